@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009 Sebastian Nowicki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Micro benchmarks for parched
+
+Run ``python benchmarks.py`` to run all benchmarks, or pass the names of
+the benchmarks to run.
+"""
+
+from __future__ import print_function
+
+import atexit
+import bz2
+import gc
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import timeit
+import tracemalloc
+from io import StringIO
+
+import parched
+
+PKGBUILD = """\
+# Maintainer: John Doe <john@doe.com>
+# Contributor: Jane Doe <jane@doe.com>
+
+pkgname=foo
+_pkgname=Foo
+pkgver=1.2.3
+pkgrel=1
+pkgdesc="A package which does foo, and sometimes bar"
+arch=('i686' 'x86_64')
+url="http://www.foo.org/"
+license=('GPL' 'MIT')
+groups=('foo-tools')
+depends=('glibc>=2.10' 'zlib' 'openssl'
+         'libfoo>=1.0')
+makedepends=('cmake' 'python')
+optdepends=('bar: for baz support'
+            'spam: for eggs support')
+provides=("$_pkgname=$pkgver")
+conflicts=('foo-git')
+backup=('etc/foo.conf' 'etc/foo.d/bar.conf')
+options=('!libtool' '!strip')
+install=foo.install
+source=("http://www.foo.org/files/$_pkgname-$pkgver.tar.gz"
+        "http://www.foo.org/files/${pkgname}_doc-$pkgver.tar.gz"
+        'foo.conf')
+md5sums=('6caefe06c7a0fc9a5e03497c7106cc56'
+         '4c593db82677c01e7fbe9febf0b95475'
+         'a4a53faa4d4a9a1c8a58a7e9c1c9f0a2')
+
+build() {
+  cd "$srcdir/$_pkgname-$pkgver"
+  ./configure --prefix=/usr --sysconfdir=/etc
+  make
+}
+
+package() {
+  cd "$srcdir/$_pkgname-$pkgver"
+  make DESTDIR="$pkgdir" install
+  install -Dm644 "$srcdir/foo.conf" "$pkgdir/etc/foo.conf"
+}
+"""
+
+PKGINFO = """\
+# Generated by makepkg 5.2.2
+# using fakeroot version 1.25.3
+pkgname = foo
+pkgbase = foo
+pkgver = 1.2.3-1
+pkgdesc = A package which does foo, and sometimes bar
+url = http://www.foo.org/
+builddate = 1600000000
+packager = John Doe <john@doe.com>
+size = 8417280
+arch = x86_64
+license = GPL
+license = MIT
+group = foo-tools
+depend = glibc>=2.10
+depend = zlib
+depend = openssl
+depend = libfoo>=1.0
+optdepend = bar: for baz support
+optdepend = spam: for eggs support
+provides = Foo=1.2.3
+conflict = foo-git
+backup = etc/foo.conf
+backup = etc/foo.d/bar.conf
+makepkgopt = strip
+makepkgopt = docs
+makepkgopt = !libtool
+"""
+
+
+def bench_pkgbuild(number=2000):
+    """Parse a typical PKGBUILD"""
+    def parse():
+        parched.PKGBUILD(fileobj=StringIO(PKGBUILD))
+    return timeit.timeit(parse, number=number) / number
+
+
+def bench_pkgbuild_fields(number=2000):
+    """Parse the name, version and dependencies of a typical PKGBUILD"""
+    def parse():
+        parched.PKGBUILD(fileobj=StringIO(PKGBUILD),
+                         fields=('name', 'version', 'release', 'depends'))
+    return timeit.timeit(parse, number=number) / number
+
+
+def bench_srcinfo(number=2000):
+    """Parse the .SRCINFO of a typical PKGBUILD"""
+    text = parched.PKGBUILD(fileobj=StringIO(PKGBUILD)).to_srcinfo()
+
+    def parse():
+        parched.SRCINFO(fileobj=StringIO(text))
+    return timeit.timeit(parse, number=number) / number
+
+
+def bench_pkgbuild_evaluate(number=2000):
+    """Evaluate a parsed PKGBUILD with overrides"""
+    script = parched.PKGBUILDScript(fileobj=StringIO(PKGBUILD))
+
+    def evaluate():
+        script.evaluate({"CARCH": "aarch64", "pkgver": "1.2.4"})
+    return timeit.timeit(evaluate, number=number) / number
+
+
+def bench_pkginfo(number=20000):
+    """Parse a typical .PKGINFO"""
+    data = PKGINFO.encode("utf-8")
+
+    class TarFile(object):
+        def extractfile(self, name):
+            return io.BytesIO(data)
+
+        def getnames(self):
+            return [".PKGINFO"]
+
+    def parse():
+        parched.PacmanPackage(tarfileobj=TarFile())
+    return timeit.timeit(parse, number=number) / number
+
+
+def bench_pkginfo_fields(number=20000):
+    """Parse the name, version and dependencies of a typical .PKGINFO"""
+    data = PKGINFO.encode("utf-8")
+
+    def parse():
+        parched.PacmanPackage(
+            pkginfo=data, fields=('name', 'version', 'release', 'depends'))
+    return timeit.timeit(parse, number=number) / number
+
+
+def bench_memory(number=2000):
+    """Memory retained per parsed package, in bytes"""
+    data = PKGINFO.encode("utf-8")
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    packages = [parched.PacmanPackage(pkginfo=data) for _ in range(number)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del packages
+    return used / number
+
+
+def bench_table_where(number=20):
+    """Filter 10000 packages by license and size"""
+    data = PKGINFO.encode("utf-8")
+    package = parched.PacmanPackage(pkginfo=data)
+    table = parched.PackageTable([package] * 10000)
+
+    def query():
+        table.where(licenses="GPL", size=lambda size: size > 100 << 20)
+    return timeit.timeit(query, number=number) / number
+
+
+def _versions(count):
+    rng = random.Random(0)
+    suffixes = ["", "", "", "rc1", "beta2", ".a"]
+    return ["%s%d.%d.%d%s-%d" % (rng.choice(["", "", "1:"]),
+                                 rng.randint(0, 9), rng.randint(0, 20),
+                                 rng.randint(0, 99), rng.choice(suffixes),
+                                 rng.randint(1, 3))
+            for _ in range(count)]
+
+
+def bench_version_sort(number=5):
+    """Sort 100000 versions with cold key caches"""
+    versions = _versions(100000)
+
+    def sort():
+        parched._version_keys.clear()
+        sorted(versions, key=parched.version_key)
+    return timeit.timeit(sort, number=number) / number
+
+
+def bench_vercmp(number=100000):
+    """Compare two versions with vercmp()"""
+    return timeit.timeit(lambda: parched.vercmp("1:2.0.1rc1-1", "1:2.0.1-2"),
+                         number=number) / number
+
+
+def bench_vercmp_binary(number=200):
+    """Compare two versions by running pacman's vercmp, if installed"""
+    def compare():
+        subprocess.check_output(["vercmp", "1:2.0.1rc1-1", "1:2.0.1-2"])
+    try:
+        compare()
+    except OSError:
+        return None
+    return timeit.timeit(compare, number=number) / number
+
+
+def _graph(count):
+    rng = random.Random(0)
+    packages = []
+    for i in range(count):
+        desc = "%%NAME%%\npkg%d\n\n%%VERSION%%\n1.0-1\n" % i
+        if i:
+            depends = set("pkg%d" % rng.randrange(i)
+                          for _ in range(rng.randint(0, 5)))
+            desc += "\n%%DEPENDS%%\n%s\n" % "\n".join(depends)
+        packages.append(parched.DatabasePackage(desc))
+    return parched.DependencyGraph(packages)
+
+
+def bench_graph_closure(number=1):
+    """Reverse closures of all of 20000 packages"""
+    graph = _graph(20000)
+    names = ["pkg%d" % i for i in range(20000)]
+
+    def closures():
+        graph._reverse_closures.clear()
+        for name in names:
+            graph._closure(graph._node(name), graph._reverse,
+                           graph._reverse_closures)
+    return timeit.timeit(closures, number=number) / number
+
+
+def bench_tree_refresh(number=5):
+    """Refresh an unchanged tree of 2000 PKGBUILDs"""
+    root = tempfile.mkdtemp()
+    try:
+        for i in range(2000):
+            os.mkdir(os.path.join(root, "pkg%d" % i))
+            with open(os.path.join(root, "pkg%d" % i, "PKGBUILD"), "w") as f:
+                f.write(PKGBUILD)
+        tree = parched.PKGBUILDTree(root)
+        tree.refresh()
+        return timeit.timeit(tree.refresh, number=number) / number
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_verify_sources(number=3):
+    """Verify md5 and sha256 sums of 4 sources of 16 MiB each"""
+    srcdir = tempfile.mkdtemp()
+    try:
+        data = os.urandom(16 << 20)
+        for i in range(4):
+            with open(os.path.join(srcdir, "src%d" % i), "wb") as f:
+                f.write(data)
+        pkgbuild = parched.PKGBUILD(fileobj=StringIO(
+            "source=(src0 src1 src2 src3)\n"
+            "md5sums=(%s)\nsha256sums=(%s)\n" % (
+                " ".join([hashlib.md5(data).hexdigest()] * 4),
+                " ".join([hashlib.sha256(data).hexdigest()] * 4))))
+
+        def verify():
+            assert all(check.ok for check in pkgbuild.verify_sources(srcdir))
+        return timeit.timeit(verify, number=number) / number
+    finally:
+        shutil.rmtree(srcdir)
+
+
+def bench_local_compare(number=5):
+    """Compare 2000 installed packages against a sync database"""
+    root = tempfile.mkdtemp()
+    try:
+        sync = []
+        for i in range(2000):
+            desc = ("%%NAME%%\npkg%d\n\n%%VERSION%%\n1.%d-1\n\n"
+                    "%%DEPENDS%%\npkg%d\nglibc>=2.0\n" % (i, i % 3, i // 2))
+            directory = os.path.join(root, "pkg%d-1.0-1" % i)
+            os.mkdir(directory)
+            with open(os.path.join(directory, "desc"), "w") as f:
+                f.write(desc)
+            sync.append(parched.DatabasePackage(desc))
+        local = parched.LocalDatabase(root)
+
+        def compare():
+            local.compare([sync])
+        return timeit.timeit(compare, number=number) / number
+    finally:
+        shutil.rmtree(root)
+
+
+def _file_index(root):
+    """Save an index of 1000 packages with 100 files each below *root*"""
+    index = parched.FileIndex(os.path.join(root, "files.idx"))
+    for i in range(1000):
+        desc = "%%NAME%%\npkg%d\n\n%%VERSION%%\n1.0-1\n" % i
+        files = ["usr/", "usr/lib/", "usr/lib/pkg%d/" % i]
+        files.extend("usr/lib/pkg%d/file%d" % (i, j) for j in range(97))
+        index.add(parched.DatabasePackage(
+            desc, "%%FILES%%\n%s\n" % "\n".join(files)))
+    index.save()
+    return index
+
+
+def bench_file_index_owners(number=20000):
+    """Look up the owners of a path in an index of 100000 paths"""
+    root = tempfile.mkdtemp()
+    try:
+        with _file_index(root) as index:
+            paths = ["usr/lib/pkg%d/file%d" % (i % 1000, i % 97)
+                     for i in range(number)]
+            start = timeit.default_timer()
+            for path in paths:
+                index.owners(path)
+            return (timeit.default_timer() - start) / number
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_file_index_basename(number=200):
+    """Find the paths with a basename shared by 1000 packages"""
+    root = tempfile.mkdtemp()
+    try:
+        with _file_index(root) as index:
+            def lookup():
+                index.with_basename("file42")
+            return timeit.timeit(lookup, number=number) / number
+    finally:
+        shutil.rmtree(root)
+
+
+def _bench_snapshot(binary, load, count=5000):
+    packages = [parched.PacmanPackage(pkginfo=PKGINFO.replace(
+        "pkgname = foo", "pkgname = foo%d" % i)) for i in range(count)]
+    output = io.BytesIO()
+    start = timeit.default_timer()
+    parched.dump_packages(packages, output, binary=binary)
+    elapsed = timeit.default_timer() - start
+    if load:
+        output.seek(0)
+        start = timeit.default_timer()
+        for package in parched.load_packages(output):
+            pass
+        elapsed = timeit.default_timer() - start
+    return elapsed / count
+
+
+def bench_snapshot_dump():
+    """Write a JSON Lines snapshot, per package"""
+    return _bench_snapshot(False, False)
+
+
+def bench_snapshot_load():
+    """Read a JSON Lines snapshot, per package"""
+    return _bench_snapshot(False, True)
+
+
+def bench_snapshot_dump_binary():
+    """Write a binary snapshot, per package"""
+    return _bench_snapshot(True, False)
+
+
+def bench_snapshot_load_binary():
+    """Read a binary snapshot, per package"""
+    return _bench_snapshot(True, True)
+
+
+_archives = {}
+
+
+def _archive(compression):
+    """Return the path of a package with 200 files, or None if the
+    compression is not supported"""
+    if not _archives:
+        rng = random.Random(0)
+        words = [("%x" % rng.getrandbits(24)).encode() for _ in range(2000)]
+        buf = io.BytesIO()
+        archive = tarfile.open(fileobj=buf, mode="w")
+        members = [(".PKGINFO", PKGINFO.encode("utf-8"))]
+        for i in range(200):
+            members.append(("usr/share/foo/%d" % i, b" ".join(
+                rng.choice(words) for _ in range(4000))))
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        archive.close()
+        data = buf.getvalue()
+        compressors = {
+            'tar': lambda data: data,
+            'gz': gzip.compress,
+            'bz2': bz2.compress,
+            'xz': lzma.compress,
+        }
+        try:
+            from compression.zstd import compress
+            compressors['zst'] = compress
+        except ImportError:
+            try:
+                import zstandard
+                compressors['zst'] = zstandard.ZstdCompressor().compress
+            except ImportError:
+                pass
+        root = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, root)
+        for name, compress in compressors.items():
+            path = os.path.join(root, "foo-1.0-1-any.pkg.tar.%s" % name)
+            with open(path, "wb") as f:
+                f.write(compress(data))
+            _archives[name] = path
+    return _archives.get(compression)
+
+
+def _bench_archive(compression, metadata_only, number):
+    path = _archive(compression)
+    if path is None:
+        return None
+
+    def parse():
+        parched.PacmanPackage(path, metadata_only=metadata_only).files
+    return timeit.timeit(parse, number=number) / number
+
+
+BENCHMARKS = [
+    ('pkgbuild', bench_pkgbuild, 1e6, 'us'),
+    ('pkgbuild_fields', bench_pkgbuild_fields, 1e6, 'us'),
+    ('srcinfo', bench_srcinfo, 1e6, 'us'),
+    ('pkgbuild_evaluate', bench_pkgbuild_evaluate, 1e6, 'us'),
+    ('pkginfo', bench_pkginfo, 1e6, 'us'),
+    ('pkginfo_fields', bench_pkginfo_fields, 1e6, 'us'),
+    ('memory', bench_memory, 1, 'bytes/package'),
+    ('table_where', bench_table_where, 1e3, 'ms'),
+    ('version_sort', bench_version_sort, 1e3, 'ms'),
+    ('vercmp', bench_vercmp, 1e6, 'us'),
+    ('vercmp_binary', bench_vercmp_binary, 1e6, 'us'),
+    ('graph_closure', bench_graph_closure, 1e3, 'ms'),
+    ('tree_refresh', bench_tree_refresh, 1e3, 'ms'),
+    ('verify_sources', bench_verify_sources, 1e3, 'ms'),
+    ('local_compare', bench_local_compare, 1e3, 'ms'),
+    ('file_index_owners', bench_file_index_owners, 1e6, 'us'),
+    ('file_index_basename', bench_file_index_basename, 1e3, 'ms'),
+    ('snapshot_dump', bench_snapshot_dump, 1e6, 'us'),
+    ('snapshot_load', bench_snapshot_load, 1e6, 'us'),
+    ('snapshot_dump_binary', bench_snapshot_dump_binary, 1e6, 'us'),
+    ('snapshot_load_binary', bench_snapshot_load_binary, 1e6, 'us'),
+]
+
+for _compression in ('tar', 'gz', 'bz2', 'xz', 'zst'):
+    BENCHMARKS.append((
+        'package_%s' % _compression,
+        lambda compression=_compression: _bench_archive(compression, False, 5),
+        1e3, 'ms'))
+    BENCHMARKS.append((
+        'package_%s_metadata' % _compression,
+        lambda compression=_compression: _bench_archive(compression, True, 50),
+        1e3, 'ms'))
+
+
+def main(names):
+    for name, benchmark, scale, unit in BENCHMARKS:
+        if names and name not in names:
+            continue
+        result = benchmark()
+        if result is None:
+            print("%-20s %10s" % (name, "skipped"))
+        else:
+            print("%-20s %10.1f %s" % (name, result * scale, unit))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -27,12 +27,65 @@ classes iniherit from the :class:`Package` class, which provides the basic
 metadata about package.
 """
 
+import bisect
+import calendar
+import codecs
+import errno
+import hashlib
+import heapq
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import struct
+import sys
 import tarfile
+from array import array
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
+from itertools import chain, groupby
 import re
-import shlex
+import zlib
+from collections import namedtuple, OrderedDict
 
-__all__ = ['Package', 'PacmanPackage', 'PKGBUILD']
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+try:
+    from sys import intern
+except ImportError:
+    # Python 2 has intern() as a builtin
+    pass
+
+# zstd support, from the standard library as of Python 3.14, or the
+# zstandard module
+try:
+    from compression import zstd as _zstd
+except ImportError:
+    _zstd = None
+try:
+    import zstandard as _zstandard
+except ImportError:
+    _zstandard = None
+
+__all__ = ['Package', 'FileList', 'FileInfo', 'PacmanPackage', 'PKGBUILD',
+           'DatabasePackage', 'RepoDatabase', 'iter_packages', 'parse_many',
+           'ParseResult', 'MetadataCache', 'PackageTable', 'Dependency',
+           'parse_dependency', 'DependencyIndex', 'vercmp', 'version_key',
+           'DependencyGraph', 'BuildOrder', 'BuildQueue', 'PKGBUILDTree',
+           'TreeChanges', 'PKGBUILDScript', 'SourceCheck', 'LocalPackage',
+           'LocalDatabase', 'DatabaseComparison', 'FileIndex',
+           'dump_packages', 'load_packages', 'SRCINFO']
 
 class Package(object):
     """An abstract package class
@@ -107,7 +160,41 @@ class Package(object):
 
     For more information about these attributes see :manpage:`PKGBUILD(5)`.
 
+    Lists are stored as tuples. Packages use :data:`__slots__`, and values
+    which recur across many packages (dependencies, licenses, architectures,
+    groups, ...) are interned, so large numbers of packages can be held in
+    memory cheaply.
+
+    Packages can be pickled. State only needed while parsing is left out,
+    which keeps pickles small when packages are passed between processes.
+    For snapshots which should outlive the current version of this module,
+    :meth:`to_dict` and :meth:`from_dict` convert packages to and from
+    plain dictionaries, and :func:`dump_packages` writes many packages at
+    once.
+
     """
+    __slots__ = (
+        'name',
+        'version',
+        'release',
+        'description',
+        'url',
+        'licenses',
+        'groups',
+        'provides',
+        'depends',
+        'optdepends',
+        'conflicts',
+        'replaces',
+        'architectures',
+        'options',
+        'backup',
+    )
+    # Attributes not needed after parsing, which are dropped when pickling
+    _transient = ()
+    # Public attributes which are properties over private state
+    _properties = ()
+
     def __init__(self, pkgfile):
         super(Package, self).__init__()
         self.name = ""
@@ -115,16 +202,229 @@ class Package(object):
         self.release = ""
         self.description = ""
         self.url = ""
-        self.licenses = []
-        self.groups = []
-        self.provides = []
-        self.depends = []
-        self.optdepends = []
-        self.conflicts = []
-        self.replaces = []
-        self.architectures = []
-        self.options = []
-        self.backup = []
+        self.licenses = ()
+        self.groups = ()
+        self.provides = ()
+        self.depends = ()
+        self.optdepends = ()
+        self.conflicts = ()
+        self.replaces = ()
+        self.architectures = ()
+        self.options = ()
+        self.backup = ()
+
+    def __getstate__(self):
+        state = {}
+        for name in _slot_names(type(self)):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        state.update(getattr(self, '__dict__', ()))
+        for name in self._transient:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def to_dict(self):
+        """Return the attributes of the package as a dictionary
+
+        Values are converted to types which JSON can represent: lists for
+        tuples and :class:`FileList` objects, and UNIX timestamps for
+        :class:`datetime` objects. Attributes whose name starts with an
+        underscore are left out. The class of the package is stored under
+        ``'type'``.
+
+        """
+        data = {'type': type(self).__name__}
+        for name, value in self.__getstate__().items():
+            if name[0] != '_':
+                data[name] = _dict_value(value)
+        for name in self._properties:
+            data[name] = _dict_value(getattr(self, name))
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a package from a dictionary returned by :meth:`to_dict`
+
+        The package is of the class named by ``data['type']``, which has to
+        be *cls* or a subclass of it. Attributes missing from *data* keep
+        their defaults, and unknown attributes are ignored, so dictionaries
+        written by other versions of this module can be read.
+
+        """
+        return _package_from_dict(data, _dict_tuple, cls)
+
+
+def _package_from_dict(data, to_tuple, base=Package):
+    """Create a package from *data*, converting lists with *to_tuple*"""
+    try:
+        package_class, empty = _package_types[data['type']]
+    except KeyError:
+        raise ValueError("unknown package type: %r" % data.get('type'))
+    if not issubclass(package_class, base):
+        raise ValueError("%s is not a %s" % (data['type'], base.__name__))
+    defaults = _package_defaults.get(package_class)
+    if defaults is None:
+        defaults = _package_defaults[package_class] = empty().__getstate__()
+    package = package_class.__new__(package_class)
+    for name, value in defaults.items():
+        if name[0] == '_' or name not in data:
+            if isinstance(value, (dict, list)):
+                value = type(value)(value)
+            setattr(package, name, value)
+    decoders = _dict_decoders
+    for name, value in data.items():
+        if name[0] == '_' or name == 'type':
+            continue
+        if name in decoders:
+            value = decoders[name](value)
+        elif value.__class__ is list:
+            value = to_tuple(value)
+        try:
+            setattr(package, name, value)
+        except AttributeError:
+            # Attributes of newer versions
+            pass
+    return package
+
+
+_slot_names_cache = {}
+
+
+def _slot_names(cls):
+    """Return the names of all slots of *cls* and its base classes"""
+    try:
+        return _slot_names_cache[cls]
+    except KeyError:
+        pass
+    names = []
+    for base in reversed(cls.__mro__):
+        slots = base.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(name for name in slots if name != '__dict__')
+    _slot_names_cache[cls] = frozenset(names)
+    return _slot_names_cache[cls]
+
+
+def _intern_all(values):
+    """Return *values* as a tuple of interned strings"""
+    return tuple([intern(value) for value in values])
+
+
+def _dict_value(value):
+    """Convert *value* to the types used by :meth:`Package.to_dict`"""
+    if isinstance(value, (tuple, list)):
+        # The items of a list are all of the same type
+        if value and isinstance(value[0], _dict_converted):
+            return [_dict_value(item) for item in value]
+        return list(value)
+    if isinstance(value, FileList):
+        return list(value)
+    if isinstance(value, dict):
+        return dict((key, _dict_value(item)) for key, item in value.items())
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    return value
+
+
+def _dict_tuple(values):
+    """Convert a list of :meth:`Package.to_dict` to an attribute value"""
+    try:
+        return _intern_all(values)
+    except TypeError:
+        return tuple(values)
+
+
+# Values which _dict_value() converts
+_dict_converted = (tuple, list, dict, datetime)
+
+
+class FileList(Sequence):
+    """A compact, read-only sequence of file names
+
+    Packages can contain hundreds of thousands of files. Rather than keeping
+    a string object per file, :class:`FileList` stores all names in a single
+    string, separated by NUL characters (which cannot occur in a path), and
+    an array of offsets into it. Strings are only created for the items that
+    are actually accessed.
+
+    Besides the usual sequence operations, a :class:`FileList` can be
+    compared to a list or tuple of names, and supports prefix lookups::
+
+        >>> files = FileList(["usr/", "usr/bin/", "usr/bin/foo"])
+        >>> "usr/bin/foo" in files
+        True
+        >>> list(files.with_prefix("usr/bin/"))
+        ['usr/bin/', 'usr/bin/foo']
+
+    """
+    __slots__ = ('_blob', '_offsets')
+
+    def __init__(self, names=()):
+        names = list(names)
+        self._offsets = array('L', [1])
+        if not names:
+            self._blob = "\0"
+            return
+        position = 1
+        for name in names:
+            position += len(name) + 1
+            self._offsets.append(position)
+        self._blob = "\0%s\0" % "\0".join(names)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("FileList index out of range")
+        return self._blob[self._offsets[index]:self._offsets[index + 1] - 1]
+
+    def __iter__(self):
+        # Splitting in one go is cheaper than slicing each item
+        if len(self):
+            for name in self._blob[1:-1].split("\0"):
+                yield name
+
+    def __contains__(self, name):
+        return "\0%s\0" % name in self._blob
+
+    def __eq__(self, other):
+        if isinstance(other, FileList):
+            return self._blob == other._blob
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "FileList(%r)" % list(self)
+
+    def with_prefix(self, prefix):
+        """Iterate over the names starting with *prefix*"""
+        needle = "\0" + prefix
+        position = self._blob.find(needle)
+        while position >= 0:
+            index = bisect.bisect_right(self._offsets, position + 1) - 1
+            if index >= len(self):
+                break
+            yield self[index]
+            position = self._blob.find(needle, self._offsets[index + 1] - 1)
 
 
 class PacmanPackage(Package):
@@ -155,6 +455,39 @@ class PacmanPackage(Package):
 
         *tarfileobj* is not closed.
 
+    If *metadata_only* is true, the archive is only read up to and
+    including the `.PKGINFO` member. Decompression stops there, so the cost
+    of parsing no longer depends on the size of the package payload.
+    :attr:`files` is ``None`` in this mode::
+
+        >>> package = PacmanPackage("foo-1.0-1-any.tar.gz", metadata_only=True)
+
+    If *mtree* is true, :attr:`files` and :attr:`file_info` are read from
+    the `.MTREE` member instead. `.MTREE` is a small, compressed manifest
+    stored at the beginning of packages built by recent versions of
+    :manpage:`makepkg(8)`, so the complete file list is available without
+    decompressing the payload. Packages without `.MTREE` fall back to
+    walking the archive. Note that `.MTREE` does not list itself::
+
+        >>> package = PacmanPackage("foo-1.0-1-any.tar.gz", mtree=True)
+        >>> package.file_info["usr/bin/foo"].size
+        4096
+
+    If the contents of the `.PKGINFO` file are already in memory, they can
+    be passed as *pkginfo* instead, as a string, :class:`bytes`, or any
+    other object supporting the buffer protocol, such as :class:`memoryview`
+    or :class:`mmap`. Buffers are decoded without being copied first::
+
+        >>> package = PacmanPackage(pkginfo=data)
+
+    If *fields* is given, only these attributes are read from `.PKGINFO`,
+    and the others keep their empty defaults. The archive is read as with
+    *metadata_only*, unless *fields* includes ``'files'``, or
+    ``'file_info'``, which implies *mtree*::
+
+        >>> package = PacmanPackage("foo-1.0-1-any.tar.gz",
+        ...                         fields=('name', 'version', 'depends'))
+
     The packages metadata can then be accessed directly::
     
         >>> print package
@@ -179,296 +512,4272 @@ class PacmanPackage(Package):
     .. attribute:: is_force
 
         Indicates whether an upgrade is forced
+
+    .. attribute:: base
+
+        The name of the PKGBUILD the package was built from.
+
+    .. attribute:: makedepends
+
+        A list of compile-time dependencies.
+
+    .. attribute:: checkdepends
+
+        A list of dependencies needed to run the package's test suite.
     
     .. attribute:: files
     
-        An array of files contained in the package
+        A :class:`FileList` of files contained in the package, or ``None``
+        if the package was opened with *metadata_only*. When the package is
+        opened by file name the list is only read from the archive on first
+        access.
+
+    .. attribute:: file_info
+
+        A dictionary mapping the paths in :attr:`files` to
+        :class:`FileInfo` tuples, or ``None`` unless the file list was read
+        from `.MTREE`.
 
     """
-    def __init__(self, name=None, tarfileobj=None):
+    __slots__ = (
+        'base',
+        'builddate',
+        'packager',
+        'is_forced',
+        'size',
+        'makedepends',
+        'checkdepends',
+        'file_info',
+        '_files',
+        '_path',
+        '_directories',
+    )
+    # .PKGINFO keys which are stored under a different attribute name
+    _symbol_map = {
+        'pkgbase': 'base',
+        'pkgname': 'name',
+        'pkgver': 'version',
+        'pkgdesc': 'description',
+        'license': 'licenses',
+        'arch': 'architectures',
+        'force': 'is_forced',
+        'conflict': 'conflicts',
+        'group': 'groups',
+        'optdepend': 'optdepends',
+        'makepkgopt': 'options',
+        'depend': 'depends',
+        'makedepend': 'makedepends',
+        'checkdepend': 'checkdepends',
+    }
+    # .PKGINFO keys by attribute name
+    _attribute_keys = dict((attribute, key)
+                           for key, attribute in _symbol_map.items())
+    _attribute_keys['release'] = 'pkgver'
+    # .PKGINFO keys which may be repeated to form a list
+    _arrays = frozenset((
+        'arch',
+        'license',
+        'replaces',
+        'group',
+        'depend',
+        'optdepend',
+        'conflict',
+        'provides',
+        'backup',
+        'makepkgopt',
+        'makedepend',
+        'checkdepend',
+    ))
+    # Conversions of .PKGINFO values, keyed by attribute name
+    _converters = {
+        'size': int,
+        'builddate': lambda value: datetime.utcfromtimestamp(int(value)),
+        'is_forced': lambda value: value == "True",
+        'packager': lambda value: (None if value in _unknown_packagers
+                                   else intern(value)),
+        'backup': tuple,
+    }
+
+    _properties = ('files',)
+
+    def __init__(self, name=None, tarfileobj=None, metadata_only=False,
+                 mtree=False, pkginfo=None, fields=None):
         super(PacmanPackage, self).__init__(tarfileobj)
+        self.base = ""
         self.builddate = ""
         self.packager = ""
-        self.is_forced = ""
+        self.is_forced = False
         self.size = 0
-        self.files = []
-        self._symbol_map = {
-            'pkgname': 'name',
-            'pkgver': 'version',
-            'pkgdesc': 'description',
-            'license': 'licenses',
-            'arch': 'architectures',
-            'force': 'is_forced',
-            'conflict': 'conflicts',
-            'group': 'groups',
-            'optdepend': 'optdepends',
-            'makepkgopt': 'options',
-            'depend': 'depends',
-        }
-        self._arrays = (
-            'arch',
-            'license',
-            'replaces',
-            'group',
-            'depend',
-            'optdepend',
-            'conflict',
-            'provides',
-            'backup',
-            'makepkgopt',
-        )
+        self.makedepends = ()
+        self.checkdepends = ()
+        self._files = None
+        self._path = None
+        # The archive members in files which are directories, if known
+        self._directories = None
+        self.file_info = None
+        if fields is not None:
+            fields = frozenset(fields)
+            if 'file_info' in fields:
+                mtree = True
+            elif 'files' not in fields:
+                metadata_only = True
+        if pkginfo is not None:
+            self._parse(pkginfo, fields)
+            return
         if not name and not tarfileobj:
             raise ValueError("nothing to open")
         should_close = False
         if not tarfileobj:
-            tarfileobj = tarfile.open(str(name), "r|*")
+            tarfileobj = _open_tarfile(name)
             should_close = True
-        pkginfo = tarfileobj.extractfile(".PKGINFO")
-        self.files = tarfileobj.getnames()
-        self._parse(pkginfo)
-        if should_close:
-            tarfileobj.close()
+            # The file list is read from the archive on first access, so
+            # stop right after .PKGINFO for now.
+            if not (metadata_only or mtree):
+                self._path = name
+                metadata_only = True
+        try:
+            if hasattr(tarfileobj, "next"):
+                pkginfo = self._scan(tarfileobj, metadata_only, mtree)
+            else:
+                pkginfo = tarfileobj.extractfile(".PKGINFO")
+                names = tarfileobj.getnames()
+                if metadata_only:
+                    pass
+                elif mtree and ".MTREE" in names:
+                    self._read_mtree(tarfileobj.extractfile(".MTREE").read())
+                else:
+                    self.files = FileList(names)
+            self._parse(pkginfo, fields)
+        finally:
+            if should_close:
+                tarfileobj.close()
 
     def __str__(self):
         return '%s %s-%s' % (self.name, self.version, self.release)
 
-    def _parse(self, pkginfo):
-        """Parse the .PKGINFO file"""
-        if hasattr(pkginfo, "seek"):
-            pkginfo.seek(0)
-        for line in pkginfo:
-            if line[0] == '#' or line.strip() == '':
+    @property
+    def files(self):
+        if self._files is None and self._path is not None:
+            archive = _open_tarfile(self._path)
+            try:
+                members = list(archive)
+            finally:
+                archive.close()
+            self._files = FileList(member.name for member in members)
+            self._directories = frozenset(member.name for member in members
+                                          if member.isdir())
+            self._path = None
+        return self._files
+
+    @files.setter
+    def files(self, value):
+        self._files = value
+
+    def _scan(self, tarfileobj, metadata_only, mtree=False):
+        """Walk the members of a :class:`TarFile` in archive order
+
+        Member names are collected into :attr:`files` along the way. With
+        *metadata_only* the walk stops as soon as `.PKGINFO` has been read,
+        and with *mtree* as soon as both `.PKGINFO` and `.MTREE` have been
+        read, leaving the rest of the archive undecompressed. The contents
+        of the `.PKGINFO` member are returned.
+
+        """
+        mtree = mtree and not metadata_only
+        pkginfo = None
+        manifest = None
+        names = []
+        directories = []
+        for member in tarfileobj:
+            names.append(member.name)
+            if member.isdir():
+                directories.append(member.name)
+            # In stream mode a member has to be read before the archive
+            # moves on to the next header.
+            if member.name == ".PKGINFO":
+                pkginfo = tarfileobj.extractfile(member).read()
+            elif member.name == ".MTREE" and mtree:
+                manifest = tarfileobj.extractfile(member).read()
+            else:
+                continue
+            if pkginfo is None:
+                continue
+            if metadata_only or manifest is not None:
+                break
+        if pkginfo is None:
+            raise KeyError("filename '.PKGINFO' not found")
+        if manifest is not None:
+            self._read_mtree(manifest)
+        elif not metadata_only:
+            self.files = FileList(names)
+            self._directories = frozenset(directories)
+        return pkginfo
+
+    def _read_mtree(self, data):
+        """Populate :attr:`files` and :attr:`file_info` from `.MTREE`"""
+        self.file_info = _parse_mtree(data)
+        self.files = FileList(self.file_info)
+
+    def _parse(self, pkginfo, fields=None):
+        """Parse the .PKGINFO file
+
+        *pkginfo* is either a file like object, or the contents of the
+        file as a string, :class:`bytes`, or any other object supporting
+        the buffer protocol, such as :class:`memoryview` or :class:`mmap`.
+        The contents are decoded once and split into lines in one go.
+        If *fields* is given, only the keys for these attributes are read.
+
+        """
+        if hasattr(pkginfo, "read"):
+            if hasattr(pkginfo, "seek"):
+                pkginfo.seek(0)
+            pkginfo = pkginfo.read()
+        if not isinstance(pkginfo, str):
+            pkginfo = codecs.decode(pkginfo, "utf-8")
+        symbol_map = self._symbol_map
+        arrays = self._arrays
+        keys = None
+        if fields is not None:
+            keys = frozenset(self._attribute_keys.get(field, field)
+                             for field in fields)
+        values = {}
+        for line in pkginfo.splitlines():
+            var, separator, value = line.partition(' = ')
+            if not separator or var[:1] in ('', '#'):
+                continue
+            if keys is not None and var not in keys:
                 continue
-            var, _, value = line.strip().rpartition(' = ')
-            real_name = var
-            if var in self._symbol_map:
-                real_name = self._symbol_map[var]
-            if var in self._arrays:
-                array = getattr(self, real_name)
-                array.append(value)
+            if var in arrays:
+                if var in values:
+                    values[var].append(value)
+                else:
+                    values[var] = [value]
             else:
-                setattr(self, real_name, value)
-        if self.size:
-            self.size = int(self.size)
-        if not self.is_forced == False:
-            self.is_forced = self.is_forced == "True"
-        if self.builddate:
-            self.builddate = datetime.utcfromtimestamp(int(self.builddate))
+                values[var] = value
+        converters = self._converters
+        slots = _slot_names(type(self))
+        for var, value in values.items():
+            name = symbol_map.get(var, var)
+            if name in converters:
+                value = converters[name](value)
+            elif var in arrays:
+                value = _intern_all(value)
+            elif name not in slots:
+                # Keys introduced by newer versions of makepkg
+                continue
+            setattr(self, name, value)
         if self.version:
             self.version, _, self.release = self.version.rpartition('-')
-            self.release = int(self.release)
-        if self.packager == 'Uknown Packager':
-            self.packager = None
+            self.release = _parse_release(self.release)
 
 
-class PKGBUILD(Package):
-    """A :manpage:`PKGBUILD(5)` parser
+_unknown_packagers = frozenset(('Unknown Packager', 'Uknown Packager'))
 
-    The :class:`PKGBUILD` class provides information about a
-    package by parsing a :manpage:`PKGBUILD(5)` file.
 
-    To instantiate a :class:`PacmanPackage` object, pass the package's file
-    path in the constructor::
+FileInfo = namedtuple('FileInfo', 'type mode size sha256 link')
+FileInfo.__doc__ = """Metadata about a file in a package, as listed in `.MTREE`
 
-        >>> import parched
-        >>> package = PKGBUILD("PKGBUILD")
+*type* is one of ``'file'``, ``'dir'`` or ``'link'``, *mode* the
+permission bits as an integer and *size* the size in bytes. *sha256* is
+the hex digest of regular files and *link* the target of symbolic links;
+both are ``None`` otherwise.
+"""
 
-    If *fileobj* is specified, it is used as an alternative to a
-    :class:`file` like object opened for *name*. It is supposed to be
-    at position 0. For example::
 
-        >>> f = open("PKGBUILD", "r")
-        >>> package = PKGBUILD(fileobj=f)
-        >>> f.close()
+_mtree_escape_regex = re.compile(r"\\([0-7]{3})")
 
-    .. note::
 
-        *fileobj* is not closed.
+def _mtree_unescape(path):
+    """Decode the octal escapes used for special characters in mtree paths"""
+    if "\\" not in path:
+        return path
+    path = _mtree_escape_regex.sub(lambda m: chr(int(m.group(1), 8)), path)
+    return path.encode("latin-1").decode("utf-8")
 
-    The packages metadata can then be accessed directly::
 
-        >>> print package
-        "foo 1.0-1"
-        >>> print package.description
-        "Example package"
+def _parse_mtree(data):
+    """Parse an (optionally gzip compressed) mtree manifest
 
-    In addition to the attributes provided by :class:`Package`,
-    :class:`PKGBUILD` provides the following attributes:
+    Returns an ordered dictionary mapping paths, relative to the package
+    root, to :class:`FileInfo` tuples.
 
-    .. attribute:: install
+    """
+    if data[:2] == b"\x1f\x8b":
+        data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    defaults = {}
+    entries = OrderedDict()
+    for line in data.decode("latin-1").replace("\\\n", "").splitlines():
+        words = line.split()
+        if not words or words[0].startswith("#"):
+            continue
+        keywords = dict(word.partition("=")[::2] for word in words[1:])
+        if words[0] == "/set":
+            defaults.update(keywords)
+            continue
+        elif words[0] == "/unset":
+            if "all" in keywords:
+                defaults.clear()
+            for key in keywords:
+                defaults.pop(key, None)
+            continue
+        path = _mtree_unescape(words[0])
+        if path.startswith("./"):
+            path = path[2:]
+        elif path == ".":
+            continue
+        for key in defaults:
+            keywords.setdefault(key, defaults[key])
+        entries[path] = FileInfo(
+            keywords.get("type", "file"),
+            int(keywords.get("mode", "0"), 8),
+            int(keywords.get("size", "0")),
+            keywords.get("sha256digest"),
+            keywords.get("link"),
+        )
+    return entries
 
-        The filename of the install scriptlet.
 
-    .. attribute:: checksums
+class _TarFile(tarfile.TarFile):
+    """A :class:`tarfile.TarFile` which also closes the files it reads from
 
-        A dictionary containing the checksums of files in the
-        :attr:`sources` list. The dictionary's keys are the algorithms
-        used, and can be any of 'md5', 'sha1', 'sha256', 'sha384', and
-        'sha512'. The value is a list of checksums. The elements
-        correspond to files in the :attr:`sources` list, in relation to
-        their position.
+    In stream mode, :func:`tarfile.open` leaves a file object passed as
+    *fileobj* open, so the files opened by :func:`_open_tarfile` are
+    closed along with the archive.
 
-    .. attribute:: sources
+    """
+    _sources = ()
 
-        A list containing the URIs of filenames. Local file paths can be
-        relative and do not require a protocol prefix.
+    def close(self):
+        try:
+            super(_TarFile, self).close()
+        finally:
+            for source in self._sources:
+                source.close()
 
-    .. attribute:: makedepends
 
-        A list of compile-time dependencies.
+# Compression formats by the magic bytes at the start of the file
+_magic_numbers = (
+    (b"\x1f\x8b", "gz"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zst"),
+)
 
-    .. attribute:: noextract
+# Size of the reads from zstd archives. tarfile's own reads are left at
+# their default size, as its stream buffer slows down with larger ones.
+_archive_read_size = 1 << 16
 
-        A list of files not to be extracted. These files correspond to
-        the basenames of the URIs in :attr:`sources`
 
-    """
-    _symbol_regex = re.compile(r"\$(?P<name>{[\w\d_]+}|[\w\d]+)")
+def _zstd_reader(fileobj):
+    """Return a file object decompressing the zstd stream *fileobj*"""
+    if _zstd is not None:
+        return _zstd.ZstdFile(fileobj)
+    if _zstandard is not None:
+        return _zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_size=_archive_read_size, read_across_frames=True)
+    raise tarfile.CompressionError(
+        "zstd archives require Python 3.14 or the zstandard module")
 
-    def __init__(self, name=None, fileobj=None):
-        super(PKGBUILD, self).__init__(fileobj)
-        self.install = ""
-        self.checksums = {
-            'md5': [],
-            'sha1': [],
-            'sha256': [],
-            'sha384': [],
-            'sha512': [],
-        }
-        self.noextract = []
-        self.sources = []
-        self.makedepends = []
-
-        # Symbol lookup table
-        self._var_map = {
-            'pkgname': 'name',
-            'pkgver': 'version',
-            'pkgdesc': 'description',
-            'pkgrel': 'release',
-            'source': 'sources',
-            'arch': 'architectures',
-            'license': 'licenses',
-        }
-        self._checksum_fields = (
-            'md5sums',
-            'sha1sums',
-            'sha256sums',
-            'sha384sums',
-            'sha512sums',
-        )
-        # Symbol table
-        self._symbols = {}
 
-        if not name and not fileobj:
-            raise ValueError("nothing to open")
-        should_close = False
-        if not fileobj:
-            fileobj = open(name, "r")
-            should_close = True
-        self._parse(fileobj)
-        if should_close:
-            fileobj.close()
-
-    def _handle_assign(self, token):
-        var, equals, value = token.strip().partition('=')
-        # Is it an array?
-        if value[0] == '(' and value[-1] == ')':
-            self._symbols[var] = self._clean_array(value)
+def _open_tarfile(name):
+    """Open the archive *name* for a single sequential pass
+
+    The compression format is detected from the first bytes of the file
+    rather than its name. gzip, bzip2 and xz archives are decompressed by
+    :mod:`tarfile` itself. zstd archives, as created by current versions
+    of :manpage:`makepkg(8)`, are decompressed with :mod:`compression.zstd`
+    where available (Python 3.14), or the :mod:`zstandard` module
+    otherwise.
+
+    """
+    fileobj = open(str(name), "rb")
+    try:
+        magic = fileobj.read(6)
+        fileobj.seek(0)
+        for prefix, compression in _magic_numbers:
+            if magic.startswith(prefix):
+                break
+        else:
+            compression = ""
+        sources = (fileobj,)
+        if compression == "zst":
+            reader = _zstd_reader(fileobj)
+            sources = (reader, fileobj)
+            archive = _TarFile.open(fileobj=reader, mode="r|")
         else:
-            self._symbols[var] = self._clean(value)
-
-    def _parse(self, fileobj):
-        """Parse PKGBUILD"""
-        if hasattr(fileobj, "seek"):
-            fileobj.seek(0)
-        parser = shlex.shlex(fileobj, posix=True)
-        parser.whitespace_split = True
-        in_function = False
-        while 1:
-            token = parser.get_token()
-            if token is None or token == '':
+            archive = _TarFile.open(fileobj=fileobj, mode="r|" + compression)
+    except Exception:
+        fileobj.close()
+        raise
+    archive._sources = sources
+    return archive
+
+
+_Assignment = namedtuple('_Assignment', 'name value append')
+_Function = namedtuple('_Function', 'name body')
+_Command = namedtuple('_Command', 'text')
+
+
+class _PKGBUILDScanner(object):
+    """A single pass scanner for the top level of a PKGBUILD
+
+    The scanner understands just enough shell syntax to split a PKGBUILD
+    into statements: variable assignments, function definitions, whose
+    bodies are kept as source text, and other commands, which are kept as
+    source text as well. Quotes are removed from values while scanning.
+    Characters which must not be expanded later on (``$`` in single quotes
+    or escaped with a backslash) are escaped with a backslash, as are
+    literal backslashes; :meth:`PKGBUILD._substitute` removes the escapes.
+
+    """
+    # Runs of characters with no special meaning
+    _plain_regex = re.compile(r"""[^\s;&|<>()'"\\$`]+""")
+    _dquoted_regex = re.compile(r'[^"\\$`]+')
+    # Blanks, line continuations and comments within a statement
+    _blank_regex = re.compile(r"(?:[ \t\r]+|\\\n|#[^\n]*)+")
+    # Anything that separates statements as well
+    _separator_regex = re.compile(r"(?:[\s;&|]+|\\\n|#[^\n]*)+")
+    _assignment_regex = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)(\+?=)")
+    _function_regex = re.compile(r"[ \t]*\([ \t]*\)")
+    # Reserved words followed by another statement
+    _reserved = frozenset(('if', 'then', 'elif', 'else', 'fi', 'do', 'done',
+                           'while', 'until', '{', '}', '!'))
+    _word_end = frozenset(' \t\r\n;&|<>()')
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def statements(self):
+        """Yield a node for every top level statement
+
+        Assignments yield an :class:`_Assignment`, whose *value* is a string,
+        or a list of strings for arrays, and whose *append* is true for
+        ``+=`` assignments. Function definitions yield a :class:`_Function`
+        and anything else a :class:`_Command`.
+
+        """
+        text = self.text
+        length = len(text)
+        while True:
+            self._skip(self._separator_regex)
+            if self.pos >= length:
+                return
+            match = self._assignment_regex.match(text, self.pos)
+            if match:
+                self.pos = match.end()
+                if text.startswith('(', self.pos):
+                    self.pos += 1
+                    value = self._read_array()
+                else:
+                    value = self._read_word()
+                yield _Assignment(match.group(1), value,
+                                  match.group(2) == '+=')
+                continue
+            start = self.pos
+            word = self._read_word()
+            if word == 'function':
+                self._skip(self._blank_regex)
+                word = self._read_word()
+                self._skip(self._function_regex)
+                yield _Function(word, self._read_function())
+            elif self._function_regex.match(text, self.pos):
+                self._skip(self._function_regex)
+                yield _Function(word, self._read_function())
+            else:
+                if word not in self._reserved:
+                    self._skip_statement()
+                if self.pos == start:
+                    # A stray operator such as ")"
+                    self.pos += 1
+                yield _Command(text[start:self.pos])
+
+    def _skip(self, regex):
+        match = regex.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+
+    def _read_word(self):
+        """Read a word, removing quotes"""
+        text = self.text
+        length = len(text)
+        pos = self.pos
+        parts = []
+        while pos < length:
+            char = text[pos]
+            if char in self._word_end:
                 break
-            # Skip escaped newlines and functions
-            if token == '\n' or in_function:
+            match = self._plain_regex.match(text, pos)
+            if match:
+                parts.append(match.group())
+                pos = match.end()
+            elif char == "'":
+                end = text.find("'", pos + 1)
+                if end < 0:
+                    end = length
+                parts.append(_escape(text[pos + 1:end]))
+                pos = end + 1
+            elif char == '"':
+                pos = self._read_double_quoted(pos + 1, parts)
+            elif char == '\\':
+                if not text.startswith('\n', pos + 1):
+                    parts.append(_escape(text[pos + 1:pos + 2]))
+                pos += 2
+            else:
+                end = self._expansion_end(pos)
+                parts.append(text[pos:end])
+                pos = end
+        self.pos = min(pos, length)
+        return "".join(parts)
+
+    def _read_double_quoted(self, pos, parts):
+        """Read a double quoted string starting at *pos* into *parts*"""
+        text = self.text
+        length = len(text)
+        while pos < length:
+            match = self._dquoted_regex.match(text, pos)
+            if match:
+                parts.append(match.group())
+                pos = match.end()
                 continue
-            # Special case:
-            # Array elements are dispersed among tokens, we have to join
-            # them first
-            if token.find("=(") >= 0 and not token.rfind(")") >= 0:
-                in_array = True
-                elements = []
-                while in_array:
-                    _token = parser.get_token()
-                    if _token == '\n':
-                        continue
-                    if _token[-1] == ')':
-                        _token = '"%s")' % _token.strip(')')
-                        token = token.replace('=(', '=("', 1) + '"'
-                        token = " ".join((token, " ".join(elements), _token))
-                        in_array = False
-                    else:
-                        elements.append('"%s"' % _token.strip())
-            # Assignment
-            if re.match(r"^[\w\d_]+=", token):
-                self._handle_assign(token)
-            # Function definitions
-            elif token == '{':
-                in_function = True
-            elif token == '}' and in_function:
-                in_function = False
-        self._substitute()
-        self._assign_local()
-        if self.release:
-            self.release = float(self.release)
+            char = text[pos]
+            if char == '"':
+                return pos + 1
+            elif char == '\\':
+                escaped = text[pos + 1:pos + 2]
+                if escaped in ('$', '`', '"', '\\'):
+                    parts.append(_escape(escaped))
+                elif escaped != '\n':
+                    parts.append('\\\\' + escaped)
+                pos += 2
+            else:
+                end = self._expansion_end(pos)
+                parts.append(text[pos:end])
+                pos = end
+        return pos
+
+    def _expansion_end(self, pos):
+        """Find the end of the expansion (``$...`` or backticks) at *pos*"""
+        text = self.text
+        if text[pos] == '`':
+            end = text.find('`', pos + 1)
+            return len(text) if end < 0 else end + 1
+        following = text[pos + 1:pos + 2]
+        if following == '{':
+            return _matching(text, pos + 1, '{', '}')
+        elif following == '(':
+            return _matching(text, pos + 1, '(', ')')
+        return pos + 1
+
+    def _read_array(self):
+        """Read the elements of an array up to the closing parenthesis"""
+        text = self.text
+        length = len(text)
+        elements = []
+        while True:
+            self._skip(self._separator_regex)
+            if self.pos >= length:
+                break
+            if text[self.pos] == ')':
+                self.pos += 1
+                break
+            start = self.pos
+            element = self._read_word()
+            if self.pos == start:
+                self.pos += 1
+            else:
+                elements.append(element)
+        return elements
+
+    def _skip_statement(self):
+        """Skip the words up to the end of the current statement"""
+        text = self.text
+        length = len(text)
+        while self.pos < length:
+            self._skip(self._blank_regex)
+            if self.pos >= length or text[self.pos] in '\n;&|':
+                return
+            start = self.pos
+            self._read_word()
+            if self.pos == start:
+                self.pos += 1
+
+    def _read_function(self):
+        """Read a function body enclosed in braces, without the braces"""
+        self._skip(self._separator_regex)
+        if not self.text.startswith('{', self.pos):
+            return ""
+        start = self.pos
+        self.pos = _matching(self.text, self.pos, '{', '}')
+        return self.text[start + 1:self.pos - 1]
+
+
+def _matching(text, pos, opening, closing):
+    """Find the end of the bracketed shell code starting at *pos*
+
+    Quoted strings, escaped characters and comments are skipped while
+    looking for the matching *closing* bracket.
+
+    """
+    regex = _matching_regexes.get((opening, closing))
+    if regex is None:
+        regex = re.compile(r"""[%s%s'"\\#]""" % (re.escape(opening),
+                                                   re.escape(closing)))
+        _matching_regexes[(opening, closing)] = regex
+    depth = 0
+    length = len(text)
+    while pos < length:
+        match = regex.search(text, pos)
+        if not match:
+            break
+        pos = match.start()
+        char = match.group()
+        if char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        elif char == "'":
+            end = text.find("'", pos + 1)
+            pos = length if end < 0 else end
+        elif char == '"':
+            end = pos + 1
+            while end < length and text[end] != '"':
+                end += 2 if text[end] == '\\' else 1
+            pos = end
+        elif char == '\\':
+            pos += 1
+        elif char == '#' and (pos == 0 or text[pos - 1] in ' \t\n;'):
+            end = text.find('\n', pos)
+            pos = length if end < 0 else end - 1
+        pos += 1
+    return length
+
+
+_matching_regexes = {}
 
-    def _clean(self, value):
-        """Pythonize a bash string.
 
-        shlex strips enclosing double quotes from right-hand side of
-        assignment, but not enclosing single quotes.
+def _escape(literal):
+    """Protect a literal string from variable substitution"""
+    if '\\' in literal or '$' in literal:
+        return literal.replace('\\', '\\\\').replace('$', '\\$')
+    return literal
+
+
+_Reference = namedtuple('_Reference',
+                        'name index length operator argument')
+
+
+class _Expansion(object):
+    """Substitute variable references within PKGBUILD values
+
+    Values are parsed into literal strings and :class:`_Reference` tuples
+    once (parsed values are cached across instances). The references form a
+    dependency graph between variables, which is walked depth first so that
+    every variable is expanded exactly once, after the variables it
+    depends on. Back edges in the walk are recorded in :attr:`cycles`.
+
+    *dependencies* optionally caches the variables each variable depends
+    on across instances, by name. An entry is reused as long as the value
+    of the variable is the same object.
+
+    """
+    _dollar_regex = re.compile(r"\\[\\$]|\$")
+    _name_regex = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9@*#?$!-]")
+    _reference_regex = re.compile(
+        r"(?P<length>#)?"
+        r"(?P<name>[A-Za-z_][A-Za-z0-9_]*|[0-9@*#?$!-])"
+        r"(?:\[(?P<index>[^\]]*)\])?"
+        r"(?P<operator>:[-=+?]|[-=+?]|%%?|##?|//?|\^\^?|,,?|:)?")
+    # Parsed values, shared between instances
+    _parsed = {}
+    _max_parsed = 65536
+
+    def __init__(self, symbols, dependencies=None):
+        self.symbols = symbols
+        self.values = {}
+        self.cycles = []
+        self.dependencies = {} if dependencies is None else dependencies
+
+    def resolve(self, names):
+        """Expand the given variables and everything they depend on
+
+        Returns a dictionary of all values expanded so far.
 
         """
-        if value.startswith("'") and value.endswith("'"):
-            return value.strip("'")
-        else:
-            return value
+        for name in self._order(names):
+            self.values[name] = self._evaluate(self.symbols[name])
+        return self.values
 
-    def _clean_array(self, value):
-        """Pythonize a bash array"""
-        return shlex.split(value.strip('()'))
+    def _order(self, names):
+        """Sort *names* and their dependencies topologically"""
+        order = []
+        state = {}
+        for root in names:
+            if root in state or root not in self.symbols:
+                continue
+            state[root] = False
+            stack = [(root, iter(self._dependencies(root)))]
+            while stack:
+                name, dependencies = stack[-1]
+                for dependency in dependencies:
+                    if dependency not in self.symbols:
+                        continue
+                    if dependency not in state:
+                        state[dependency] = False
+                        stack.append((dependency,
+                                      iter(self._dependencies(dependency))))
+                        break
+                    elif state[dependency] is False:
+                        # Still on the stack, so this closes a cycle
+                        names = [n for n, _ in stack]
+                        self.cycles.append(names[names.index(dependency):])
+                else:
+                    stack.pop()
+                    state[name] = True
+                    if name not in self.values:
+                        order.append(name)
+        return order
+
+    def _dependencies(self, name):
+        value = self.symbols[name]
+        cached = self.dependencies.get(name)
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        if isinstance(value, list):
+            dependencies = set()
+            for element in value:
+                dependencies.update(_references(self._parse(element)))
+        else:
+            dependencies = _references(self._parse(value))
+        self.dependencies[name] = (value, dependencies)
+        return dependencies
 
-    def _replace_symbol(self, matchobj):
-        """Replace a regex-matched variable with its value"""
-        symbol = matchobj.group('name').strip("{}")
-        # If the symbol isn't found fallback to an empty string, like bash
+    def _parse(self, value):
+        """Split *value* into literal strings and references"""
         try:
-            value = self._symbols[symbol]
+            return self._parsed[value]
         except KeyError:
-            value = ''
-        # BUG: Might result in an infinite loop, oops!
-        return self._symbol_regex.sub(self._replace_symbol, value)
-
-    def _substitute(self):
-        """Substitute all bash variables within values with their values"""
-        for symbol in self._symbols:
-            value = self._symbols[symbol]
-            # FIXME: This is icky
-            if isinstance(value, str):
-                result = self._symbol_regex.sub(self._replace_symbol, value)
+            pass
+        parts = []
+        literal = []
+        pos = 0
+        length = len(value)
+        while pos < length:
+            match = self._dollar_regex.search(value, pos)
+            if not match:
+                literal.append(value[pos:])
+                break
+            if match.start() > pos:
+                literal.append(value[pos:match.start()])
+            pos = match.end()
+            if match.group() != '$':
+                literal.append(match.group()[1])
+                continue
+            reference = None
+            if value.startswith('{', pos):
+                end = _matching(value, pos, '{', '}')
+                reference = self._parse_reference(value[pos + 1:end - 1])
             else:
-                result = [self._symbol_regex.sub(self._replace_symbol, x)
-                    for x in value]
-            self._symbols[symbol] = result
-
-    def _assign_local(self):
-        """Assign values from _symbols to PKGBUILD variables"""
-        for var in self._symbols:
-            value = self._symbols[var]
-            if var in self._checksum_fields:
-                key = var.replace('sums', '')
-                self.checksums[key] = value
+                name = self._name_regex.match(value, pos)
+                if name:
+                    end = name.end()
+                    reference = _Reference(name.group(), None, False, None,
+                                           None)
+            if reference is None:
+                literal.append('$')
+                continue
+            if literal:
+                parts.append("".join(literal))
+                literal = []
+            parts.append(reference)
+            pos = end
+        if literal:
+            parts.append("".join(literal))
+        if len(self._parsed) >= self._max_parsed:
+            self._parsed.clear()
+        self._parsed[value] = parts
+        return parts
+
+    def _parse_reference(self, expression):
+        """Parse the expression within ``${...}``"""
+        match = self._reference_regex.match(expression)
+        if not match:
+            return None
+        operator = match.group('operator')
+        argument = expression[match.end():]
+        if operator is None:
+            if argument:
+                return None
+            argument = None
+        elif operator in ('/', '//'):
+            pattern, replacement = _split_pattern(argument)
+            argument = (self._parse(pattern), self._parse(replacement))
+        else:
+            argument = self._parse(argument)
+        return _Reference(match.group('name'), match.group('index'),
+                          bool(match.group('length')), operator, argument)
+
+    def _evaluate(self, value):
+        if isinstance(value, list):
+            result = []
+            for element in value:
+                parts = self._parse(element)
+                # "${array[@]}" expands to all elements of the array
+                if (len(parts) == 1 and not isinstance(parts[0], str) and
+                        parts[0].index in ('@', '*') and
+                        not parts[0].operator and not parts[0].length):
+                    array = self.values.get(parts[0].name)
+                    if isinstance(array, list):
+                        result.extend(array)
+                    elif array is not None:
+                        result.append(array)
+                    continue
+                result.append(self._expand(parts))
+            return result
+        return self._expand(self._parse(value))
+
+    def _expand(self, parts):
+        result = []
+        for part in parts:
+            if isinstance(part, str):
+                result.append(part)
             else:
-                if var in self._var_map:
-                    var = self._var_map[var]
-                setattr(self, var, value)
+                result.append(self._expand_reference(part))
+        return "".join(result)
+
+    def _expand_reference(self, reference):
+        value = self.values.get(reference.name)
+        index = reference.index
+        if isinstance(value, list):
+            if index in ('@', '*'):
+                if reference.length:
+                    return str(len(value))
+                value = " ".join(value)
+            else:
+                try:
+                    value = value[int(index or 0)]
+                except (ValueError, IndexError):
+                    value = None
+        elif index not in (None, '0', '@', '*'):
+            value = None
+        if reference.length:
+            return str(len(value or ''))
+        operator = reference.operator
+        if operator is None:
+            return value or ''
+        argument = reference.argument
+        if operator in (':-', ':='):
+            return value or self._expand(argument)
+        elif operator in ('-', '='):
+            return self._expand(argument) if value is None else value
+        elif operator == ':+':
+            return self._expand(argument) if value else ''
+        elif operator == '+':
+            return '' if value is None else self._expand(argument)
+        value = value or ''
+        if operator in ('%', '%%', '#', '##'):
+            return _remove_pattern(value, self._expand(argument), operator)
+        elif operator in ('/', '//'):
+            pattern = _glob_regex(self._expand(argument[0]))
+            replacement = self._expand(argument[1]).replace('\\', '\\\\')
+            return pattern.sub(replacement, value,
+                               count=0 if operator == '//' else 1)
+        elif operator == ':':
+            return _substring(value, self._expand(argument))
+        elif operator == '^^':
+            return value.upper()
+        elif operator == '^':
+            return value[:1].upper() + value[1:]
+        elif operator == ',,':
+            return value.lower()
+        elif operator == ',':
+            return value[:1].lower() + value[1:]
+        return value
+
 
+def _references(parts):
+    """Return the names of the variables referenced by parsed *parts*"""
+    names = set()
+    for part in parts:
+        if isinstance(part, str):
+            continue
+        names.add(part.name)
+        argument = part.argument
+        if argument:
+            if isinstance(argument, tuple):
+                names.update(_references(argument[0]))
+                names.update(_references(argument[1]))
+            else:
+                names.update(_references(argument))
+    return names
+
+
+def _value_references(value):
+    """Return the names of the variables referenced by an unexpanded
+    *value*, a string or a list of strings"""
+    expansion = _Expansion({})
+    if not isinstance(value, list):
+        return _references(expansion._parse(value))
+    names = set()
+    for element in value:
+        names.update(_references(expansion._parse(element)))
+    return names
+
+
+def _split_pattern(argument):
+    """Split the argument of ``${var/pattern/string}``"""
+    pos = 0
+    while True:
+        pos = argument.find('/', pos)
+        if pos < 0:
+            return argument, ''
+        if pos == 0 or argument[pos - 1] != '\\':
+            return argument[:pos], argument[pos + 1:]
+        pos += 1
+
+
+def _glob_regex(pattern, anchor=''):
+    """Translate a shell pattern into a regular expression
+
+    The expression is not anchored at the end, unless *anchor* is
+    ``r'\\Z'``.
+
+    """
+    result = []
+    pos = 0
+    length = len(pattern)
+    while pos < length:
+        char = pattern[pos]
+        pos += 1
+        if char == '*':
+            result.append('.*')
+        elif char == '?':
+            result.append('.')
+        elif char == '\\' and pos < length:
+            result.append(re.escape(pattern[pos]))
+            pos += 1
+        elif char == '[':
+            end = pattern.find(']', pos + 1)
+            if end < 0:
+                result.append('\\[')
+                continue
+            members = pattern[pos:end].replace('\\', '\\\\')
+            if members[:1] == '!':
+                members = '^' + members[1:]
+            result.append('[%s]' % members)
+            pos = end + 1
+        else:
+            result.append(re.escape(char))
+    result.append(anchor)
+    return re.compile("".join(result), re.DOTALL)
+
+
+def _remove_pattern(value, pattern, operator):
+    """Remove the shortest or longest matching prefix or suffix"""
+    regex = _glob_regex(pattern, r'\Z')
+    length = len(value)
+    if operator == '%':
+        positions = range(length, -1, -1)
+    elif operator == '%%':
+        positions = range(0, length + 1)
+    elif operator == '#':
+        positions = range(0, length + 1)
+    else:
+        positions = range(length, -1, -1)
+    for pos in positions:
+        if operator[0] == '%':
+            if regex.match(value, pos):
+                return value[:pos]
+        elif regex.match(value[:pos]):
+            return value[pos:]
+    return value
+
+
+def _substring(value, argument):
+    """Evaluate ``${var:offset:length}``"""
+    offset, _, length = argument.partition(':')
+    try:
+        offset = int(offset)
+        if offset < 0:
+            offset = max(len(value) + offset, 0)
+        if not length:
+            return value[offset:]
+        length = int(length)
+    except ValueError:
+        return value
+    if length < 0:
+        return value[offset:length]
+    return value[offset:offset + length]
+
+
+# Regexes finding assignments to sets of variables, by set
+_assignment_regexes = {}
+
+
+class PKGBUILDScript(object):
+    """A parsed, but not yet evaluated, :manpage:`PKGBUILD(5)`
+
+    Parsing a PKGBUILD is split into two steps: the file is first split
+    into statements, which :class:`PKGBUILDScript` retains, and these are
+    then evaluated into a :class:`PKGBUILD`. A script can be evaluated
+    many times, with different variables, without parsing the file again::
+
+        >>> script = PKGBUILDScript("PKGBUILD")
+        >>> for arch in ("x86_64", "aarch64"):
+        ...     package = script.evaluate({"CARCH": arch})
+
+    *name* and *fileobj* have the same meaning as for :class:`PKGBUILD`.
+
+    If *fields* is given, the script is only meant to be evaluated for
+    these attributes (see :class:`PKGBUILD`). Scanning then stops as soon
+    as the rest of the file assigns none of the variables these attributes,
+    or the values assigned so far, depend on. Statements after that point,
+    such as most functions, are left out.
+
+    .. attribute:: assignments
+
+        A list of the top level variable assignments, as (name, value,
+        append) tuples. *value* is a string, or a list of strings for
+        arrays, with quotes removed but variable references left in place.
+        *append* is true for ``+=`` assignments.
+
+    .. attribute:: functions
+
+        An ordered dictionary of the source code of function bodies (such
+        as ``build`` or ``package``) by function name.
+
+    .. attribute:: commands
+
+        A list of the source code of all other top level statements. These
+        are not evaluated.
+
+    """
+
+    def __init__(self, name=None, fileobj=None, fields=None):
+        super(PKGBUILDScript, self).__init__()
+        if not name and not fileobj:
+            raise ValueError("nothing to open")
+        if fileobj:
+            if hasattr(fileobj, "seek"):
+                fileobj.seek(0)
+            text = fileobj.read()
+        else:
+            with open(name, "r") as f:
+                text = f.read()
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        self.assignments = []
+        self.functions = OrderedDict()
+        self.commands = []
+        # Symbols without overrides, and the variables each one references
+        self._symbols = None
+        self._dependencies = {}
+        needed = None
+        if fields is not None:
+            needed = PKGBUILD._field_variables(fields)
+        # Position of the next assignment to a needed variable
+        following = 0
+        scanner = _PKGBUILDScanner(text)
+        for statement in scanner.statements():
+            if isinstance(statement, _Assignment):
+                self.assignments.append(statement)
+                if needed is not None:
+                    references = _value_references(statement.value)
+                    if not references <= needed:
+                        needed.update(references)
+                        following = 0
+            elif isinstance(statement, _Function):
+                self.functions[statement.name] = statement.body
+            else:
+                self.commands.append(statement.text)
+            if needed is not None and scanner.pos > following:
+                following = self._next_assignment(text, scanner.pos, needed)
+                if following is None:
+                    break
+
+    @staticmethod
+    def _next_assignment(text, pos, names):
+        """Return the position of the next assignment to one of *names*
+
+        The search is textual, so it may find assignments within function
+        bodies or strings as well, but never misses one the scanner would
+        find. Architecture specific variants such as ``depends_x86_64`` are
+        included.
+
+        """
+        key = frozenset(names)
+        regex = _assignment_regexes.get(key)
+        if regex is None:
+            if len(_assignment_regexes) >= 256:
+                _assignment_regexes.clear()
+            regex = _assignment_regexes[key] = re.compile(
+                r"(?<![^\s;&|(){}<>])(?:%s)(?:_\w+)?\+?=" % "|".join(
+                    re.escape(name) for name in sorted(names)))
+        match = regex.search(text, pos)
+        return match.start() if match else None
+
+    def symbols(self, overrides=None):
+        """Return the unexpanded values of all variables
+
+        Variables in *overrides* replace those assigned in the script.
+        Override values are taken literally, they are not expanded.
+
+        """
+        if self._symbols is None:
+            self._symbols = {}
+            for var, value, append in self.assignments:
+                if append and var in self._symbols:
+                    previous = self._symbols[var]
+                    if isinstance(previous, list):
+                        if not isinstance(value, list):
+                            value = [value]
+                        value = previous + value
+                    elif not isinstance(value, list):
+                        value = previous + value
+                self._symbols[var] = value
+        # Values are shared with the cached table, but never modified
+        symbols = self._symbols.copy()
+        if overrides:
+            for var, value in overrides.items():
+                if isinstance(value, _string_types):
+                    symbols[var] = _escape(value)
+                else:
+                    symbols[var] = [_escape(element) for element in value]
+            arch = overrides.get('CARCH')
+            if arch:
+                self._merge_arch(symbols, arch)
+        return symbols
+
+    # Arrays which can have architecture specific variants, e.g.
+    # depends_x86_64
+    _arch_arrays = ('source', 'depends', 'makedepends', 'checkdepends',
+                    'optdepends', 'provides', 'conflicts', 'replaces',
+                    'md5sums', 'sha1sums', 'sha256sums', 'sha384sums',
+                    'sha512sums')
+
+    @classmethod
+    def _merge_arch(cls, symbols, arch):
+        """Append the variants for *arch* of arrays to the arrays"""
+        for var in cls._arch_arrays:
+            specific = symbols.get("%s_%s" % (var, arch))
+            if specific is None:
+                continue
+            if not isinstance(specific, list):
+                specific = [specific]
+            value = symbols.get(var, [])
+            if not isinstance(value, list):
+                value = [value]
+            symbols[var] = value + specific
+
+    def evaluate(self, overrides=None):
+        """Evaluate the script into a :class:`PKGBUILD`
+
+        *overrides* is a dictionary of variables which replace those
+        assigned in the script, or provide variables which are usually
+        set by :manpage:`makepkg(8)`, such as ``CARCH``. Values are strings,
+        or lists of strings for arrays. If ``CARCH`` is given, architecture
+        specific arrays such as ``depends_x86_64`` are appended to their
+        general counterparts.
+
+        """
+        return PKGBUILD(script=self, overrides=overrides)
+
+
+class PKGBUILD(Package):
+    """A :manpage:`PKGBUILD(5)` parser
+
+    The :class:`PKGBUILD` class provides information about a
+    package by parsing a :manpage:`PKGBUILD(5)` file.
+
+    To instantiate a :class:`PacmanPackage` object, pass the package's file
+    path in the constructor::
+
+        >>> import parched
+        >>> package = PKGBUILD("PKGBUILD")
+
+    If *fileobj* is specified, it is used as an alternative to a
+    :class:`file` like object opened for *name*. It is supposed to be
+    at position 0. For example::
+
+        >>> f = open("PKGBUILD", "r")
+        >>> package = PKGBUILD(fileobj=f)
+        >>> f.close()
+
+    .. note::
+
+        *fileobj* is not closed.
+
+    Alternatively, a :class:`PKGBUILDScript` can be passed as *script*,
+    which is evaluated without parsing the file again. *overrides* is a
+    dictionary of variables, see :meth:`PKGBUILDScript.evaluate`.
+
+    If *fields* is given, only these attributes are evaluated, such as
+    ``('name', 'version', 'release', 'depends')``; the others keep their
+    empty defaults. Variable names such as ``pkgver`` can be given as well.
+    Only the variables these attributes depend on are expanded, and the
+    file is only scanned as far as needed, see :class:`PKGBUILDScript`::
+
+        >>> package = PKGBUILD("PKGBUILD", fields=('name', 'depends'))
+
+    The packages metadata can then be accessed directly::
+
+        >>> print package
+        "foo 1.0-1"
+        >>> print package.description
+        "Example package"
+
+    In addition to the attributes provided by :class:`Package`,
+    :class:`PKGBUILD` provides the following attributes:
+
+    .. attribute:: install
+
+        The filename of the install scriptlet.
+
+    .. attribute:: checksums
+
+        A dictionary containing the checksums of files in the
+        :attr:`sources` list. The dictionary's keys are the algorithms
+        used, and can be any of 'md5', 'sha1', 'sha256', 'sha384', and
+        'sha512'. The value is a list of checksums. The elements
+        correspond to files in the :attr:`sources` list, in relation to
+        their position.
+
+    .. attribute:: sources
+
+        A list containing the URIs of filenames. Local file paths can be
+        relative and do not require a protocol prefix.
+
+    .. attribute:: makedepends
+
+        A list of compile-time dependencies.
+
+    .. attribute:: noextract
+
+        A list of files not to be extracted. These files correspond to
+        the basenames of the URIs in :attr:`sources`
+
+    .. attribute:: cycles
+
+        A list of variables which reference each other in a cycle, such as
+        ``pkgver=$pkgver``. Each cycle is a list of variable names.
+        References which would close a cycle expand to an empty string.
+
+    Variable references in values are substituted. Besides ``$var`` and
+    ``${var}``, the parameter expansions ``${var:-default}``,
+    ``${var-default}``, ``${var:+alternative}``, ``${var+alternative}``,
+    ``${#var}``, ``${var%suffix}``, ``${var%%suffix}``, ``${var#prefix}``,
+    ``${var##prefix}``, ``${var/pattern/string}``,
+    ``${var//pattern/string}``, ``${var:offset:length}``, ``${var^^}`` and
+    ``${var,,}`` are supported, as are array subscripts. Each variable is
+    expanded once, after the variables it references.
+
+    """
+    # Symbol lookup table
+    _var_map = {
+        'pkgname': 'name',
+        'pkgver': 'version',
+        'pkgdesc': 'description',
+        'pkgrel': 'release',
+        'source': 'sources',
+        'arch': 'architectures',
+        'license': 'licenses',
+    }
+    # Variables by attribute name
+    _attribute_vars = dict((attribute, var)
+                           for var, attribute in _var_map.items())
+    _checksum_fields = frozenset((
+        'md5sums',
+        'sha1sums',
+        'sha256sums',
+        'sha384sums',
+        'sha512sums',
+    ))
+    # Variables whose values recur across many packages
+    _interned = frozenset((
+        'arch',
+        'license',
+        'groups',
+        'depends',
+        'makedepends',
+        'optdepends',
+        'provides',
+        'conflicts',
+        'replaces',
+        'options',
+    ))
+
+    def __init__(self, name=None, fileobj=None, overrides=None, script=None,
+                 fields=None):
+        super(PKGBUILD, self).__init__(fileobj)
+        self.install = ""
+        self.checksums = {
+            'md5': (),
+            'sha1': (),
+            'sha256': (),
+            'sha384': (),
+            'sha512': (),
+        }
+        self.noextract = ()
+        self.sources = ()
+        self.makedepends = ()
+        self.cycles = []
+
+        if script is None:
+            script = PKGBUILDScript(name, fileobj, fields)
+        self._parse(script, overrides, fields)
+
+    @classmethod
+    def _field_variables(cls, fields):
+        """Return the set of variables which the attributes *fields* are
+        assigned from"""
+        variables = set()
+        for field in fields:
+            if field == 'checksums':
+                variables.update(cls._checksum_fields)
+            else:
+                variables.add(cls._attribute_vars.get(field, field))
+        return variables
+
+    def _parse(self, script, overrides=None, fields=None):
+        """Evaluate the statements of *script*"""
+        symbols = script.symbols(overrides)
+        if fields is None:
+            names = symbols
+        else:
+            names = [var for var in self._field_variables(fields)
+                     if var in symbols]
+        values = self._substitute(symbols, script._dependencies, names)
+        if fields is not None:
+            # Leave out the variables which were only expanded as a
+            # dependency of a requested one
+            values = dict((var, values[var]) for var in names)
+        self._assign_local(values)
+        if self.release:
+            self.release = float(self.release)
+
+    def _substitute(self, symbols, dependencies=None, names=None):
+        """Substitute all bash variables within values with their values
+
+        Only *names* and the variables they depend on are expanded, if
+        given.
+
+        """
+        expansion = _Expansion(symbols, dependencies)
+        values = expansion.resolve(symbols if names is None else names)
+        self.cycles = expansion.cycles
+        return values
+
+    def _assign_local(self, symbols):
+        """Assign values from the symbol table to PKGBUILD variables"""
+        for var in symbols:
+            value = symbols[var]
+            if isinstance(value, list):
+                if var in self._interned:
+                    value = _intern_all(value)
+                else:
+                    value = tuple(value)
+            if var in self._checksum_fields:
+                key = var.replace('sums', '')
+                self.checksums[key] = value
+            else:
+                if var in self._var_map:
+                    var = self._var_map[var]
+                setattr(self, var, value)
+
+    def verify_sources(self, srcdir, workers=None):
+        """Verify the local source files in *srcdir* against :attr:`checksums`
+
+        Returns a :class:`SourceCheck` per entry of :attr:`sources`. Each
+        file is read once, in large chunks, feeding all declared hash
+        algorithms at the same time. Files are hashed concurrently by
+        *workers* threads, which defaults to the number of CPUs; hashing
+        releases the GIL.
+
+        Entries without checksums, or whose checksums are all ``SKIP``
+        (as for VCS sources) are not read, and their *ok* is ``None``.
+
+        """
+        jobs = []
+        for index, source in enumerate(self.sources):
+            expected = {}
+            for algorithm, checksums in self.checksums.items():
+                if index < len(checksums) and checksums[index] != 'SKIP':
+                    expected[algorithm] = checksums[index].lower()
+            path = os.path.join(srcdir, _source_filename(source))
+            jobs.append((source, path, expected))
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers <= 1 or len(jobs) <= 1:
+            return [_verify_source(job) for job in jobs]
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            return pool.map(_verify_source, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Variables written to .SRCINFO, in the order used by makepkg
+    _srcinfo_scalars = ('pkgdesc', 'pkgver', 'pkgrel', 'epoch', 'url',
+                        'install', 'changelog')
+    _srcinfo_hashes = ('cksums', 'md5sums', 'sha1sums', 'sha224sums',
+                       'sha256sums', 'sha384sums', 'sha512sums', 'b2sums')
+    _srcinfo_arrays = ('arch', 'groups', 'license', 'checkdepends',
+                       'makedepends', 'depends', 'optdepends', 'provides',
+                       'conflicts', 'replaces', 'noextract', 'options',
+                       'backup', 'source', 'validpgpkeys') + _srcinfo_hashes
+    _srcinfo_arch_arrays = ('source', 'provides', 'conflicts', 'depends',
+                            'replaces', 'optdepends', 'makedepends',
+                            'checkdepends') + _srcinfo_hashes
+
+    def _variable(self, var):
+        """Return the value of the variable *var*, as evaluated"""
+        if var in self._checksum_fields:
+            return self.checksums.get(var[:-len('sums')], ())
+        value = getattr(self, self._var_map.get(var, var), None)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return value
+
+    def _split_packages(self):
+        """Return the evaluated packages of a split package, by name"""
+        return {}
+
+    def _srcinfo_lines(self, base=None):
+        """Return the `.SRCINFO` lines of the variables of the package
+
+        If *base* is given, only variables which differ from it are
+        included.
+
+        """
+        lines = []
+        names = list(self._srcinfo_scalars + self._srcinfo_arrays)
+        for arch in self._variable('arch') or ():
+            if arch != 'any':
+                names.extend("%s_%s" % (var, arch)
+                             for var in self._srcinfo_arch_arrays)
+        for var in names:
+            value = self._variable(var)
+            if base is not None and value == base._variable(var):
+                continue
+            if isinstance(value, (list, tuple)):
+                if not value and base is not None and base._variable(var):
+                    # Overridden with an empty array
+                    lines.append("\t%s = " % var)
+                lines.extend("\t%s = %s" % (var, element) for element in value)
+            elif value not in (None, ""):
+                lines.append("\t%s = %s" % (var, value))
+        return lines
+
+    def to_srcinfo(self):
+        """Return the contents of a `.SRCINFO` file for the package
+
+        The output follows ``makepkg --printsrcinfo``. Overrides within the
+        ``package()`` functions of split packages are not evaluated, so
+        `pkgname` sections of PKGBUILDs list no variables of their own.
+        Values are written as evaluated, so packages parsed with a
+        ``CARCH`` override list the variants for that architecture twice.
+
+        """
+        names = _names(self)
+        pkgbase = getattr(self, 'pkgbase', None) or (names[0] if names else "")
+        lines = ["pkgbase = %s" % pkgbase]
+        lines.extend(self._srcinfo_lines())
+        packages = self._split_packages()
+        for name in names:
+            lines.append("")
+            lines.append("pkgname = %s" % name)
+            if name in packages:
+                lines.extend(packages[name]._srcinfo_lines(self))
+        return "\n".join(lines) + "\n"
+
+
+SourceCheck = namedtuple('SourceCheck', 'source path ok mismatches error')
+SourceCheck.__doc__ = """The outcome of verifying a source with
+:meth:`PKGBUILD.verify_sources`
+
+*source* is the entry of :attr:`PKGBUILD.sources` and *path* the local
+file it was checked against. *ok* is true if all declared checksums
+match, false otherwise and ``None`` if there was nothing to check.
+*mismatches* lists the algorithms whose checksum did not match. *error*
+holds the exception if the file could not be read.
+"""
+
+
+def _source_filename(source):
+    """Return the local file name of the PKGBUILD source *source*"""
+    name, separator, url = source.partition('::')
+    if separator:
+        return name
+    # Drop VCS fragments and queries, e.g. git+https://host/repo.git#tag=v1
+    url = source.split('#', 1)[0].split('?', 1)[0].rstrip('/')
+    name = url.rsplit('/', 1)[-1]
+    if '://' in source and name.endswith('.git'):
+        name = name[:-4]
+    return name
+
+
+# Size of the chunks source files are read in
+_hash_chunk_size = 1 << 20
+
+
+def _verify_source(job):
+    """Hash a (source, path, expected) job and compare the digests"""
+    source, path, expected = job
+    if not expected:
+        return SourceCheck(source, path, None, (), None)
+    hashes = [(algorithm, hashlib.new(algorithm)) for algorithm in expected]
+    buffer = bytearray(_hash_chunk_size)
+    view = memoryview(buffer)
+    try:
+        with open(path, "rb") as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                for _, digest in hashes:
+                    digest.update(view[:size])
+    except (IOError, OSError) as e:
+        return SourceCheck(source, path, False, (), e)
+    mismatches = tuple(sorted(algorithm for algorithm, digest in hashes
+                              if digest.hexdigest() != expected[algorithm]))
+    return SourceCheck(source, path, not mismatches, mismatches, None)
+
+
+# .SRCINFO keys which are not arrays
+_srcinfo_scalars = frozenset(('pkgbase', 'pkgname', 'pkgdesc', 'pkgver',
+                              'pkgrel', 'epoch', 'url', 'install',
+                              'changelog'))
+
+
+def _parse_srcinfo(text):
+    """Split a `.SRCINFO` file into the variables of its sections
+
+    Returns the variables of the `pkgbase` section and an ordered
+    dictionary of the variables of each `pkgname` section.
+
+    """
+    base = {}
+    packages = OrderedDict()
+    section = base
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        key, separator, value = line.partition('=')
+        if not separator:
+            continue
+        key = key.strip()
+        value = value.strip()
+        if key == 'pkgbase':
+            section = base
+        elif key == 'pkgname':
+            section = packages[value] = {}
+            continue
+        if key in _srcinfo_scalars:
+            section[key] = value
+        elif key in section:
+            section[key].append(value)
+        else:
+            # An empty value overrides an array of pkgbase with an empty one
+            section[key] = [value] if value else []
+    return base, packages
+
+
+class SRCINFO(PKGBUILD):
+    """A `.SRCINFO` parser
+
+    AUR packages ship a `.SRCINFO` file next to their PKGBUILD, a static
+    rendering of its metadata written by ``makepkg --printsrcinfo``. It is
+    made up of ``key = value`` lines, which need no shell evaluation, so it
+    is much cheaper to parse than the PKGBUILD itself. :class:`SRCINFO`
+    provides the same attributes as :class:`PKGBUILD`::
+
+        >>> package = SRCINFO(".SRCINFO")
+        >>> package.depends
+        ('glibc', 'zlib')
+
+    *name*, *fileobj*, *overrides* and *fields* have the same meaning as for
+    :class:`PKGBUILD`. Override values are taken literally. If ``CARCH`` is
+    given, architecture specific arrays such as ``depends_x86_64`` are
+    appended to their general counterparts, for packages built for that
+    architecture.
+
+    The attributes describe the `pkgbase` section. For split packages,
+    :attr:`name` is a tuple of all package names, and :attr:`packages`
+    holds the variables of each package, with its own section applied.
+
+    .. attribute:: packages
+
+        An ordered dictionary of a :class:`SRCINFO` for each `pkgname`
+        section, by package name.
+
+    """
+
+    def __init__(self, name=None, fileobj=None, overrides=None, fields=None,
+                 script=None):
+        if script is None:
+            if not name and not fileobj:
+                raise ValueError("nothing to open")
+            if fileobj:
+                if hasattr(fileobj, "seek"):
+                    fileobj.seek(0)
+                text = fileobj.read()
+            else:
+                with open(name, "rb") as f:
+                    text = f.read()
+            if isinstance(text, bytes):
+                text = text.decode("utf-8")
+            script = _parse_srcinfo(text)
+        super(SRCINFO, self).__init__(fileobj=fileobj, overrides=overrides,
+                                      script=script, fields=fields)
+
+    def _parse(self, script, overrides=None, fields=None):
+        """Assign the variables of the sections in *script*"""
+        base, packages = script
+        symbols = dict(base)
+        if packages:
+            names = list(packages)
+            symbols['pkgname'] = names if len(names) > 1 else names[0]
+        if overrides:
+            symbols.update(overrides)
+            arch = overrides.get('CARCH')
+            # Packages for other architectures, e.g. 'any', ignore them
+            if arch and arch in symbols.get('arch', (arch,)):
+                PKGBUILDScript._merge_arch(symbols, arch)
+        if fields is not None:
+            symbols = dict((var, symbols[var])
+                           for var in self._field_variables(fields)
+                           if var in symbols)
+        self._assign_local(symbols)
+        if self.release:
+            self.release = float(self.release)
+        self._packages = OrderedDict()
+        for name, variables in packages.items():
+            merged = dict(base)
+            merged.update(variables)
+            merged['pkgname'] = name
+            self._packages[name] = SRCINFO(
+                script=(merged, {}), overrides=overrides, fields=fields)
+
+    @property
+    def packages(self):
+        return getattr(self, '_packages', {})
+
+    @packages.setter
+    def packages(self, value):
+        self._packages = value
+
+    def to_dict(self):
+        """Return the attributes of the package as a dictionary
+
+        In addition to the attributes written by :meth:`Package.to_dict`,
+        ``'packages'`` holds a list of the dictionaries of
+        :attr:`packages`, in order.
+
+        """
+        data = super(SRCINFO, self).to_dict()
+        data['packages'] = [package.to_dict()
+                            for package in self.packages.values()]
+        return data
+
+    def _split_packages(self):
+        return self.packages
+
+
+class DatabasePackage(Package):
+    """A package entry of a pacman database
+
+    Pacman databases describe each package with a `desc` file, made up of
+    ``%FIELD%`` headers each followed by one value per line, and optionally
+    a `files` file in the same format listing the package's contents.
+    Entries are normally obtained by iterating over a
+    :class:`RepoDatabase`, but can be created from the text of those files
+    directly::
+
+        >>> package = DatabasePackage(open("foo-1.0-1/desc").read())
+
+    In addition to the attributes provided by :class:`Package`,
+    :class:`DatabasePackage` provides the following attributes:
+
+    .. attribute:: filename
+
+        The file name of the package in the repository.
+
+    .. attribute:: base
+
+        The name of the PKGBUILD the package was built from.
+
+    .. attribute:: size
+
+        The installed size of the package in bytes.
+
+    .. attribute:: csize
+
+        The size of the package file in bytes.
+
+    .. attribute:: md5sum
+
+        The MD5 digest of the package file.
+
+    .. attribute:: sha256sum
+
+        The SHA-256 digest of the package file.
+
+    .. attribute:: builddate
+
+        A :class:`datetime` object indicating time at which the package was
+        built.
+
+    .. attribute:: packager
+
+        The person who made the package.
+
+    .. attribute:: makedepends
+
+        A list of compile-time dependencies.
+
+    .. attribute:: checkdepends
+
+        A list of dependencies needed to run the package's test suite.
+
+    .. attribute:: files
+
+        A :class:`FileList` of files contained in the package, or ``None``
+        if the database does not list files.
+
+    """
+    __slots__ = (
+        'filename',
+        'base',
+        'size',
+        'csize',
+        'md5sum',
+        'sha256sum',
+        'pgpsig',
+        'builddate',
+        'packager',
+        'makedepends',
+        'checkdepends',
+        'files',
+    )
+    _scalars = {
+        'FILENAME': 'filename',
+        'NAME': 'name',
+        'BASE': 'base',
+        'VERSION': 'version',
+        'DESC': 'description',
+        'CSIZE': 'csize',
+        'ISIZE': 'size',
+        'MD5SUM': 'md5sum',
+        'SHA256SUM': 'sha256sum',
+        'PGPSIG': 'pgpsig',
+        'URL': 'url',
+        'BUILDDATE': 'builddate',
+        'PACKAGER': 'packager',
+    }
+    _arrays = {
+        'GROUPS': 'groups',
+        'LICENSE': 'licenses',
+        'ARCH': 'architectures',
+        'REPLACES': 'replaces',
+        'CONFLICTS': 'conflicts',
+        'PROVIDES': 'provides',
+        'DEPENDS': 'depends',
+        'OPTDEPENDS': 'optdepends',
+        'MAKEDEPENDS': 'makedepends',
+        'CHECKDEPENDS': 'checkdepends',
+        'BACKUP': 'backup',
+    }
+    # Fields whose values recur across many packages
+    _interned = frozenset((
+        'BASE',
+        'PACKAGER',
+        'GROUPS',
+        'LICENSE',
+        'ARCH',
+        'REPLACES',
+        'CONFLICTS',
+        'PROVIDES',
+        'DEPENDS',
+        'OPTDEPENDS',
+        'MAKEDEPENDS',
+        'CHECKDEPENDS',
+    ))
+
+    def __init__(self, desc, files=None):
+        super(DatabasePackage, self).__init__(None)
+        self.filename = ""
+        self.base = ""
+        self.size = 0
+        self.csize = 0
+        self.md5sum = ""
+        self.sha256sum = ""
+        self.pgpsig = ""
+        self.builddate = ""
+        self.packager = ""
+        self.makedepends = ()
+        self.checkdepends = ()
+        self.files = None
+        self._parse(desc)
+        if files is not None:
+            self._parse_files(files)
+
+    def __str__(self):
+        return '%s %s-%s' % (self.name, self.version, self.release)
+
+    def _parse(self, desc):
+        """Parse the contents of a `desc` entry"""
+        for field, values in _parse_database_fields(desc):
+            if field in self._interned:
+                values = _intern_all(values)
+            if field in self._scalars:
+                # Empty values, such as a missing pkgdesc, have no line
+                setattr(self, self._scalars[field],
+                        values[0] if values else "")
+            elif field in self._arrays:
+                setattr(self, self._arrays[field], tuple(values))
+        if self.size:
+            self.size = int(self.size)
+        if self.csize:
+            self.csize = int(self.csize)
+        if self.builddate:
+            self.builddate = datetime.utcfromtimestamp(int(self.builddate))
+        if self.version:
+            self.version, _, self.release = self.version.rpartition('-')
+            self.release = _parse_release(self.release)
+
+    def _parse_files(self, files):
+        """Parse the contents of a `files` entry"""
+        for field, values in _parse_database_fields(files):
+            if field == 'FILES':
+                self.files = FileList(values)
+
+
+def _parse_database_fields(text):
+    """Split a pacman database entry into (field, values) pairs"""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    field = None
+    values = []
+    for line in text.splitlines():
+        if not line:
+            if field is not None:
+                yield field, values
+            field = None
+        elif field is None:
+            if line[0] == '%' and line[-1] == '%':
+                field = line[1:-1]
+                values = []
+        else:
+            values.append(line)
+    if field is not None:
+        yield field, values
+
+
+def _parse_release(value):
+    """Convert a package release to a number
+
+    Releases are integers, except for minor rebuilds such as ``1.1``.
+
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+class RepoDatabase(object):
+    """A pacman sync database
+
+    The :class:`RepoDatabase` class reads a repository database, such as
+    `core.db` or `extra.files`, as created by :manpage:`repo-add(8)`.
+    Iterating over it yields a :class:`DatabasePackage` for each package in
+    the repository. The whole archive is read in one sequential pass, and
+    entries are yielded as soon as they have been read::
+
+        >>> import parched
+        >>> for package in RepoDatabase("extra.db.tar.gz"):
+        ...     print package
+
+    Databases with a `files` entry per package (`*.files`) also populate
+    :attr:`DatabasePackage.files`.
+
+    If *tarfileobj* is specified, it is used as an alternative to a
+    :class:`TarFile` like object opened for *name*. As it is read
+    sequentially it can only be iterated over once.
+
+    .. note::
+
+        *tarfileobj* is not closed.
+
+    """
+    def __init__(self, name=None, tarfileobj=None):
+        super(RepoDatabase, self).__init__()
+        if not name and not tarfileobj:
+            raise ValueError("nothing to open")
+        self.name = name
+        self._tarfileobj = tarfileobj
+
+    def __iter__(self):
+        tarfileobj = self._tarfileobj
+        should_close = False
+        if not tarfileobj:
+            tarfileobj = _open_tarfile(self.name)
+            should_close = True
+        try:
+            # Entries are directories named after the package, holding the
+            # desc, files and (in old databases) depends files.
+            directory = None
+            entries = {}
+            for member in tarfileobj:
+                if not member.isfile():
+                    continue
+                parent, _, filename = member.name.rpartition('/')
+                if parent != directory:
+                    if 'desc' in entries:
+                        yield self._package(entries)
+                    directory = parent
+                    entries = {}
+                entries[filename] = tarfileobj.extractfile(member).read()
+            if 'desc' in entries:
+                yield self._package(entries)
+        finally:
+            if should_close:
+                tarfileobj.close()
+
+    def _package(self, entries):
+        desc = entries['desc']
+        if 'depends' in entries:
+            desc = b"\n".join((desc, entries['depends']))
+        return DatabasePackage(desc, entries.get('files'))
+
+
+class LocalPackage(DatabasePackage):
+    """An installed package, as recorded in pacman's local database
+
+    The local database keeps a directory per installed package, holding a
+    `desc` file in the same format as sync databases, and a `files` file
+    listing the package's files and backup files. Entries are normally
+    obtained from a :class:`LocalDatabase`. If *path* is the directory of
+    the entry, its `files` file is only read when :attr:`files` or
+    :attr:`backup` is first accessed.
+
+    In addition to the attributes provided by :class:`DatabasePackage`,
+    :class:`LocalPackage` provides the following attributes:
+
+    .. attribute:: installdate
+
+        A :class:`datetime` object indicating time at which the package was
+        installed.
+
+    .. attribute:: reason
+
+        ``0`` if the package was explicitly installed, ``1`` if it was
+        installed as a dependency.
+
+    .. attribute:: validation
+
+        A list of the methods used to validate the package on installation,
+        such as ``'pgp'``.
+
+    """
+    __slots__ = (
+        'installdate',
+        'reason',
+        'validation',
+        '_path',
+        '_files',
+        '_backup',
+        '_loaded',
+    )
+    _scalars = dict(DatabasePackage._scalars, **{
+        'SIZE': 'size',
+        'INSTALLDATE': 'installdate',
+        'REASON': 'reason',
+    })
+    _arrays = dict(DatabasePackage._arrays, VALIDATION='validation')
+    _interned = DatabasePackage._interned | frozenset(('VALIDATION',))
+
+    def __init__(self, desc, files=None, path=None):
+        self.installdate = ""
+        self.reason = 0
+        self.validation = ()
+        self._path = path
+        self._loaded = files is not None or path is None
+        super(LocalPackage, self).__init__(desc, files)
+
+    def _parse(self, desc):
+        super(LocalPackage, self)._parse(desc)
+        if self.installdate:
+            self.installdate = datetime.utcfromtimestamp(
+                int(self.installdate))
+        self.reason = int(self.reason or 0)
+
+    def _parse_files(self, files):
+        for field, values in _parse_database_fields(files):
+            if field == 'FILES':
+                self._files = FileList(values)
+            elif field == 'BACKUP':
+                # Backup entries are followed by the MD5 digest of the file
+                # as installed
+                self._backup = tuple(
+                    value.partition('\t')[0] for value in values)
+
+    def _load(self):
+        """Read the `files` entry of the package"""
+        self._loaded = True
+        try:
+            with open(os.path.join(self._path, 'files'), 'rb') as f:
+                self._parse_files(f.read())
+        except (IOError, OSError) as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+    @property
+    def files(self):
+        if not self._loaded:
+            self._load()
+        return self._files
+
+    @files.setter
+    def files(self, value):
+        self._files = value
+
+    @property
+    def backup(self):
+        if not self._loaded:
+            self._load()
+        return self._backup
+
+    @backup.setter
+    def backup(self, value):
+        self._backup = value
+
+
+# Package classes with a function creating an empty package, by class name
+_package_types = {
+    'PacmanPackage': (PacmanPackage, lambda: PacmanPackage(pkginfo="")),
+    'PKGBUILD': (PKGBUILD, lambda: PKGBUILD(fileobj=io.StringIO(""))),
+    'SRCINFO': (SRCINFO, lambda: SRCINFO(fileobj=io.StringIO(""))),
+    'DatabasePackage': (DatabasePackage, lambda: DatabasePackage("")),
+    'LocalPackage': (LocalPackage, lambda: LocalPackage("")),
+}
+# The attributes of empty packages, by class
+_package_defaults = {}
+
+
+def _datetime_value(value):
+    return datetime.utcfromtimestamp(value) if value != "" else value
+
+
+# Conversions of Package.to_dict() values which are not lists of strings,
+# keyed by attribute name
+_dict_decoders = {
+    'builddate': _datetime_value,
+    'installdate': _datetime_value,
+    'files': lambda value: None if value is None else FileList(value),
+    'file_info': lambda value: None if value is None else dict(
+        (path, FileInfo(*info)) for path, info in value.items()),
+    'checksums': lambda value: dict(
+        (key, _dict_tuple(sums)) for key, sums in value.items()),
+    'cycles': lambda value: [list(cycle) for cycle in value],
+    'packages': lambda value: OrderedDict(
+        (package.name, package) for package in map(SRCINFO.from_dict, value)),
+}
+
+
+DatabaseComparison = namedtuple('DatabaseComparison',
+                                'outdated foreign missing')
+DatabaseComparison.__doc__ = """The result of :meth:`LocalDatabase.compare`
+
+*outdated* is a list of (installed, available) package pairs, for which a
+newer version is available. *foreign* is a list of installed packages not
+found in any sync database. *missing* is a list of (package, dependency)
+pairs, for dependencies of installed packages which no installed package
+satisfies. Each list is sorted by package name.
+"""
+
+
+class LocalDatabase(Mapping):
+    """pacman's database of installed packages
+
+    The :class:`LocalDatabase` class maps the name of every package
+    installed on a system to its :class:`LocalPackage`, read from the local
+    database below *path*::
+
+        >>> local = LocalDatabase()
+        >>> local["pacman"].version
+        '7.0.0.r6.gc685ae6'
+
+    Package `desc` files are read when the database is created; `files`
+    files are read on demand. :meth:`compare` checks the installed packages
+    against sync databases, like ``pacman -Qu`` and ``pacman -Qm`` do.
+
+    """
+
+    def __init__(self, path="/var/lib/pacman/local"):
+        super(LocalDatabase, self).__init__()
+        self.path = path
+        self._packages = {}
+        for entry in os.listdir(path):
+            directory = os.path.join(path, entry)
+            try:
+                with open(os.path.join(directory, 'desc'), 'rb') as f:
+                    desc = f.read()
+            except (IOError, OSError) as error:
+                # Such as the ALPM_DB_VERSION file
+                if error.errno in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise
+            package = LocalPackage(desc, path=directory)
+            self._packages[package.name] = package
+
+    def __getitem__(self, name):
+        return self._packages[name]
+
+    def __iter__(self):
+        return iter(self._packages)
+
+    def __len__(self):
+        return len(self._packages)
+
+    def compare(self, sync_dbs):
+        """Compare the installed packages against *sync_dbs*
+
+        *sync_dbs* is a list of :class:`RepoDatabase` objects, or other
+        iterables of packages, in order of precedence: as in pacman, a
+        package is looked up in the first database which contains it. Each
+        database is read once, into a table by package name, and is
+        therefore best given without `files` entries.
+
+        Returns a :class:`DatabaseComparison`.
+
+        """
+        available = {}
+        for database in sync_dbs:
+            for package in database:
+                available.setdefault(package.name, package)
+        outdated = []
+        foreign = []
+        for name in sorted(self._packages):
+            package = self._packages[name]
+            if name in available:
+                newer = available[name]
+                if vercmp(_full_version(newer), _full_version(package)) > 0:
+                    outdated.append((package, newer))
+            else:
+                foreign.append(package)
+        index = DependencyIndex(self._packages.values())
+        missing = sorted(index.unsatisfied(), key=lambda entry: entry[0].name)
+        return DatabaseComparison(outdated, foreign, missing)
+
+
+# Number of entries between full keys in a FileIndex table
+_restart_interval = 16
+# Shared prefix length, suffix length and value count of a table entry
+_table_entry = struct.Struct("<HHI")
+# Magic, version, then the offset and length of the package names, and the
+# offset, entry count and restart point offset of the path and basename
+# tables
+_index_header = struct.Struct("<8sIQQQQQQQQ")
+_index_magic = b"PARCHFIX"
+
+
+def _write_table(out, items):
+    """Append a table of sorted (key, values) pairs to the bytearray *out*
+
+    Keys are byte strings sharing as much of their prefix with the previous
+    key as possible, except for every :data:`_restart_interval`-th key,
+    which is stored in full. Values are lists of integers. Returns the
+    offset, number of entries and offset of the restart points.
+
+    """
+    offset = len(out)
+    restarts = []
+    previous = b""
+    count = 0
+    for key, values in items:
+        if count % _restart_interval:
+            shared = len(os.path.commonprefix((previous, key)))
+        else:
+            restarts.append(len(out))
+            shared = 0
+        out += _table_entry.pack(shared, len(key) - shared, len(values))
+        out += key[shared:]
+        out += struct.pack("<%dI" % len(values), *values)
+        previous = key
+        count += 1
+    restarts_offset = len(out)
+    out += struct.pack("<%dQ" % len(restarts), *restarts)
+    return offset, count, restarts_offset
+
+
+class _Table(object):
+    """A table written by :func:`_write_table`, read from a buffer"""
+
+    def __init__(self, buf, count, restarts):
+        super(_Table, self).__init__()
+        self._buf = buf
+        self._count = count
+        self._restarts = restarts
+        self._blocks = (count + _restart_interval - 1) // _restart_interval
+
+    def __len__(self):
+        return self._count
+
+    def _restart(self, block):
+        return struct.unpack_from("<Q", self._buf, self._restarts + 8 * block)[0]
+
+    def _restart_key(self, block):
+        position = self._restart(block)
+        _, length, _ = _table_entry.unpack_from(self._buf, position)
+        position += _table_entry.size
+        return self._buf[position:position + length]
+
+    def _scan(self, block):
+        """Yield (ordinal, key, values) triples, starting at *block*"""
+        buf = self._buf
+        position = self._restart(block) if block < self._blocks else 0
+        key = b""
+        for ordinal in range(block * _restart_interval, self._count):
+            shared, length, count = _table_entry.unpack_from(buf, position)
+            position += _table_entry.size
+            key = key[:shared] + buf[position:position + length]
+            position += length
+            values = struct.unpack_from("<%dI" % count, buf, position)
+            position += 4 * count
+            yield ordinal, key, values
+
+    def _find(self, key):
+        """Return the block which *key* would be in"""
+        low, high = 0, self._blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self._restart_key(middle) <= key:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    def get(self, key):
+        """Return the values of *key*, or an empty tuple"""
+        for _, other, values in self._scan(self._find(key)):
+            if other >= key:
+                return values if other == key else ()
+        return ()
+
+    def entry(self, ordinal):
+        """Return the key and values of the *ordinal*-th entry"""
+        for other, key, values in self._scan(ordinal // _restart_interval):
+            if other == ordinal:
+                return key, values
+        raise IndexError(ordinal)
+
+    def with_prefix(self, prefix):
+        """Yield the (key, values) pairs whose key starts with *prefix*"""
+        for _, key, values in self._scan(self._find(prefix)):
+            if key.startswith(prefix):
+                yield key, values
+            elif key > prefix:
+                break
+
+
+def _basename(path):
+    return path.rstrip("/").rpartition("/")[2]
+
+
+def _merge_owners(*streams):
+    """Merge sorted streams of (key, names) pairs, joining equal keys"""
+    merged = heapq.merge(*streams)
+    for key, group in groupby(merged, key=lambda entry: entry[0]):
+        names = []
+        for _, other in group:
+            names.extend(other)
+        yield key, tuple(sorted(names))
+
+
+def _package_paths(package):
+    """Yield the files of *package* as listed in `.files` databases
+
+    Package archives also hold metadata files, such as `.PKGINFO`, which
+    are skipped, and name directories without a trailing slash, which is
+    added according to the member types or `.MTREE`.
+
+    """
+    directories = getattr(package, '_directories', None)
+    if directories is None:
+        file_info = getattr(package, 'file_info', None) or {}
+        directories = frozenset(path for path, info in file_info.items()
+                                if info.type == 'dir')
+    for path in package.files:
+        if path[:1] == '.' and '/' not in path:
+            continue
+        if path in directories:
+            path += '/'
+        yield path
+
+
+class FileIndex(object):
+    """An index of the files of many packages, by path
+
+    The :class:`FileIndex` class answers which packages own a path, or
+    which paths have more than one owner, without scanning the file list
+    of every package::
+
+        >>> index = FileIndex()
+        >>> index.update(RepoDatabase("core.files"))
+        >>> index.owners("usr/bin/ls")
+        ('coreutils',)
+        >>> index.save("core.idx")
+
+    Paths are given as listed in packages, without the leading slash (a
+    leading slash is ignored in lookups). Directories, which end with a
+    slash, are usually owned by many packages.
+
+    If *path* names an existing file, it is opened as the base of the
+    index. The file is memory-mapped, and only the parts needed by a lookup
+    are read, so an index of a whole repository can be opened in constant
+    time. It holds the paths in sorted order, prefix compressed, each with
+    the ids of the packages owning it, and a second table from basenames to
+    paths. Packages added or removed afterwards are kept in memory, as a
+    delta over the base; :meth:`save` writes the merged index back to disk.
+
+    The index can also be used as a context manager, which closes it on
+    exit.
+
+    """
+    # Bumped whenever the file format changes
+    _version = 1
+
+    def __init__(self, path=None):
+        super(FileIndex, self).__init__()
+        self.path = path
+        self._file = None
+        self._map = None
+        self._names = []
+        self._ids = {}
+        self._paths = None
+        self._basenames = None
+        # Ids of base packages which were removed or replaced
+        self._removed = set()
+        # The delta: paths by added package, owners and basenames by path
+        self._packages = {}
+        self._owners = {}
+        self._added_basenames = {}
+        self._sorted = []
+        if path is not None and os.path.exists(path):
+            self._open(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            if len(self._map) < _index_header.size:
+                raise ValueError("not a file index: %s" % path)
+            header = _index_header.unpack_from(self._map, 0)
+        except Exception:
+            self.close()
+            raise
+        if header[0] != _index_magic or header[1] != self._version:
+            self.close()
+            raise ValueError("not a file index: %s" % path)
+        names = self._map[header[2]:header[2] + header[3]]
+        self._names = names.decode("utf-8").split("\0") if names else []
+        self._ids = dict((name, i) for i, name in enumerate(self._names))
+        self._paths = _Table(self._map, *header[5:7])
+        self._basenames = _Table(self._map, *header[8:10])
+
+    def close(self):
+        """Close the base file of the index, and drop it from the index"""
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = self._file = self._paths = self._basenames = None
+        self._names = []
+        self._ids = {}
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._ids) - len(self._removed) + len(self._packages)
+
+    def __iter__(self):
+        for i, name in enumerate(self._names):
+            if i not in self._removed:
+                yield name
+        for name in self._packages:
+            yield name
+
+    def __contains__(self, name):
+        if name in self._packages:
+            return True
+        return name in self._ids and self._ids[name] not in self._removed
+
+    def add(self, package):
+        """Add the files of *package*, replacing a package of the same name
+
+        *package* needs a ``files`` list, such as a :class:`PacmanPackage`
+        or a :class:`DatabasePackage` read from a `*.files` database.
+        Files of package archives are indexed as in a database: without
+        metadata files such as `.PKGINFO`, and with a trailing slash on
+        directories.
+
+        """
+        if package.files is None:
+            raise ValueError("%s does not list its files" % package.name)
+        if package.name in self:
+            self.remove(package.name)
+        name = package.name
+        paths = tuple(_package_paths(package))
+        self._packages[name] = paths
+        for path in paths:
+            owners = self._owners.get(path)
+            if owners is None:
+                self._owners[path] = [name]
+                self._added_basenames.setdefault(_basename(path),
+                                                 set()).add(path)
+                self._sorted = None
+            else:
+                owners.append(name)
+
+    def update(self, packages):
+        """Add all *packages*"""
+        for package in packages:
+            self.add(package)
+
+    def remove(self, name):
+        """Remove the files of the package named *name*"""
+        if name in self._packages:
+            for path in self._packages.pop(name):
+                owners = self._owners[path]
+                owners.remove(name)
+                if not owners:
+                    del self._owners[path]
+                    basenames = self._added_basenames[_basename(path)]
+                    basenames.discard(path)
+                    if not basenames:
+                        del self._added_basenames[_basename(path)]
+                    self._sorted = None
+        elif name in self._ids and self._ids[name] not in self._removed:
+            self._removed.add(self._ids[name])
+        else:
+            raise KeyError(name)
+
+    def _base_names(self, ids):
+        return [self._names[i] for i in ids if i not in self._removed]
+
+    def _added_paths(self):
+        """Return the paths of the delta, in sorted order"""
+        if self._sorted is None:
+            self._sorted = sorted(self._owners)
+        return self._sorted
+
+    def _lookup(self, path):
+        names = list(self._owners.get(path, ()))
+        if self._paths is not None:
+            names.extend(self._base_names(
+                self._paths.get(path.encode("utf-8"))))
+        return tuple(sorted(names))
+
+    def owners(self, path):
+        """Return the names of the packages owning *path*"""
+        if path.startswith("/"):
+            path = path[1:]
+        return self._lookup(path)
+
+    def _base_entries(self, prefix):
+        if self._paths is None:
+            return
+        for key, ids in self._paths.with_prefix(prefix.encode("utf-8")):
+            names = self._base_names(ids)
+            if names:
+                yield key.decode("utf-8"), names
+
+    def _added_entries(self, prefix):
+        paths = self._added_paths()
+        for i in range(bisect.bisect_left(paths, prefix), len(paths)):
+            if not paths[i].startswith(prefix):
+                break
+            yield paths[i], self._owners[paths[i]]
+
+    def _entries(self, prefix=""):
+        """Yield the (path, owners) pairs of paths starting with *prefix*"""
+        return _merge_owners(self._base_entries(prefix),
+                             self._added_entries(prefix))
+
+    def with_prefix(self, prefix):
+        """Iterate over the (path, owners) pairs of paths starting with
+        *prefix*, in sorted order"""
+        if prefix.startswith("/"):
+            prefix = prefix[1:]
+        return self._entries(prefix)
+
+    def with_basename(self, basename):
+        """Return the (path, owners) pairs of paths named *basename*, in
+        sorted order"""
+        streams = [sorted((path, self._owners[path]) for path in
+                          self._added_basenames.get(basename, ()))]
+        if self._basenames is not None:
+            entries = []
+            for ordinal in self._basenames.get(basename.encode("utf-8")):
+                key, ids = self._paths.entry(ordinal)
+                names = self._base_names(ids)
+                if names:
+                    entries.append((key.decode("utf-8"), names))
+            streams.append(entries)
+        return list(_merge_owners(*streams))
+
+    def conflicts(self):
+        """Iterate over the (path, owners) pairs of files, but not
+        directories, owned by more than one package"""
+        for path, owners in self._entries():
+            if len(owners) > 1 and not path.endswith("/"):
+                yield path, owners
+
+    def save(self, path=None):
+        """Write the index to *path*, and use it as the new base
+
+        *path* defaults to the path the index was created with. The file
+        is replaced atomically, so readers which still have the previous
+        version open are not affected.
+
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("no path to save the index to")
+        names = sorted(self)
+        ids = dict((name, i) for i, name in enumerate(names))
+        basenames = {}
+
+        def paths():
+            for ordinal, (name, owners) in enumerate(self._entries()):
+                basenames.setdefault(_basename(name).encode("utf-8"),
+                                     []).append(ordinal)
+                yield (name.encode("utf-8"),
+                       sorted(ids[owner] for owner in owners))
+
+        out = bytearray(_index_header.size)
+        names_offset = len(out)
+        out += "\0".join(names).encode("utf-8")
+        names_length = len(out) - names_offset
+        path_table = _write_table(out, paths())
+        basename_table = _write_table(out, sorted(basenames.items()))
+        _index_header.pack_into(
+            out, 0, _index_magic, self._version, names_offset, names_length,
+            *(path_table + basename_table))
+        temporary = "%s.tmp%d" % (path, os.getpid())
+        with open(temporary, "wb") as f:
+            f.write(out)
+        getattr(os, "replace", os.rename)(temporary, path)
+        self.close()
+        self._packages = {}
+        self._owners = {}
+        self._added_basenames = {}
+        self._sorted = []
+        self.path = path
+        self._open(path)
+
+
+_database_regex = re.compile(r"\.(db|files)(\.tar(\.\w+)?)?$")
+
+
+def _guess_kind(path):
+    """Guess whether *path* is a 'pkgbuild', 'srcinfo', 'database' or
+    'package'"""
+    filename = os.path.basename(str(path))
+    if filename == "PKGBUILD":
+        return 'pkgbuild'
+    if filename == ".SRCINFO":
+        return 'srcinfo'
+    if _database_regex.search(filename):
+        return 'database'
+    return 'package'
+
+
+def iter_packages(sources, kind=None, metadata_only=False):
+    """Iterate over the packages in *sources*, one at a time
+
+    *sources* is a path, a :class:`RepoDatabase`, or an iterable of either.
+    Paths are parsed as a :class:`PKGBUILD` if the file is named `PKGBUILD`,
+    as a :class:`SRCINFO` if it is named `.SRCINFO`, as a
+    :class:`RepoDatabase` if the name ends in `.db` or `.files`
+    (optionally followed by a `.tar` extension), and as a
+    :class:`PacmanPackage` otherwise. *kind* forces one of ``'pkgbuild'``,
+    ``'srcinfo'``, ``'database'`` or ``'package'`` for all paths.
+    Databases yield each of their entries.
+
+    Packages are parsed as they are requested and files are closed before
+    the package is yielded, so only as many packages are held in memory as
+    the caller keeps references to::
+
+        >>> for package in iter_packages(glob.glob("/srv/pool/*.pkg.tar.*"),
+        ...                              metadata_only=True):
+        ...     print package
+
+    *metadata_only* is passed on to :class:`PacmanPackage`.
+
+    """
+    if isinstance(sources, (_string_types, RepoDatabase)):
+        sources = [sources]
+    for source in sources:
+        if isinstance(source, RepoDatabase):
+            for package in source:
+                yield package
+            continue
+        source_kind = kind or _guess_kind(source)
+        if source_kind == 'database':
+            for package in RepoDatabase(source):
+                yield package
+        else:
+            yield _parse_path(source, source_kind, metadata_only)
+
+
+def _parse_path(path, kind, metadata_only=False):
+    """Parse a single package or PKGBUILD of the given *kind*"""
+    if kind == 'pkgbuild':
+        return PKGBUILD(path)
+    elif kind == 'srcinfo':
+        return SRCINFO(path)
+    elif kind == 'package':
+        return PacmanPackage(path, metadata_only=metadata_only)
+    elif kind == 'database':
+        return list(RepoDatabase(path))
+    raise ValueError("unknown kind %r" % kind)
+
+
+ParseResult = namedtuple('ParseResult', 'path package error')
+ParseResult.__doc__ = """The outcome of parsing *path* with :func:`parse_many`
+
+*package* is the parsed package, or a list of packages for databases.
+If parsing failed, *package* is ``None`` and *error* holds the exception.
+"""
+
+
+def _parse_job(job):
+    """Parse a (path, kind, metadata_only) job in a worker process"""
+    path, kind, metadata_only = job
+    try:
+        package = _parse_path(path, kind or _guess_kind(path), metadata_only)
+    except Exception as e:
+        return ParseResult(path, None, e)
+    return ParseResult(path, package, None)
+
+
+def parse_many(paths, workers=None, kind=None, ordered=True, chunksize=None,
+               metadata_only=False):
+    """Parse many packages in parallel
+
+    The paths are distributed over a pool of *workers* processes, which
+    defaults to the number of CPUs, and handed out in chunks of *chunksize*
+    paths to keep the communication overhead low. With a single worker the
+    paths are parsed in the calling process.
+
+    A :class:`ParseResult` is yielded per path, in the order of *paths*, or
+    as soon as it is available if *ordered* is false. A path that fails to
+    parse does not abort the batch; its result carries the exception
+    instead::
+
+        >>> for result in parse_many(paths, workers=8):
+        ...     if result.error:
+        ...         print "%s: %s" % (result.path, result.error)
+
+    *kind* and *metadata_only* have the same meaning as for
+    :func:`iter_packages`. Packages are pickled without their parser state
+    to be sent back. The file list of a :class:`PacmanPackage` is not sent
+    back either; it is read in the calling process if it is accessed.
+
+    """
+    jobs = [(path, kind, metadata_only) for path in paths]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _parse_job(job)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (workers * 4))
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    try:
+        if ordered:
+            results = pool.imap(_parse_job, jobs, chunksize)
+        else:
+            results = pool.imap_unordered(_parse_job, jobs, chunksize)
+        for result in results:
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+_dump_magic = b"PARCHPKG"
+_dump_version = 1
+# Number of packages per block of a binary dump
+_dump_block_size = 1024
+# Kinds of the constants of a binary dump
+_constant_kinds = {
+    str: b"s",
+    int: b"i",
+    float: b"f",
+    bool: b"b",
+    type(None): b"n",
+}
+_constant_parsers = {
+    "s": intern,
+    "i": int,
+    "f": float,
+    "b": lambda text: text == "1",
+    "n": lambda text: None,
+}
+
+
+def _constant_index(value, constants, new):
+    """Return the index of *value* in the table of constants"""
+    key = (value.__class__, value)
+    index = constants.get(key)
+    if index is None:
+        index = constants[key] = len(constants)
+        new.append(value)
+    return index
+
+
+def _encode_value(value, words, constants, new):
+    """Append the words encoding *value* to *words*
+
+    The low two bits of a word are a tag. A constant is encoded as its index
+    in the table of constants (tag 0), and a dictionary as its length
+    (tag 2) followed by its keys and values. A list of constants, such as
+    dependencies, is encoded as its length (tag 3) followed by the plain
+    indices of its items, and other lists as their length (tag 1) followed
+    by their items.
+
+    """
+    if isinstance(value, list):
+        try:
+            indices = [constants.get((item.__class__, item)) for item in value]
+        except TypeError:
+            # Lists and dictionaries cannot be constants
+            words.append(len(value) << 2 | 1)
+            for item in value:
+                _encode_value(item, words, constants, new)
+            return
+        if None in indices:
+            indices = [_constant_index(item, constants, new)
+                       for item in value]
+        words.append(len(value) << 2 | 3)
+        words.extend(indices)
+    elif isinstance(value, dict):
+        words.append(len(value) << 2 | 2)
+        for key, item in value.items():
+            words.append(_constant_index(key, constants, new) << 2)
+            _encode_value(item, words, constants, new)
+    else:
+        words.append(_constant_index(value, constants, new) << 2)
+
+
+def _decode_value(words, position, constants):
+    """Decode the value at *position*, return it and the next position
+
+    Lists of constants are decoded as tuples.
+
+    """
+    word = words[position]
+    position += 1
+    tag = word & 3
+    length = word >> 2
+    if tag == 0:
+        return constants[length], position
+    if tag == 3:
+        end = position + length
+        return tuple(map(constants.__getitem__, words[position:end])), end
+    if tag == 1:
+        value = []
+        for _ in range(length):
+            item, position = _decode_value(words, position, constants)
+            value.append(item)
+        return value, position
+    value = {}
+    for _ in range(length):
+        key = constants[words[position] >> 2]
+        word = words[position + 1]
+        tag = word & 3
+        if tag == 0:
+            value[key] = constants[word >> 2]
+            position += 2
+        elif tag == 3:
+            # Inlined, as most values are lists of constants
+            position += 2
+            end = position + (word >> 2)
+            value[key] = tuple(map(constants.__getitem__,
+                                   words[position:end]))
+            position = end
+        else:
+            value[key], position = _decode_value(words, position + 1,
+                                                 constants)
+    return value, position
+
+
+def _write_block(fileobj, packages, constants):
+    new = []
+    words = array('I')
+    for package in packages:
+        _encode_value(package.to_dict(), words, constants, new)
+    kinds = b"".join(_constant_kinds[type(value)] for value in new)
+    texts = "\0".join(
+        value if isinstance(value, str) else
+        repr(value) if isinstance(value, float) else
+        "%d" % value if value is not None else ""
+        for value in new).encode("utf-8")
+    if sys.byteorder == 'big':
+        words.byteswap()
+    fileobj.write(struct.pack("<III", len(new), len(texts), len(words)))
+    fileobj.write(kinds)
+    fileobj.write(texts)
+    fileobj.write(words.tobytes())
+
+
+def _read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("truncated package dump")
+    return data
+
+
+def dump_packages(packages, fileobj, binary=False):
+    """Write a snapshot of *packages* to the binary file object *fileobj*
+
+    By default, packages are written as JSON Lines: one object per line,
+    as returned by :meth:`Package.to_dict`. With *binary*, a more compact
+    format is written, which is also faster to read. Every distinct string
+    and number is stored once, in a table shared by all packages, and
+    packages refer to it by index. Values which are the same across
+    packages are therefore shared again after loading.
+
+    Packages are written in blocks as they are read from *packages*, which
+    may be any iterable. Returns the number of packages written.
+
+    """
+    count = 0
+    if not binary:
+        for package in packages:
+            fileobj.write(json.dumps(package.to_dict(), sort_keys=True,
+                                     separators=(",", ":")).encode("utf-8"))
+            fileobj.write(b"\n")
+            count += 1
+        return count
+    fileobj.write(_dump_magic + struct.pack("<I", _dump_version))
+    constants = {}
+    block = []
+    for package in packages:
+        block.append(package)
+        if len(block) == _dump_block_size:
+            _write_block(fileobj, block, constants)
+            count += len(block)
+            block = []
+    if block:
+        _write_block(fileobj, block, constants)
+        count += len(block)
+    return count
+
+
+def load_packages(fileobj):
+    """Iterate over the packages of a snapshot written by
+    :func:`dump_packages`
+
+    The format is detected from the contents of the binary file object
+    *fileobj*.
+
+    """
+    head = fileobj.read(len(_dump_magic))
+    if head != _dump_magic:
+        for line in chain((head + fileobj.readline(),), fileobj):
+            if line.strip():
+                yield Package.from_dict(json.loads(line.decode("utf-8")))
+        return
+    version, = struct.unpack("<I", _read_exactly(fileobj, 4))
+    if version != _dump_version:
+        raise ValueError("unsupported package dump version %d" % version)
+    constants = []
+    while True:
+        header = fileobj.read(12)
+        if not header:
+            break
+        if len(header) != 12:
+            raise ValueError("truncated package dump")
+        count, length, size = struct.unpack("<III", header)
+        kinds = _read_exactly(fileobj, count).decode("ascii")
+        texts = _read_exactly(fileobj, length).decode("utf-8")
+        if count:
+            constants.extend(
+                _constant_parsers[kind](text)
+                for kind, text in zip(kinds, texts.split("\0")))
+        words = array('I')
+        words.frombytes(_read_exactly(fileobj, 4 * size))
+        if sys.byteorder == 'big':
+            words.byteswap()
+        position = 0
+        while position < size:
+            data, position = _decode_value(words, position, constants)
+            # Strings of the table are interned already
+            yield _package_from_dict(data, tuple)
+
+
+class MetadataCache(object):
+    """A persistent cache of parsed packages
+
+    The :class:`MetadataCache` class stores parsed packages in an SQLite
+    database at *path*, so that files which have not changed since they
+    were last parsed do not have to be parsed again. Entries are keyed by
+    file path and validated against the file's size, modification time and
+    inode number. PKGBUILDs and `.SRCINFO` files are small enough to be
+    hashed as well, so a PKGBUILD whose contents did not change (e.g. after
+    a fresh checkout) is not parsed again either::
+
+        >>> cache = MetadataCache("packages.sqlite")
+        >>> for path in glob.glob("/srv/pool/*.pkg.tar.*"):
+        ...     package = cache.parse(path)
+        >>> cache.prune()
+        >>> cache.close()
+
+    A warm cache costs a :func:`os.stat` call and a database lookup per
+    file. Changes are written to disk on :meth:`commit` and :meth:`close`.
+    The cache can also be used as a context manager, which closes it on
+    exit.
+
+    .. attribute:: hits
+
+        The number of :meth:`parse` calls answered from the cache.
+
+    .. attribute:: misses
+
+        The number of :meth:`parse` calls which had to parse the file.
+
+    """
+    # Bumped whenever the stored representation changes
+    _version = 3
+
+    def __init__(self, path):
+        super(MetadataCache, self).__init__()
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != self._version:
+            self._db.execute("DROP TABLE IF EXISTS packages")
+            self._db.execute("PRAGMA user_version = %d" % self._version)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS packages ("
+            " path TEXT PRIMARY KEY,"
+            " kind TEXT,"
+            " size INTEGER,"
+            " mtime INTEGER,"
+            " inode INTEGER,"
+            " digest TEXT,"
+            " data BLOB)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def parse(self, path, kind=None):
+        """Return the package at *path*, parsing it only if it changed
+
+        *kind* has the same meaning as for :func:`iter_packages`.
+        Databases are returned as a list of packages.
+
+        """
+        path = os.path.abspath(str(path))
+        kind = kind or _guess_kind(path)
+        st = os.stat(path)
+        mtime = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        row = self._db.execute(
+            "SELECT kind, size, mtime, inode, digest, data FROM packages"
+            " WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == kind:
+            if row[1:4] == (st.st_size, mtime, st.st_ino):
+                self.hits += 1
+                return pickle.loads(row[5])
+        digest = None
+        if kind in ('pkgbuild', 'srcinfo'):
+            digest = self._digest(path)
+            if row and row[0] == kind and row[4] == digest:
+                self._db.execute(
+                    "UPDATE packages SET size = ?, mtime = ?, inode = ?"
+                    " WHERE path = ?", (st.st_size, mtime, st.st_ino, path))
+                self.hits += 1
+                return pickle.loads(row[5])
+        self.misses += 1
+        package = _parse_path(path, kind)
+        data = pickle.dumps(package, pickle.HIGHEST_PROTOCOL)
+        self._db.execute(
+            "INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, kind, st.st_size, mtime, st.st_ino, digest,
+             sqlite3.Binary(data)))
+        return package
+
+    def prune(self, keep=None):
+        """Evict entries for files which no longer exist
+
+        If *keep* is given, entries for paths not in *keep* are evicted
+        instead. Returns the number of evicted entries.
+
+        """
+        if keep is not None:
+            keep = set(os.path.abspath(str(path)) for path in keep)
+        evicted = []
+        for (path,) in self._db.execute("SELECT path FROM packages"):
+            if keep is None and not os.path.exists(path):
+                evicted.append((path,))
+            elif keep is not None and path not in keep:
+                evicted.append((path,))
+        self._db.executemany("DELETE FROM packages WHERE path = ?", evicted)
+        return len(evicted)
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+
+    def commit(self):
+        """Write pending changes to disk"""
+        self._db.commit()
+
+    def close(self):
+        """Write pending changes to disk and close the cache"""
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def _digest(self, path):
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+
+TreeChanges = namedtuple('TreeChanges', 'added changed removed')
+TreeChanges.__doc__ = """The paths which changed in a :meth:`PKGBUILDTree.refresh`
+
+Each of *added*, *changed* and *removed* is a sorted list of paths.
+"""
+
+
+class PKGBUILDTree(Mapping):
+    """A directory tree of PKGBUILDs, kept up to date incrementally
+
+    The :class:`PKGBUILDTree` class maps the path of every file named
+    `PKGBUILD` below *root* to its parsed :class:`PKGBUILD`. Hidden
+    directories, such as `.git`, are skipped. :meth:`refresh` rescans the
+    tree and only parses files which changed since the previous scan::
+
+        >>> tree = PKGBUILDTree("/srv/aur")
+        >>> tree.refresh()
+        TreeChanges(added=[...], changed=[], removed=[])
+        >>> subprocess.call(["git", "pull"], cwd="/srv/aur")
+        >>> tree.refresh().changed
+        ['/srv/aur/foo/PKGBUILD']
+
+    A file whose size, modification time and inode number did not change
+    is assumed to be unchanged. Otherwise it is read and only parsed again
+    if its SHA-1 hash differs, so touching a file (as a fresh checkout
+    does) is cheap as well. Changed files are parsed with
+    :func:`parse_many` using *workers* processes.
+
+    .. attribute:: errors
+
+        The exceptions raised by PKGBUILDs which failed to parse, by path.
+        These PKGBUILDs are not part of the mapping.
+
+    """
+
+    def __init__(self, root, workers=1):
+        super(PKGBUILDTree, self).__init__()
+        self.root = root
+        self.workers = workers
+        self.errors = {}
+        # (size, mtime, inode), hash and PKGBUILD by path
+        self._entries = {}
+        # (size, mtime, inode) and hash of failed PKGBUILDs by path
+        self._failed = {}
+
+    def __getitem__(self, path):
+        return self._entries[path][2]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _paths(self):
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = [name for name in subdirectories
+                                 if not name.startswith('.')]
+            if 'PKGBUILD' in files:
+                yield os.path.join(directory, 'PKGBUILD')
+
+    def refresh(self):
+        """Rescan the tree, and return the :class:`TreeChanges`"""
+        seen = set()
+        stale = {}
+        for path in self._paths():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime),
+                   st.st_ino)
+            entry = self._entries.get(path) or self._failed.get(path)
+            if entry is not None and entry[0] == key:
+                seen.add(path)
+                continue
+            try:
+                with open(path, "rb") as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+            except OSError:
+                # Removed since the scan, e.g. by a git checkout
+                continue
+            seen.add(path)
+            if entry is not None and entry[1] == digest:
+                if path in self._entries:
+                    self._entries[path] = (key, digest, entry[2])
+                else:
+                    self._failed[path] = (key, digest)
+                continue
+            stale[path] = (key, digest)
+
+        removed = [path for path in self._entries if path not in seen]
+        for path in removed:
+            del self._entries[path]
+        for path in [path for path in self._failed if path not in seen]:
+            del self._failed[path]
+            del self.errors[path]
+
+        added = []
+        changed = []
+        for result in parse_many(sorted(stale), workers=self.workers,
+                                 kind='pkgbuild'):
+            key, digest = stale[result.path]
+            if result.error is not None:
+                if self._entries.pop(result.path, None) is not None:
+                    removed.append(result.path)
+                self._failed[result.path] = (key, digest)
+                self.errors[result.path] = result.error
+                continue
+            if result.path in self._entries:
+                changed.append(result.path)
+            else:
+                added.append(result.path)
+            self._failed.pop(result.path, None)
+            self.errors.pop(result.path, None)
+            self._entries[result.path] = (key, digest, result.package)
+        return TreeChanges(sorted(added), sorted(changed), sorted(removed))
+
+
+class _NumberColumn(object):
+    """A column of integers or floats, stored in an :class:`array.array`"""
+    __slots__ = ('data',)
+
+    def __init__(self, typecode, data=None):
+        self.data = array(typecode) if data is None else data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, row):
+        return self.data[row]
+
+    def append(self, value):
+        self.data.append(value)
+
+    def take(self, rows=None):
+        if rows is None:
+            return _NumberColumn(self.data.typecode, self.data[:])
+        data = self.data
+        return _NumberColumn(data.typecode,
+                             array(data.typecode, [data[row] for row in rows]))
+
+    def matches(self, test):
+        return [row for row, value in enumerate(self.data) if test(value)]
+
+    def to_numpy(self, numpy):
+        return numpy.frombuffer(self.data, self.data.typecode).copy()
+
+
+class _StringColumn(object):
+    """A dictionary-encoded column of strings
+
+    Each distinct string is stored once in *values*, and rows refer to it by
+    its index (its code). Filters are evaluated once per distinct value
+    rather than once per row.
+
+    """
+    __slots__ = ('codes', 'values', 'index')
+
+    def __init__(self, values=None, index=None, codes=None):
+        # The dictionary only ever grows, so it is shared between a column
+        # and the columns taken from it
+        self.values = [] if values is None else values
+        self.index = {} if index is None else index
+        self.codes = array('l') if codes is None else codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def encode(self, value):
+        try:
+            return self.index[value]
+        except KeyError:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def take(self, rows=None):
+        codes = self.codes
+        if rows is None:
+            codes = codes[:]
+        else:
+            codes = array('l', [codes[row] for row in rows])
+        return _StringColumn(self.values, self.index, codes)
+
+    def accepted(self, test):
+        """Return the codes of the values for which *test* is true"""
+        return frozenset(code for code, value in enumerate(self.values)
+                         if test(value))
+
+    def matches(self, test):
+        accepted = self.accepted(test)
+        return [row for row, code in enumerate(self.codes)
+                if code in accepted]
+
+    def to_numpy(self, numpy):
+        values = numpy.empty(len(self.values), dtype=object)
+        values[:] = self.values
+        return values[numpy.frombuffer(self.codes, self.codes.typecode)]
+
+
+class _ListColumn(_StringColumn):
+    """A dictionary-encoded column of lists of strings
+
+    The items of all rows are stored back to back in *codes*, and row ``i``
+    spans ``codes[offsets[i]:offsets[i + 1]]``.
+
+    """
+    __slots__ = ('offsets',)
+
+    def __init__(self, values=None, index=None, codes=None, offsets=None):
+        super(_ListColumn, self).__init__(values, index, codes)
+        self.offsets = array('L', [0]) if offsets is None else offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        values = self.values
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return tuple([values[code] for code in self.codes[start:end]])
+
+    def append(self, items):
+        encode = self.encode
+        self.codes.extend([encode(item) for item in items])
+        self.offsets.append(len(self.codes))
+
+    def take(self, rows=None):
+        if rows is None:
+            return _ListColumn(self.values, self.index, self.codes[:],
+                               self.offsets[:])
+        codes = array('l')
+        offsets = array('L', [0])
+        for row in rows:
+            codes.extend(self.codes[self.offsets[row]:self.offsets[row + 1]])
+            offsets.append(len(codes))
+        return _ListColumn(self.values, self.index, codes, offsets)
+
+    def matches(self, test):
+        # A row matches if any of its items does
+        accepted = self.accepted(test)
+        offsets = self.offsets
+        rows = []
+        end = 0
+        for position, code in enumerate(self.codes):
+            if code in accepted and position >= end:
+                row = bisect.bisect_right(offsets, position) - 1
+                rows.append(row)
+                end = offsets[row + 1]
+        return rows
+
+    def to_numpy(self, numpy):
+        result = numpy.empty(len(self), dtype=object)
+        for row in range(len(self)):
+            result[row] = self[row]
+        return result
+
+
+class PackageTable(object):
+    """A columnar table of packages
+
+    The :class:`PackageTable` class holds many packages as a table with one
+    column per attribute, which is more compact than a list of
+    :class:`Package` objects and can be queried without touching each
+    package. Integer and float columns are stored in arrays, strings are
+    dictionary-encoded (each distinct string is stored once and rows refer
+    to it by number) and lists such as ``depends`` or ``files`` are stored
+    as one dictionary-encoded array per column, plus an array of offsets.
+
+    Any :class:`Package` (:class:`PacmanPackage`, :class:`PKGBUILD`,
+    :class:`DatabasePackage`, ...) can be added, attributes the package
+    does not have are stored as ``0``, ``""`` or an empty tuple. The build
+    date is stored as a UNIX timestamp, and the names of split PKGBUILDs
+    are separated by spaces. *columns* limits the table to the given
+    columns::
+
+        >>> table = PackageTable(iter_packages(paths),
+        ...                      columns=["name", "licenses", "size"])
+        >>> big = table.where(licenses="GPL", size=lambda s: s > 100 << 20)
+        >>> big.column("name")
+        ['firefox', 'libreoffice-fresh']
+
+    .. attribute:: columns
+
+        The names of the columns of the table.
+
+    """
+    # Columns and how they are stored: 'q' integers, 'd' floats, 's'
+    # strings and 'l' lists of strings
+    _kinds = OrderedDict((
+        ('name', 's'),
+        ('base', 's'),
+        ('version', 's'),
+        ('release', 'd'),
+        ('description', 's'),
+        ('url', 's'),
+        ('packager', 's'),
+        ('builddate', 'q'),
+        ('size', 'q'),
+        ('csize', 'q'),
+        ('licenses', 'l'),
+        ('groups', 'l'),
+        ('architectures', 'l'),
+        ('provides', 'l'),
+        ('depends', 'l'),
+        ('optdepends', 'l'),
+        ('makedepends', 'l'),
+        ('checkdepends', 'l'),
+        ('conflicts', 'l'),
+        ('replaces', 'l'),
+        ('options', 'l'),
+        ('backup', 'l'),
+        ('files', 'l'),
+    ))
+
+    def __init__(self, packages=(), columns=None):
+        super(PackageTable, self).__init__()
+        if columns is None:
+            columns = self._kinds
+        self._data = OrderedDict()
+        for name in columns:
+            if name not in self._kinds:
+                raise ValueError("unknown column %r" % name)
+            self._data[name] = self._new_column(self._kinds[name])
+        self.columns = tuple(self._data)
+        self._length = 0
+        self.extend(packages)
+
+    @staticmethod
+    def _new_column(kind):
+        if kind == 's':
+            return _StringColumn()
+        if kind == 'l':
+            return _ListColumn()
+        return _NumberColumn(kind)
+
+    @classmethod
+    def _from_columns(cls, data, length):
+        table = cls(columns=())
+        table._data = data
+        table.columns = tuple(data)
+        table._length = length
+        return table
+
+    def _value(self, package, name):
+        kind = self._kinds[name]
+        value = getattr(package, name, None)
+        if kind == 's':
+            if isinstance(value, (list, tuple)):
+                return " ".join(value)
+            return value or ""
+        if kind == 'l':
+            return value or ()
+        if not value:
+            return 0
+        if isinstance(value, datetime):
+            return calendar.timegm(value.utctimetuple())
+        return float(value) if kind == 'd' else int(value)
+
+    def append(self, package):
+        """Add *package* to the end of the table"""
+        for name, column in self._data.items():
+            column.append(self._value(package, name))
+        self._length += 1
+
+    def extend(self, packages):
+        """Add all *packages* to the end of the table"""
+        for package in packages:
+            self.append(package)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, row):
+        """Return the row at index *row* as a dict"""
+        if row < 0:
+            row += self._length
+        if not 0 <= row < self._length:
+            raise IndexError("PackageTable index out of range")
+        return dict((name, column[row]) for name, column in self._data.items())
+
+    def __iter__(self):
+        for row in range(self._length):
+            yield self[row]
+
+    def column(self, name):
+        """Return the values of column *name* as a list"""
+        column = self._data[name]
+        return [column[row] for row in range(self._length)]
+
+    def select(self, *names):
+        """Return a table with only the columns *names*"""
+        data = OrderedDict((name, self._data[name].take()) for name in names)
+        return self._from_columns(data, self._length)
+
+    def take(self, rows):
+        """Return a table with the rows at the indices *rows*"""
+        rows = list(rows)
+        data = OrderedDict((name, column.take(rows))
+                           for name, column in self._data.items())
+        return self._from_columns(data, len(rows))
+
+    def where(self, **conditions):
+        """Return a table with the rows matching all *conditions*
+
+        Each keyword names a column, and its value is either a value to
+        compare against or a function returning whether a value matches.
+        List columns match if any of their items does, so
+        ``where(depends="glibc")`` returns the packages depending on glibc.
+
+        """
+        rows = None
+        for name, condition in conditions.items():
+            if callable(condition):
+                test = condition
+            else:
+                test = lambda value, expected=condition: value == expected
+            matches = self._data[name].matches(test)
+            if rows is None:
+                rows = matches
+            else:
+                matches = frozenset(matches)
+                rows = [row for row in rows if row in matches]
+        if rows is None:
+            rows = range(self._length)
+        return self.take(rows)
+
+    def to_numpy(self, columns=None):
+        """Return the table as a dict of NumPy arrays
+
+        Number columns become arrays of the matching type, string and list
+        columns become object arrays of strings and tuples. This requires
+        NumPy to be installed.
+
+        """
+        import numpy
+        if columns is None:
+            columns = self.columns
+        return dict((name, self._data[name].to_numpy(numpy))
+                    for name in columns)
+
+
+def _rpmvercmp(a, b):
+    """Compare two version segments the way pacman's rpmvercmp() does"""
+    if a == b:
+        return 0
+    one = two = 0
+    length_a, length_b = len(a), len(b)
+    while one < length_a and two < length_b:
+        start_a, start_b = one, two
+        while one < length_a and not _isalnum(a[one]):
+            one += 1
+        while two < length_b and not _isalnum(b[two]):
+            two += 1
+        if one == length_a or two == length_b:
+            break
+        # Longer separators are newer
+        if one - start_a != two - start_b:
+            return -1 if one - start_a < two - start_b else 1
+        start_a, start_b = one, two
+        if a[one] in _digits:
+            isnum = True
+            while one < length_a and a[one] in _digits:
+                one += 1
+            while two < length_b and b[two] in _digits:
+                two += 1
+        else:
+            isnum = False
+            while one < length_a and a[one] in _letters:
+                one += 1
+            while two < length_b and b[two] in _letters:
+                two += 1
+        if two == start_b:
+            # Segments of different types, numbers are newer
+            return 1 if isnum else -1
+        segment_a, segment_b = a[start_a:one], b[start_b:two]
+        if isnum:
+            segment_a, segment_b = int(segment_a), int(segment_b)
+        if segment_a != segment_b:
+            return -1 if segment_a < segment_b else 1
+    if one == length_a and two == length_b:
+        return 0
+    # A remaining alphabetic segment never beats an empty string
+    rest_a, rest_b = a[one:one + 1], b[two:two + 1]
+    if (not rest_a and rest_b not in _letters) or rest_a in _letters:
+        return -1
+    return 1
+
+
+_digits = frozenset("0123456789")
+_letters = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_alphanumerics = _digits | _letters
+
+
+def _isalnum(char):
+    return char in _alphanumerics
+
+
+def _split_version(version):
+    """Split *version* into its epoch, version and release
+
+    The release is ``None`` if *version* has none.
+
+    """
+    rest = version.lstrip("0123456789")
+    digits = len(version) - len(rest)
+    if rest[:1] == ':':
+        epoch = version[:digits] or "0"
+        rest = rest[1:]
+    else:
+        epoch = "0"
+        rest = version
+    version, dash, release = rest.rpartition('-')
+    if not dash:
+        return epoch, release, None
+    return epoch, version, release
+
+
+def vercmp(a, b):
+    """Compare the package versions *a* and *b*
+
+    Versions have the form ``[epoch:]version[-release]``. The result is
+    negative if *a* is older than *b*, zero if they are equal and positive
+    if *a* is newer, exactly like :manpage:`vercmp(8)`::
+
+        >>> vercmp("1.0rc1-1", "1.0-1")
+        -1
+        >>> vercmp("1:0.9", "2.0")
+        1
+
+    The release is only compared if both versions have one, so ``1.0`` and
+    ``1.0-2`` are equal.
+
+    """
+    if a == b:
+        return 0
+    epoch_a, version_a, release_a = _split_version(a)
+    epoch_b, version_b, release_b = _split_version(b)
+    result = _rpmvercmp(epoch_a, epoch_b)
+    if result == 0:
+        result = _rpmvercmp(version_a, version_b)
+        if result == 0 and release_a is not None and release_b is not None:
+            result = _rpmvercmp(release_a, release_b)
+    return result
+
+
+_version_segment_regex = re.compile(r"([^0-9A-Za-z]*)(?:([0-9]+)|([A-Za-z]+))")
+
+
+def _segments_key(text, key):
+    """Append the sort key of a version segment to *key*
+
+    Each alphanumeric run becomes the items (separator length, rank,
+    value), where letters rank below the end of the segment, which ranks
+    below numbers. Keys are kept flat, as nested tuples are slow to compare.
+
+    """
+    for separator, number, letters in _version_segment_regex.findall(text):
+        if number:
+            key.extend((len(separator), 3, int(number)))
+        else:
+            key.extend((len(separator), 1, letters))
+    trailing = text and text[-1] not in _alphanumerics
+    key.extend((1 if trailing else 0, 2, ''))
+
+
+# Sort keys by version string, shared by all callers
+_version_keys = {}
+
+
+def version_key(version):
+    """Return a sort key for the package version *version*
+
+    The key orders versions like :func:`vercmp`, so the newest of many
+    versions is ``max(versions, key=version_key)``. Keys are cached, so
+    sorting the same versions again is cheap::
+
+        >>> sorted(["1.0-1", "1.0rc1-1", "1:0.9-1"], key=version_key)
+        ['1.0rc1-1', '1.0-1', '1:0.9-1']
+
+    .. note::
+
+        :func:`vercmp` is not a total order in two corner cases, which a
+        key cannot reproduce: versions without a release compare equal to
+        the same version with any release, whereas the key sorts them
+        first, and trailing separators (``1.0.``) compare inconsistently
+        against segments after longer separators (``1.0..a``).
+
+    """
+    try:
+        return _version_keys[version]
+    except KeyError:
+        pass
+    epoch, rest, release = _split_version(version)
+    key = []
+    _segments_key(epoch, key)
+    _segments_key(rest, key)
+    if release is not None:
+        _segments_key(release, key)
+    key = tuple(key)
+    if len(_version_keys) >= 262144:
+        _version_keys.clear()
+    _version_keys[version] = key
+    return key
+
+
+Dependency = namedtuple('Dependency', 'name operator version')
+Dependency.__doc__ = """A parsed dependency expression
+
+A dependency such as ``"glibc>=2.10"`` is parsed into *name* ``"glibc"``,
+*operator* ``">="`` and *version* ``"2.10"``. *operator* and *version* are
+``None`` for unversioned dependencies. The description of optional
+dependencies (``"foo: for bar support"``) is dropped.
+"""
+
+_dependency_regex = re.compile(r"^(.*?)(?:(<=|>=|<|>|=)(.*))?$")
+
+# Parsed dependencies by expression, shared by all indexes
+_dependency_cache = {}
+
+
+def parse_dependency(text):
+    """Parse the dependency expression *text* into a :class:`Dependency`
+
+    ::
+
+        >>> parse_dependency("glibc>=2.10")
+        Dependency(name='glibc', operator='>=', version='2.10')
+
+    """
+    try:
+        return _dependency_cache[text]
+    except KeyError:
+        pass
+    # Package names cannot contain ':', but epochs in versions do
+    expression = text.split(": ", 1)[0].strip()
+    name, operator, version = _dependency_regex.match(expression).groups()
+    dependency = Dependency(intern(name.strip()), operator,
+                            version and intern(version.strip()))
+    if len(_dependency_cache) >= 65536:
+        _dependency_cache.clear()
+    _dependency_cache[text] = dependency
+    return dependency
+
+
+def _names(package):
+    """Return the names of *package*, which are several for split PKGBUILDs"""
+    if isinstance(package.name, _string_types):
+        return (package.name,)
+    return tuple(package.name)
+
+
+def _full_version(package):
+    """Return the version of *package* as ``[epoch:]version-release``"""
+    version = package.version
+    epoch = getattr(package, 'epoch', None)
+    if epoch and ':' not in version:
+        version = "%s:%s" % (epoch, version)
+    release = package.release
+    if isinstance(release, float) and release.is_integer():
+        release = int(release)
+    if release == "":
+        return version
+    return "%s-%s" % (version, release)
+
+
+# Tests for the result of vercmp() by dependency operator
+_version_operators = {
+    '=': lambda result: result == 0,
+    '>=': lambda result: result >= 0,
+    '<=': lambda result: result <= 0,
+    '>': lambda result: result > 0,
+    '<': lambda result: result < 0,
+}
+
+
+def _satisfies(provision, dependency):
+    """Return whether *provision* satisfies the versioned *dependency*"""
+    if provision.operator != '=':
+        return False
+    result = vercmp(provision.version, dependency.version)
+    return _version_operators[dependency.operator](result)
+
+
+class DependencyIndex(object):
+    """An index of dependency relations between packages
+
+    The :class:`DependencyIndex` class parses the ``provides``, ``depends``,
+    ``conflicts`` and ``replaces`` expressions of many packages once, and
+    keeps hash tables from names to the packages providing, depending on,
+    conflicting with and replacing them, so lookups do not need to scan the
+    packages::
+
+        >>> index = DependencyIndex(RepoDatabase("core.db"))
+        >>> [package.name for package in index.satisfiers("sh")]
+        ['bash']
+        >>> [package.name for package in index.dependents("bash")][:3]
+        ['bzip2', 'ca-certificates-utils', 'e2fsprogs']
+
+    Every package provides its own name(s) at its own version. Dependents
+    are collected from ``depends``, ``makedepends`` and ``checkdepends``.
+
+    Like in pacman, a versioned dependency is only satisfied by packages
+    with a matching version, or which provide the name at a matching
+    version.
+
+    """
+    # Fields whose entries are indexed as dependencies
+    _dependency_fields = ('depends', 'makedepends', 'checkdepends')
+
+    def __init__(self, packages=()):
+        super(DependencyIndex, self).__init__()
+        self._packages = []
+        # Each table maps a name to a list of (package, dependency) pairs
+        self._providers = {}
+        self._dependents = {}
+        self._conflicts = {}
+        self._replaces = {}
+        for package in packages:
+            self.add(package)
+
+    def __len__(self):
+        return len(self._packages)
+
+    def __iter__(self):
+        return iter(self._packages)
+
+    def _entries(self, package):
+        """Yield (table, dependency) pairs for all relations of *package*"""
+        version = _full_version(package)
+        for name in _names(package):
+            yield self._providers, Dependency(name, '=', version)
+        for expression in package.provides:
+            yield self._providers, parse_dependency(expression)
+        for field in self._dependency_fields:
+            for expression in getattr(package, field, ()):
+                yield self._dependents, parse_dependency(expression)
+        for expression in package.conflicts:
+            yield self._conflicts, parse_dependency(expression)
+        for expression in package.replaces:
+            yield self._replaces, parse_dependency(expression)
+
+    def add(self, package):
+        """Add *package* to the index"""
+        self._packages.append(package)
+        for table, dependency in self._entries(package):
+            table.setdefault(dependency.name, []).append((package, dependency))
+
+    def remove(self, package):
+        """Remove *package* from the index"""
+        self._packages.remove(package)
+        for table, dependency in self._entries(package):
+            entries = table.get(dependency.name, [])
+            entries[:] = [entry for entry in entries if entry[0] is not package]
+            if not entries:
+                table.pop(dependency.name, None)
+
+    @staticmethod
+    def _unique(entries):
+        """Return the packages of *entries*, without duplicates"""
+        seen = set()
+        packages = []
+        for package, _ in entries:
+            if id(package) not in seen:
+                seen.add(id(package))
+                packages.append(package)
+        return packages
+
+    def providers(self, name):
+        """Return the packages named *name* or providing *name*"""
+        return self._unique(self._providers.get(name, ()))
+
+    def satisfiers(self, dependency):
+        """Return the packages satisfying *dependency*
+
+        *dependency* is either a :class:`Dependency` or an expression such
+        as ``"sh"`` or ``"glibc>=2.10"``.
+
+        """
+        if isinstance(dependency, _string_types):
+            dependency = parse_dependency(dependency)
+        entries = self._providers.get(dependency.name, ())
+        if dependency.operator is not None:
+            entries = [entry for entry in entries
+                       if _satisfies(entry[1], dependency)]
+        return self._unique(entries)
+
+    def dependents(self, name):
+        """Return the packages depending on *name*"""
+        return self._unique(self._dependents.get(name, ()))
+
+    def conflicts(self, package):
+        """Return the indexed packages which conflict with *package*
+
+        Conflicts are checked in both directions: packages providing a
+        name *package* conflicts with, and packages declaring a conflict
+        with a name *package* provides.
+
+        """
+        entries = []
+        for expression in package.conflicts:
+            entries.extend(self._providers.get(
+                parse_dependency(expression).name, ()))
+        provided = list(_names(package))
+        provided.extend(parse_dependency(expression).name
+                        for expression in package.provides)
+        for name in provided:
+            entries.extend(self._conflicts.get(name, ()))
+        return [other for other in self._unique(entries)
+                if other is not package]
+
+    def replacements(self, name):
+        """Return the packages which replace *name*"""
+        return self._unique(self._replaces.get(name, ()))
+
+    def unsatisfied(self):
+        """Return the (package, dependency) pairs without any satisfier
+
+        Versioned dependencies are checked like in :meth:`satisfiers`, so a
+        dependency on ``glibc>=2.40`` is unsatisfied if only an older glibc
+        is indexed.
+
+        """
+        return [(package, dependency)
+                for entries in self._dependents.values()
+                for package, dependency in entries
+                if not self.satisfiers(dependency)]
+
+
+class DependencyGraph(object):
+    """A graph of the dependencies between packages
+
+    The :class:`DependencyGraph` class answers transitive questions, such
+    as which packages have to be rebuilt when a library changes::
+
+        >>> graph = DependencyGraph(packages)
+        >>> [package.name for package in graph.dependents("openssl")]
+        ['curl', 'git', 'python', ...]
+
+    Each package is assigned an integer id, and its dependencies are
+    resolved to ids once, using a :class:`DependencyIndex`, and stored in
+    arrays. Closures are computed as bitsets (integers with one bit per
+    package) and memoized for every package visited along the way, so
+    queries sharing parts of the graph are answered from earlier results.
+    When a package is updated or removed, only the memoized closures it
+    can affect are discarded.
+
+    Dependencies are taken from the *fields* of each package. A dependency
+    with several satisfiers (such as ``sh``) has an edge to each of them.
+
+    """
+
+    def __init__(self, packages=(), fields=('depends', 'makedepends')):
+        super(DependencyGraph, self).__init__()
+        self.fields = tuple(fields)
+        self._index = DependencyIndex()
+        # Packages by node id, None for removed packages
+        self._packages = []
+        # Node ids by package name and by id() of the package
+        self._nodes = {}
+        self._ids = {}
+        # Dependency and dependent node ids by node id
+        self._edges = []
+        self._reverse = []
+        # Memoized closures as bitsets by node id
+        self._closures = {}
+        self._reverse_closures = {}
+        for package in packages:
+            self._insert(package)
+        for node in range(len(self._packages)):
+            self._set_edges(node, self._resolve(node))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return (package for package in self._packages if package is not None)
+
+    def _insert(self, package, node=None):
+        """Assign *package* the id *node*, or a new id"""
+        if node is None:
+            node = len(self._packages)
+            self._packages.append(None)
+            self._edges.append(array('L'))
+            self._reverse.append(array('L'))
+        self._packages[node] = package
+        self._ids[id(package)] = node
+        for name in _names(package):
+            self._nodes[name] = node
+        self._index.add(package)
+        return node
+
+    def _discard(self, node):
+        """Drop the package with the id *node*"""
+        package = self._packages[node]
+        self._index.remove(package)
+        del self._ids[id(package)]
+        for name in _names(package):
+            if self._nodes.get(name) == node:
+                del self._nodes[name]
+        self._packages[node] = None
+
+    def _node(self, package):
+        if isinstance(package, _string_types):
+            return self._nodes[package]
+        return self._ids[id(package)]
+
+    @staticmethod
+    def _provided(package):
+        """Return the names *package* can satisfy dependencies on"""
+        names = set(_names(package))
+        names.update(parse_dependency(expression).name
+                     for expression in package.provides)
+        return names
+
+    def _resolve(self, node):
+        """Return the ids of the packages satisfying the dependencies of
+        the package with the id *node*"""
+        package = self._packages[node]
+        if package is None:
+            return array('L')
+        targets = set()
+        for field in self.fields:
+            for expression in getattr(package, field, ()):
+                for provider in self._index.satisfiers(expression):
+                    targets.add(self._ids[id(provider)])
+        targets.discard(node)
+        return array('L', sorted(targets))
+
+    def _set_edges(self, node, targets):
+        for target in self._edges[node]:
+            reverse = self._reverse[target]
+            del reverse[reverse.index(node)]
+        for target in targets:
+            self._reverse[target].append(node)
+        self._edges[node] = targets
+
+    def update(self, package):
+        """Add *package*, replacing the package of the same name if any"""
+        node = self._nodes.get(_names(package)[0])
+        names = self._provided(package)
+        if node is not None:
+            names.update(self._provided(self._packages[node]))
+            self._discard(node)
+        node = self._insert(package, node)
+        self._invalidate(node, names)
+
+    def remove(self, package):
+        """Remove *package*, given as a package or a package name"""
+        node = self._node(package)
+        names = self._provided(self._packages[node])
+        self._discard(node)
+        self._invalidate(node, names)
+
+    def _invalidate(self, node, names):
+        """Update the edges and memoized closures after the package with the
+        id *node*, which provides *names*, changed"""
+        # Nodes whose dependencies may resolve differently now
+        changed = set([node])
+        for name in names:
+            changed.update(self._ids[id(package)]
+                           for package in self._index.dependents(name))
+        bits = 0
+        for changed_node in changed:
+            bits |= 1 << changed_node
+        # Forward closures change if they reach a changed node, reverse
+        # closures if a changed node used to reach them...
+        for closures in (self._closures, self._reverse_closures):
+            for key in [key for key, closure in closures.items()
+                        if closure & bits or (bits >> key) & 1]:
+                del closures[key]
+        for changed_node in changed:
+            self._set_edges(changed_node, self._resolve(changed_node))
+        # ...or reaches them now
+        if self._reverse_closures:
+            reached = 0
+            for changed_node in changed:
+                reached |= self._closure(changed_node, self._edges,
+                                         self._closures)
+            for key in list(self._reverse_closures):
+                if (reached >> key) & 1:
+                    del self._reverse_closures[key]
+
+    def _closure(self, start, edges, closures):
+        """Return the bitset of the nodes reachable from *start*
+
+        Closures of all nodes visited are memoized in *closures*. Cycles
+        are handled by computing closures per strongly connected component,
+        using an iterative version of Tarjan's algorithm.
+
+        """
+        if start in closures:
+            return closures[start]
+        index = {start: 0}
+        low = {start: 0}
+        stack = [start]
+        on_stack = set([start])
+        work = [(start, iter(edges[start]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child in closures:
+                    continue
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges[child])))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] != index[node]:
+                    continue
+                members = []
+                member_bits = 0
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    members.append(member)
+                    member_bits |= 1 << member
+                    if member == node:
+                        break
+                # Members of a cycle reach each other
+                closure = member_bits if len(members) > 1 else 0
+                for member in members:
+                    for child in edges[member]:
+                        if not (member_bits >> child) & 1:
+                            closure |= (1 << child) | closures[child]
+                for member in members:
+                    closures[member] = closure
+        return closures[start]
+
+    def cycles(self):
+        """Return the lists of packages which depend on each other"""
+        cycles = OrderedDict()
+        for node, package in enumerate(self._packages):
+            if package is None:
+                continue
+            closure = self._closure(node, self._edges, self._closures)
+            # Members of a cycle reach themselves, and share their closure
+            if (closure >> node) & 1:
+                cycles.setdefault(closure, []).append(package)
+        return list(cycles.values())
+
+    def _members(self, bits):
+        """Return the packages in the bitset *bits*"""
+        packages = []
+        while bits:
+            lowest = bits & -bits
+            packages.append(self._packages[lowest.bit_length() - 1])
+            bits ^= lowest
+        return packages
+
+    def dependencies(self, package):
+        """Return the packages *package* depends on, directly or not
+
+        *package* is a package in the graph or a package name.
+
+        """
+        node = self._node(package)
+        return self._members(self._closure(node, self._edges, self._closures))
+
+    def dependents(self, package):
+        """Return the packages depending on *package*, directly or not
+
+        *package* is a package in the graph or a package name.
+
+        """
+        node = self._node(package)
+        return self._members(self._closure(node, self._reverse,
+                                           self._reverse_closures))
+
+
+class BuildOrder(object):
+    """The order in which a set of PKGBUILDs can be built
+
+    Dependencies of each PKGBUILD (``depends``, ``makedepends`` and
+    ``checkdepends``) are linked to the names and ``provides`` of the
+    other PKGBUILDs of the set, dependencies outside the set are assumed
+    to be available already. :meth:`waves` splits the PKGBUILDs into
+    layers whose members do not depend on each other::
+
+        >>> order = BuildOrder(PKGBUILD(path) for path in paths)
+        >>> for wave in order.waves():
+        ...     build_in_parallel(wave)
+
+    A builder with a fixed number of workers should rather pull from
+    :meth:`queue`, which hands out PKGBUILDs as soon as their
+    dependencies are built.
+
+    .. attribute:: cycles
+
+        A list of lists of PKGBUILDs which depend on each other. These
+        cannot be ordered, so :meth:`waves` and :meth:`queue` raise
+        :class:`ValueError` if there are any.
+
+    """
+    _fields = ('depends', 'makedepends', 'checkdepends')
+
+    def __init__(self, pkgbuilds):
+        super(BuildOrder, self).__init__()
+        self._graph = DependencyGraph(pkgbuilds, self._fields)
+        self.cycles = self._graph.cycles()
+
+    def _check(self):
+        if self.cycles:
+            raise ValueError("dependency cycle between %s" % "; ".join(
+                ", ".join(" ".join(_names(package)) for package in cycle)
+                for cycle in self.cycles))
+
+    def waves(self):
+        """Return the PKGBUILDs as a list of lists which can be built in
+        order, the PKGBUILDs of each list in parallel"""
+        self._check()
+        edges = self._graph._edges
+        reverse = self._graph._reverse
+        packages = self._graph._packages
+        pending = [len(targets) for targets in edges]
+        wave = [node for node, package in enumerate(packages)
+                if package is not None and not pending[node]]
+        waves = []
+        while wave:
+            waves.append([packages[node] for node in wave])
+            following = []
+            for node in wave:
+                for dependent in reverse[node]:
+                    pending[dependent] -= 1
+                    if not pending[dependent]:
+                        following.append(dependent)
+            wave = sorted(following)
+        return waves
+
+    def queue(self):
+        """Return a :class:`BuildQueue` over the PKGBUILDs"""
+        self._check()
+        return BuildQueue(self._graph)
+
+
+class BuildQueue(object):
+    """A queue of PKGBUILDs, handing out those whose dependencies are built
+
+    Use :meth:`BuildOrder.queue` to create one. :meth:`ready` returns the
+    PKGBUILDs which can be built now, and :meth:`done` or :meth:`failed`
+    report finished builds::
+
+        >>> queue = order.queue()
+        >>> while queue:
+        ...     for pkgbuild in queue.ready():
+        ...         pool.submit(pkgbuild)
+        ...     pkgbuild, ok = pool.wait_for_one()
+        ...     if ok:
+        ...         queue.done(pkgbuild)
+        ...     else:
+        ...         queue.failed(pkgbuild)
+
+    The queue is true while PKGBUILDs are waiting or being built.
+
+    """
+
+    def __init__(self, graph):
+        super(BuildQueue, self).__init__()
+        self._graph = graph
+        self._pending = [len(targets) for targets in graph._edges]
+        self._ready = [node for node, package in enumerate(graph._packages)
+                       if package is not None and not self._pending[node]]
+        self._remaining = len(graph)
+
+    def __len__(self):
+        return self._remaining
+
+    def __bool__(self):
+        return self._remaining > 0
+
+    __nonzero__ = __bool__
+
+    def ready(self):
+        """Return the PKGBUILDs which became buildable since the last call"""
+        packages = self._graph._packages
+        ready = [packages[node] for node in self._ready]
+        self._ready = []
+        return ready
+
+    def done(self, pkgbuild):
+        """Mark *pkgbuild* as built"""
+        node = self._graph._node(pkgbuild)
+        self._remaining -= 1
+        for dependent in self._graph._reverse[node]:
+            self._pending[dependent] -= 1
+            if not self._pending[dependent]:
+                self._ready.append(dependent)
+
+    def failed(self, pkgbuild):
+        """Mark *pkgbuild* as failed
+
+        The PKGBUILDs depending on it are skipped, and returned.
+
+        """
+        skipped = []
+        for package in self._graph.dependents(pkgbuild):
+            node = self._graph._node(package)
+            # Still waiting for the failed build, so never handed out
+            if self._pending[node] >= 0:
+                self._pending[node] = -1
+                skipped.append(package)
+        self._remaining -= 1 + len(skipped)
+        return skipped
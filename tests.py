@@ -23,6 +23,13 @@
 
 from __future__ import unicode_literals
 
+import gzip
+import io
+import mmap
+import os
+import shutil
+import tarfile
+import tempfile
 import time
 import unittest
 
@@ -72,6 +79,40 @@ class TarFileMock(object):
         return [self._files[k].name for k in self._files]
 
 
+def write_tarfile(path, members, mode="w:gz", fileobj=None):
+    """Write a tarball from (name, content) pairs
+
+    Members whose content is ``None`` are added as directories.
+
+    """
+    archive = tarfile.open(path, mode=mode, fileobj=fileobj)
+    for name, content in members:
+        if content is None:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            archive.addfile(info)
+            continue
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        archive.addfile(info, io.BytesIO(content))
+    archive.close()
+
+
+def make_tarfile(members, mode="w:gz"):
+    """Build an in-memory tarball from (name, content) pairs
+
+    The archive is reopened in stream mode, as :class:`PacmanPackage` opens
+    packages itself.
+
+    """
+    buf = io.BytesIO()
+    write_tarfile(None, members, mode, fileobj=buf)
+    buf.seek(0)
+    return tarfile.open(fileobj=buf, mode="r|*")
+
+
 class PackageGenerator(object):
     def __init__(self):
         super(PackageGenerator, self).__init__()
@@ -86,6 +127,8 @@ class PackageGenerator(object):
         self.replaces = []
         self.conflicts = []
         self.provides = []
+        self.depends = []
+        self.optdepends = []
         self.backup = []
         self.options = []
 
@@ -191,6 +234,25 @@ class PacmanPackageTest(unittest.TestCase):
         self.package.release = 1
         self.package.description = "Test package"
 
+    def test_fields(self):
+        self.package.url = "http://www.test.com"
+        self.package.depends = ['baz', 'eggs']
+        tarfile = TarFileMock()
+        tarfile.add(self.package.as_file())
+        tarfile.add(FileMock("foo", "foo.txt"))
+        fields = ('name', 'version', 'release', 'depends')
+        target = parched.PacmanPackage(tarfileobj=tarfile, fields=fields)
+        self.assertEqual("test", target.name)
+        self.assertEqual("1.0", target.version)
+        self.assertEqual(1, target.release)
+        self.assertEqual(("baz", "eggs"), target.depends)
+        self.assertEqual("", target.url)
+        self.assertEqual("", target.description)
+        self.assertEqual(None, target.files)
+        target = parched.PacmanPackage(tarfileobj=tarfile,
+                                       fields=fields + ('files',))
+        self.assertEqual([".PKGINFO", "foo.txt"], target.files)
+
     def test_sane_package(self):
         self.package.builddate = datetime.utcfromtimestamp(1231575886)
         self.package.packager = "John Doe"
@@ -221,16 +283,1039 @@ class PacmanPackageTest(unittest.TestCase):
         self.assertEqual(self.package.size, target.size)
         self.assertEqual(self.package.packager, target.packager)
         self.assertEqual(self.package.is_forced, target.is_forced)
-        self.assertEqual(self.package.groups, target.groups)
-        self.assertEqual(self.package.licenses, target.licenses)
-        self.assertEqual(self.package.architectures, target.architectures)
-        self.assertEqual(self.package.replaces, target.replaces)
-        self.assertEqual(self.package.conflicts, target.conflicts)
-        self.assertEqual(self.package.provides, target.provides)
-        self.assertEqual(self.package.backup, target.backup)
-        self.assertEqual(self.package.options, target.options)
+        self.assertEqual(tuple(self.package.groups), target.groups)
+        self.assertEqual(tuple(self.package.licenses), target.licenses)
+        self.assertEqual(tuple(self.package.architectures), target.architectures)
+        self.assertEqual(tuple(self.package.replaces), target.replaces)
+        self.assertEqual(tuple(self.package.conflicts), target.conflicts)
+        self.assertEqual(tuple(self.package.provides), target.provides)
+        self.assertEqual(tuple(self.package.backup), target.backup)
+        self.assertEqual(tuple(self.package.options), target.options)
         self.assertEqual(target.files, [".PKGINFO", "foo.txt"])
 
+    def test_pkginfo_buffer(self):
+        self.package.description = "Test = package"
+        self.package.release = 2
+        pkginfo = ("# Generated by makepkg\n = empty\n%s\n" %
+                   self.package.as_file().read()).encode("utf-8")
+        with tempfile.TemporaryFile() as f:
+            f.write(pkginfo)
+            f.flush()
+            buffers = [
+                pkginfo,
+                memoryview(pkginfo),
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ),
+                pkginfo.decode("utf-8"),
+            ]
+            for buffer in buffers:
+                target = parched.PacmanPackage(pkginfo=buffer)
+                self.assertEqual(self.package.name, target.name)
+                self.assertEqual("Test = package", target.description)
+                self.assertEqual(2, target.release)
+                self.assertEqual(False, target.is_forced)
+                self.assertEqual(None, target.files)
+            buffers[2].close()
+
+    def test_tarfile(self):
+        pkginfo = self.package.as_file().read()
+        archive = make_tarfile([
+            (".PKGINFO", pkginfo),
+            ("usr/bin/test", "#!/bin/sh"),
+        ])
+        target = parched.PacmanPackage(tarfileobj=archive)
+        self.assertEqual(self.package.name, target.name)
+        self.assertEqual(self.package.release, target.release)
+        self.assertEqual([".PKGINFO", "usr/bin/test"], target.files)
+
+    def test_metadata_only(self):
+        pkginfo = self.package.as_file().read()
+        archive = make_tarfile([
+            (".PKGINFO", pkginfo),
+            ("usr/bin/test", "#!/bin/sh"),
+        ])
+        target = parched.PacmanPackage(tarfileobj=archive, metadata_only=True)
+        self.assertEqual(self.package.name, target.name)
+        self.assertEqual(self.package.description, target.description)
+        self.assertEqual(None, target.files)
+        # The archive was left positioned right after .PKGINFO
+        self.assertEqual("usr/bin/test", archive.next().name)
+
+    def test_lazy_files(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "test-1.0-1-any.pkg.tar.gz")
+        write_tarfile(path, [
+            (".PKGINFO", self.package.as_file().read()),
+            ("usr/bin/test", "#!/bin/sh"),
+        ])
+        target = parched.PacmanPackage(path)
+        self.assertEqual(None, target._files)
+        self.assertEqual([".PKGINFO", "usr/bin/test"], target.files)
+        self.assertTrue(isinstance(target.files, parched.FileList))
+        target = parched.PacmanPackage(path, metadata_only=True)
+        self.assertEqual(None, target.files)
+
+    def test_compression_formats(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        members = [
+            (".PKGINFO", self.package.as_file().read()),
+            ("usr/bin/test", "#!/bin/sh"),
+        ]
+        for mode in ("w", "w:gz", "w:bz2", "w:xz"):
+            # The format is detected from the contents, not the name
+            path = os.path.join(tmpdir, "test-1.0-1-any.pkg.tar.zst")
+            write_tarfile(path, members, mode)
+            target = parched.PacmanPackage(path)
+            self.assertEqual(self.package.name, target.name)
+            self.assertEqual([".PKGINFO", "usr/bin/test"], target.files)
+
+    def test_zstd(self):
+        try:
+            from compression import zstd
+            compress = zstd.compress
+        except ImportError:
+            try:
+                import zstandard
+            except ImportError:
+                self.skipTest("no zstd module available")
+            compress = zstandard.ZstdCompressor().compress
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        buf = io.BytesIO()
+        write_tarfile(None, [
+            (".PKGINFO", self.package.as_file().read()),
+            ("usr/bin/test", "#!/bin/sh"),
+        ], "w", fileobj=buf)
+        path = os.path.join(tmpdir, "test-1.0-1-any.pkg.tar.zst")
+        with open(path, "wb") as f:
+            f.write(compress(buf.getvalue()))
+        target = parched.PacmanPackage(path)
+        self.assertEqual(self.package.name, target.name)
+        self.assertEqual([".PKGINFO", "usr/bin/test"], target.files)
+
+    def test_mtree(self):
+        mtree = "\n".join([
+            "#mtree",
+            "/set type=file uid=0 gid=0 mode=644",
+            "./.PKGINFO time=1231575886.0 size=212 sha256digest=abc",
+            "./usr time=1231575886.0 mode=755 type=dir",
+            "./usr/bin time=1231575886.0 mode=755 type=dir",
+            "./usr/bin/test time=1231575886.0 mode=755 size=9"
+            " sha256digest=def",
+            "./usr/bin/my\\040test time=1231575886.0 type=link"
+            " link=test",
+        ])
+        archive = make_tarfile([
+            (".MTREE", gzip.compress(mtree.encode("utf-8"))),
+            (".PKGINFO", self.package.as_file().read()),
+            ("usr/bin/test", "#!/bin/sh"),
+        ])
+        target = parched.PacmanPackage(tarfileobj=archive, mtree=True)
+        self.assertEqual(self.package.name, target.name)
+        self.assertEqual([".PKGINFO", "usr", "usr/bin", "usr/bin/test",
+                          "usr/bin/my test"], target.files)
+        info = target.file_info["usr/bin/test"]
+        self.assertEqual(("file", 0o755, 9, "def", None), info)
+        info = target.file_info["usr/bin/my test"]
+        self.assertEqual(("link", 0o644, 0, None, "test"), info)
+        # Only the members up to .MTREE and .PKGINFO were read
+        self.assertEqual("usr/bin/test", archive.next().name)
+
+    def test_mtree_missing(self):
+        archive = make_tarfile([
+            (".PKGINFO", self.package.as_file().read()),
+            ("usr/bin/test", "#!/bin/sh"),
+        ])
+        target = parched.PacmanPackage(tarfileobj=archive, mtree=True)
+        self.assertEqual([".PKGINFO", "usr/bin/test"], target.files)
+        self.assertEqual(None, target.file_info)
+
+    def test_missing_pkginfo(self):
+        archive = make_tarfile([("usr/bin/test", "#!/bin/sh")])
+        self.assertRaises(KeyError, parched.PacmanPackage, tarfileobj=archive)
+
+class FileListTest(unittest.TestCase):
+    def setUp(self):
+        self.names = ["usr/", "usr/bin/", "usr/bin/foo", "usr/lib/libfoo.so"]
+        self.files = parched.FileList(self.names)
+
+    def test_sequence(self):
+        self.assertEqual(len(self.names), len(self.files))
+        self.assertEqual(self.names, list(self.files))
+        self.assertEqual("usr/bin/foo", self.files[2])
+        self.assertEqual("usr/lib/libfoo.so", self.files[-1])
+        self.assertEqual(self.names[1:3], self.files[1:3])
+        self.assertRaises(IndexError, lambda: self.files[4])
+        self.assertEqual(self.names, self.files)
+
+    def test_contains(self):
+        self.assertTrue("usr/bin/foo" in self.files)
+        self.assertFalse("usr/bin" in self.files)
+        self.assertFalse("bin/foo" in self.files)
+
+    def test_with_prefix(self):
+        self.assertEqual(["usr/bin/", "usr/bin/foo"],
+                         list(self.files.with_prefix("usr/bin")))
+        self.assertEqual([], list(self.files.with_prefix("etc/")))
+
+    def test_empty(self):
+        files = parched.FileList()
+        self.assertEqual(0, len(files))
+        self.assertEqual([], list(files))
+        self.assertFalse("" in files)
+
+
+def make_desc(name, version, **fields):
+    """Render a pacman database `desc` entry"""
+    content = ["%%NAME%%\n%s\n" % name, "%%VERSION%%\n%s\n" % version]
+    for field, values in fields.items():
+        if not isinstance(values, list):
+            values = [values]
+        content.append("%%%s%%\n%s\n" % (field.upper(), "\n".join(values)))
+    return "\n".join(content)
+
+
+class RepoDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.members = [
+            ("foo-1.0-1/desc", make_desc(
+                "foo", "1.0-1",
+                filename="foo-1.0-1-x86_64.pkg.tar.zst",
+                desc="Foo package",
+                csize="1024",
+                isize="4096",
+                builddate="1231575886",
+                arch="x86_64",
+                license=["MIT", "GPL"],
+                depends=["glibc", "bar>=2.0"],
+            )),
+            ("foo-1.0-1/files", "%FILES%\nusr/\nusr/bin/\nusr/bin/foo\n"),
+            ("bar-2:2.1-1.1/desc", make_desc("bar", "2:2.1-1.1")),
+        ]
+
+    def test_packages(self):
+        database = parched.RepoDatabase(tarfileobj=make_tarfile(self.members))
+        packages = list(database)
+        self.assertEqual(2, len(packages))
+        foo, bar = packages
+        self.assertEqual("foo", foo.name)
+        self.assertEqual("1.0", foo.version)
+        self.assertEqual(1, foo.release)
+        self.assertEqual("Foo package", foo.description)
+        self.assertEqual("foo-1.0-1-x86_64.pkg.tar.zst", foo.filename)
+        self.assertEqual(1024, foo.csize)
+        self.assertEqual(4096, foo.size)
+        self.assertEqual(datetime.utcfromtimestamp(1231575886), foo.builddate)
+        self.assertEqual(("x86_64",), foo.architectures)
+        self.assertEqual(("MIT", "GPL"), foo.licenses)
+        self.assertEqual(("glibc", "bar>=2.0"), foo.depends)
+        self.assertEqual(["usr/", "usr/bin/", "usr/bin/foo"], foo.files)
+        self.assertEqual("bar", bar.name)
+        self.assertEqual("2:2.1", bar.version)
+        self.assertEqual(1.1, bar.release)
+        self.assertEqual(None, bar.files)
+
+    def test_database_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "test.db.tar.gz")
+        write_tarfile(path, self.members)
+        database = parched.RepoDatabase(path)
+        self.assertEqual(["foo", "bar"], [p.name for p in database])
+        # Each iteration reads the database again
+        self.assertEqual(["foo", "bar"], [p.name for p in database])
+
+
+class LocalDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        with open(os.path.join(self.path, "ALPM_DB_VERSION"), "w") as f:
+            f.write("9\n")
+        self.add("foo", "1.0-1", installdate="1231575886", size="4096",
+                 reason="1", validation="pgp", depends=["glibc", "bar>=2.1"])
+        self.add("bar", "2.0-1", provides=["libbar.so=1-64"])
+        self.add("baz", "1:1.0-1", depends=["libbar.so", "qux"])
+        self.add("glibc", "2.40-1")
+
+    def add(self, name, version, **fields):
+        directory = os.path.join(self.path, "%s-%s" % (name, version))
+        os.mkdir(directory)
+        with open(os.path.join(directory, "desc"), "w") as f:
+            f.write(make_desc(name, version, **fields))
+        return directory
+
+    def test_packages(self):
+        local = parched.LocalDatabase(self.path)
+        self.assertEqual(["bar", "baz", "foo", "glibc"], sorted(local))
+        foo = local["foo"]
+        self.assertEqual("1.0", foo.version)
+        self.assertEqual(1, foo.release)
+        self.assertEqual(4096, foo.size)
+        self.assertEqual(1, foo.reason)
+        self.assertEqual(("pgp",), foo.validation)
+        self.assertEqual(datetime.utcfromtimestamp(1231575886),
+                         foo.installdate)
+        self.assertEqual(("glibc", "bar>=2.1"), foo.depends)
+        self.assertEqual(0, local["bar"].reason)
+
+    def test_empty_field(self):
+        self.add("qux", "1.0-1", desc="")
+        local = parched.LocalDatabase(self.path)
+        self.assertEqual("", local["qux"].description)
+        self.assertEqual("1.0", local["qux"].version)
+        self.add("quux", "1.0-1", reason="")
+        self.assertEqual(0, parched.LocalDatabase(self.path)["quux"].reason)
+
+    def test_files(self):
+        local = parched.LocalDatabase(self.path)
+        # The files entry is only read when first needed
+        with open(os.path.join(self.path, "foo-1.0-1", "files"), "w") as f:
+            f.write("%FILES%\netc/\netc/foo.conf\nusr/\nusr/bin/\n"
+                    "usr/bin/foo\n\n%BACKUP%\netc/foo.conf\t"
+                    "d41d8cd98f00b204e9800998ecf8427e\n")
+        foo = local["foo"]
+        self.assertEqual(["etc/", "etc/foo.conf", "usr/", "usr/bin/",
+                          "usr/bin/foo"], foo.files)
+        self.assertEqual(("etc/foo.conf",), foo.backup)
+        self.assertEqual(None, local["bar"].files)
+        self.assertEqual((), local["bar"].backup)
+
+    def test_compare(self):
+        local = parched.LocalDatabase(self.path)
+        core = [parched.DatabasePackage(make_desc("glibc", "2.41-1")),
+                parched.DatabasePackage(make_desc("bar", "2.0-1"))]
+        extra = [parched.DatabasePackage(make_desc("glibc", "2.42-1")),
+                 parched.DatabasePackage(make_desc("baz", "1.1-1"))]
+        outdated, foreign, missing = local.compare([core, extra])
+        # The first database with a package takes precedence, and the
+        # epoch of baz is higher than that of the available version
+        self.assertEqual([("glibc", "2.41")],
+                         [(installed.name, available.version)
+                          for installed, available in outdated])
+        self.assertEqual(["foo"], [package.name for package in foreign])
+        self.assertEqual([("baz", ("qux", None, None)),
+                          ("foo", ("bar", ">=", "2.1"))],
+                         [(package.name, dependency)
+                          for package, dependency in missing])
+
+
+def make_files_package(name, files):
+    """Create a DatabasePackage listing *files*"""
+    return parched.DatabasePackage(make_desc(name, "1.0-1"),
+                                   "%%FILES%%\n%s\n" % "\n".join(files))
+
+
+class FileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "files.idx")
+        self.packages = [
+            make_files_package("coreutils", [
+                "usr/", "usr/bin/", "usr/bin/ls", "usr/bin/cat"]),
+            make_files_package("busybox", [
+                "usr/", "usr/bin/", "usr/bin/busybox", "usr/bin/ls"]),
+            make_files_package("ls-docs", [
+                "usr/", "usr/share/", "usr/share/ls/", "usr/share/doc/ls"]),
+        ]
+
+    def check(self, index):
+        self.assertEqual(3, len(index))
+        self.assertEqual(["busybox", "coreutils", "ls-docs"], sorted(index))
+        self.assertEqual(("busybox", "coreutils"), index.owners("usr/bin/ls"))
+        self.assertEqual(("coreutils",), index.owners("/usr/bin/cat"))
+        self.assertEqual((), index.owners("usr/bin/dog"))
+        self.assertEqual([
+            ("usr/bin/", ("busybox", "coreutils")),
+            ("usr/bin/busybox", ("busybox",)),
+            ("usr/bin/cat", ("coreutils",)),
+            ("usr/bin/ls", ("busybox", "coreutils")),
+        ], list(index.with_prefix("/usr/bin/")))
+        self.assertEqual([
+            ("usr/bin/ls", ("busybox", "coreutils")),
+            ("usr/share/doc/ls", ("ls-docs",)),
+            ("usr/share/ls/", ("ls-docs",)),
+        ], index.with_basename("ls"))
+        self.assertEqual([("usr/bin/ls", ("busybox", "coreutils"))],
+                         list(index.conflicts()))
+
+    def test_memory(self):
+        index = parched.FileIndex()
+        index.update(self.packages)
+        self.check(index)
+
+    def test_archives(self):
+        packages = []
+        paths = []
+        for package in self.packages:
+            generator = PacmanPackageGenerator()
+            generator.name = package.name
+            generator.version = "1.0"
+            generator.release = 1
+            members = [(".PKGINFO", generator.as_file().read()),
+                       (".BUILDINFO", "format = 2\n")]
+            # Archives name directories without a trailing slash
+            members.extend((path.rstrip("/"), None if path.endswith("/")
+                            else "") for path in package.files)
+            path = os.path.join(self.tmpdir, "%s.pkg.tar.gz" % package.name)
+            write_tarfile(path, members)
+            paths.append(path)
+            packages.append(parched.PacmanPackage(path))
+        # Read in stream mode, rather than on first access
+        archive = tarfile.open(paths[0], mode="r|*")
+        self.addCleanup(archive.close)
+        packages[0] = parched.PacmanPackage(tarfileobj=archive)
+        index = parched.FileIndex()
+        index.update(packages)
+        self.check(index)
+        self.assertEqual((), index.owners(".PKGINFO"))
+        self.assertEqual(("busybox", "coreutils"), index.owners("/usr/bin/"))
+
+    def test_save(self):
+        index = parched.FileIndex(self.path)
+        index.update(self.packages)
+        index.save()
+        index.close()
+        with parched.FileIndex(self.path) as index:
+            self.check(index)
+
+    def test_updates(self):
+        index = parched.FileIndex()
+        index.update(self.packages)
+        index.save(self.path)
+        index.remove("busybox")
+        index.add(make_files_package("coreutils", ["usr/", "usr/bin/cat"]))
+        index.add(make_files_package("uutils", ["usr/", "usr/bin/ls"]))
+        self.assertRaises(KeyError, index.remove, "busybox")
+        self.assertFalse("busybox" in index)
+        self.assertEqual(["coreutils", "ls-docs", "uutils"], sorted(index))
+        self.assertEqual(("uutils",), index.owners("usr/bin/ls"))
+        self.assertEqual([("usr/bin/cat", ("coreutils",)),
+                          ("usr/bin/ls", ("uutils",))],
+                         list(index.with_prefix("usr/bin/")))
+        self.assertEqual(("coreutils", "ls-docs", "uutils"),
+                         index.owners("usr/"))
+        self.assertEqual([], list(index.conflicts()))
+        index.save()
+        index.close()
+        index = parched.FileIndex(self.path)
+        self.addCleanup(index.close)
+        self.assertEqual(["coreutils", "ls-docs", "uutils"], sorted(index))
+        self.assertEqual([("usr/bin/ls", ("uutils",)),
+                          ("usr/share/doc/ls", ("ls-docs",)),
+                          ("usr/share/ls/", ("ls-docs",))],
+                         index.with_basename("ls"))
+
+    def test_large(self):
+        # Enough paths for several restart points
+        files = ["usr/lib/foo/%04d" % i for i in range(100)]
+        index = parched.FileIndex(self.path)
+        index.add(make_files_package("foo", files))
+        index.add(make_files_package("bar", files[::3]))
+        index.save()
+        for i, path in enumerate(files):
+            owners = ("bar", "foo") if i % 3 == 0 else ("foo",)
+            self.assertEqual(owners, index.owners(path))
+        self.assertEqual(files[50:60],
+                         [path for path, _ in
+                          index.with_prefix("usr/lib/foo/005")])
+        self.assertEqual([("usr/lib/foo/0099", ("bar", "foo"))],
+                         index.with_basename("0099"))
+        index.close()
+
+    def test_invalid(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 128)
+        self.assertRaises(ValueError, parched.FileIndex, self.path)
+        self.assertRaises(ValueError, parched.FileIndex().add,
+                          parched.DatabasePackage(make_desc("foo", "1-1")))
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        package = PacmanPackageGenerator()
+        package.name = "foo"
+        package.version = "1.0"
+        package.release = 1
+        package.builddate = datetime.utcfromtimestamp(1231575886)
+        package.licenses = ["MIT"]
+        package.depends = ["glibc", "bar>=2.0"]
+        archive = TarFileMock()
+        archive.add(package.as_file())
+        archive.add(FileMock("", "usr/bin/foo"))
+        local = parched.LocalPackage(
+            make_desc("baz", "1:2.0-1.1", installdate="1231575886",
+                      reason="1", license="MIT"),
+            "%FILES%\netc/baz.conf\n\n%BACKUP%\netc/baz.conf\tabc\n")
+        self.packages = [
+            parched.PacmanPackage(tarfileobj=archive),
+            parched.PKGBUILD(fileobj=StringIO(
+                "pkgname=(spam eggs)\npkgver=1.0\npkgrel=1\n"
+                "sha256sums=(abc)\n_version=$_version\n")),
+            parched.DatabasePackage(
+                make_desc("bar", "2.0-1", license="MIT",
+                          builddate="1231575886"),
+                "%FILES%\nusr/\nusr/lib/libbar.so\n"),
+            local,
+        ]
+
+    def test_to_dict(self):
+        data = self.packages[0].to_dict()
+        self.assertEqual("PacmanPackage", data["type"])
+        self.assertEqual("foo", data["name"])
+        self.assertEqual(1231575886, data["builddate"])
+        self.assertEqual(["glibc", "bar>=2.0"], data["depends"])
+        self.assertEqual([".PKGINFO", "usr/bin/foo"], data["files"])
+        self.assertFalse(any(name.startswith("_") for name in data))
+        package = parched.PacmanPackage.from_dict(data)
+        self.assertTrue(isinstance(package, parched.PacmanPackage))
+        self.assertEqual(datetime.utcfromtimestamp(1231575886),
+                         package.builddate)
+        self.assertEqual(("glibc", "bar>=2.0"), package.depends)
+        self.assertEqual([".PKGINFO", "usr/bin/foo"], package.files)
+        self.assertEqual(data, package.to_dict())
+
+    def test_from_dict(self):
+        package = parched.Package.from_dict(
+            {"type": "DatabasePackage", "name": "foo", "spam": "eggs"})
+        self.assertEqual("foo", package.name)
+        self.assertEqual("", package.version)
+        self.assertEqual((), package.depends)
+        self.assertRaises(ValueError, parched.Package.from_dict,
+                          {"type": "Spam"})
+        self.assertRaises(ValueError, parched.PKGBUILD.from_dict,
+                          {"type": "DatabasePackage"})
+
+    def check(self, binary):
+        output = io.BytesIO()
+        self.assertEqual(4, parched.dump_packages(self.packages, output,
+                                                  binary=binary))
+        loaded = list(parched.load_packages(io.BytesIO(output.getvalue())))
+        self.assertEqual([package.to_dict() for package in self.packages],
+                         [package.to_dict() for package in loaded])
+        pkgbuild, database, local = loaded[1:]
+        self.assertEqual(("spam", "eggs"), pkgbuild.name)
+        self.assertEqual({"md5": (), "sha1": (), "sha256": ("abc",),
+                          "sha384": (), "sha512": ()}, pkgbuild.checksums)
+        self.assertEqual([["_version"]], pkgbuild.cycles)
+        self.assertEqual(["usr/", "usr/lib/libbar.so"], database.files)
+        self.assertEqual(datetime.utcfromtimestamp(1231575886),
+                         local.installdate)
+        self.assertEqual(("etc/baz.conf",), local.backup)
+        self.assertEqual("2.0", local.version[2:])
+        return loaded
+
+    def test_json_lines(self):
+        self.check(False)
+
+    def test_binary(self):
+        loaded = self.check(True)
+        # Strings are stored once
+        self.assertTrue(loaded[0].licenses[0] is loaded[3].licenses[0])
+
+    def test_truncated(self):
+        output = io.BytesIO()
+        parched.dump_packages(self.packages, output, binary=True)
+        data = output.getvalue()[:-3]
+        self.assertRaises(ValueError, list,
+                          parched.load_packages(io.BytesIO(data)))
+
+
+class IterPackagesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        package = PacmanPackageGenerator()
+        package.name = "foo"
+        package.version = "1.0"
+        package.release = 1
+        self.package = os.path.join(self.tmpdir, "foo-1.0-1-any.pkg.tar.gz")
+        write_tarfile(self.package, [(".PKGINFO", package.as_file().read())])
+        self.database = os.path.join(self.tmpdir, "test.db.tar.gz")
+        write_tarfile(self.database, [
+            ("bar-1.0-1/desc", make_desc("bar", "1.0-1")),
+            ("baz-1.0-1/desc", make_desc("baz", "1.0-1")),
+        ])
+        self.pkgbuild = os.path.join(self.tmpdir, "PKGBUILD")
+        with open(self.pkgbuild, "w") as f:
+            f.write("pkgname=spam\npkgver=1.0\npkgrel=1\n")
+
+    def test_kinds(self):
+        paths = [self.package, self.database, self.pkgbuild]
+        packages = parched.iter_packages(paths)
+        self.assertEqual("foo", next(packages).name)
+        self.assertEqual(["bar", "baz", "spam"], [p.name for p in packages])
+
+    def test_single_source(self):
+        packages = list(parched.iter_packages(self.package,
+                                              metadata_only=True))
+        self.assertEqual(1, len(packages))
+        self.assertEqual(None, packages[0].files)
+        database = parched.RepoDatabase(self.database)
+        self.assertEqual(["bar", "baz"],
+                         [p.name for p in parched.iter_packages(database)])
+
+    def test_kind(self):
+        packages = parched.iter_packages([self.pkgbuild], kind='database')
+        self.assertRaises(tarfile.ReadError, list, packages)
+        packages = parched.iter_packages([self.pkgbuild], kind='spam')
+        self.assertRaises(ValueError, list, packages)
+
+
+class ParseManyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.paths = []
+        for i in range(6):
+            path = os.path.join(self.tmpdir, str(i), "PKGBUILD")
+            os.mkdir(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write("pkgname=pkg%d\npkgver=1.0\npkgrel=1\n" % i)
+            self.paths.append(path)
+        self.broken = os.path.join(self.tmpdir, "broken-1.0-1-any.pkg.tar.gz")
+        with open(self.broken, "w") as f:
+            f.write("not a tarball")
+
+    def test_ordered(self):
+        paths = self.paths[:3] + [self.broken] + self.paths[3:]
+        results = list(parched.parse_many(paths, workers=2, chunksize=1))
+        self.assertEqual(paths, [r.path for r in results])
+        self.assertEqual(None, results[3].package)
+        self.assertTrue(isinstance(results[3].error, tarfile.ReadError))
+        names = [r.package.name for r in results if r.package]
+        self.assertEqual(["pkg%d" % i for i in range(6)], names)
+        self.assertFalse(hasattr(results[0].package, "_symbols"))
+
+    def test_unordered(self):
+        results = parched.parse_many(self.paths, workers=2, ordered=False)
+        names = sorted(r.package.name for r in results)
+        self.assertEqual(["pkg%d" % i for i in range(6)], names)
+
+    def test_single_worker(self):
+        results = list(parched.parse_many(self.paths, workers=1))
+        self.assertEqual("pkg0", results[0].package.name)
+        self.assertEqual(None, results[0].error)
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.pkgbuild = os.path.join(self.tmpdir, "PKGBUILD")
+        self.write_pkgbuild("1.0")
+        self.cache_path = os.path.join(self.tmpdir, "cache.sqlite")
+        self.cache = parched.MetadataCache(self.cache_path)
+        self.addCleanup(self.cache.close)
+
+    def write_pkgbuild(self, version, mtime=None):
+        with open(self.pkgbuild, "w") as f:
+            f.write("pkgname=foo\npkgver=%s\npkgrel=1\n" % version)
+        if mtime is not None:
+            os.utime(self.pkgbuild, (mtime, mtime))
+
+    def test_hit(self):
+        self.assertEqual("1.0", self.cache.parse(self.pkgbuild).version)
+        self.assertEqual("1.0", self.cache.parse(self.pkgbuild).version)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_changed(self):
+        self.write_pkgbuild("1.0", 1000000000)
+        self.cache.parse(self.pkgbuild)
+        self.write_pkgbuild("1.0.1", 1000000000)
+        self.assertEqual("1.0.1", self.cache.parse(self.pkgbuild).version)
+        self.assertEqual((0, 2), (self.cache.hits, self.cache.misses))
+
+    def test_touched(self):
+        self.write_pkgbuild("1.0", 1000000000)
+        self.cache.parse(self.pkgbuild)
+        self.write_pkgbuild("1.0", 1000000100)
+        self.assertEqual("1.0", self.cache.parse(self.pkgbuild).version)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_persistent(self):
+        self.cache.parse(self.pkgbuild)
+        self.cache.close()
+        with parched.MetadataCache(self.cache_path) as cache:
+            self.assertEqual("foo", cache.parse(self.pkgbuild).name)
+            self.assertEqual(1, cache.hits)
+
+    def test_version(self):
+        self.cache.parse(self.pkgbuild)
+        self.cache._db.execute("PRAGMA user_version = %d" %
+                               (parched.MetadataCache._version - 1))
+        self.cache.close()
+        with parched.MetadataCache(self.cache_path) as cache:
+            self.assertEqual(0, len(cache))
+            cache.parse(self.pkgbuild)
+            self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+    def test_prune(self):
+        self.cache.parse(self.pkgbuild)
+        self.assertEqual(0, self.cache.prune())
+        self.assertEqual(1, self.cache.prune(keep=[]))
+        self.cache.parse(self.pkgbuild)
+        os.unlink(self.pkgbuild)
+        self.assertEqual(1, self.cache.prune())
+        self.assertEqual(0, len(self.cache))
+
+
+class DependencyGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.packages = [
+            parched.DatabasePackage(make_desc("glibc", "2.33-4")),
+            parched.DatabasePackage(make_desc(
+                "openssl", "1.1.1-1", depends="glibc")),
+            parched.DatabasePackage(make_desc(
+                "curl", "7.78-1", depends=["openssl", "glibc"])),
+            parched.DatabasePackage(make_desc(
+                "git", "2.33-1", depends="curl", makedepends="python")),
+            parched.DatabasePackage(make_desc(
+                "python", "3.9.7-1", depends=["openssl", "python-pip"])),
+            parched.DatabasePackage(make_desc(
+                "python-pip", "21.2-1", depends="python")),
+        ]
+        self.graph = parched.DependencyGraph(self.packages)
+
+    def names(self, packages):
+        return sorted(package.name for package in packages)
+
+    def test_dependencies(self):
+        self.assertEqual(["curl", "glibc", "openssl", "python", "python-pip"],
+                         self.names(self.graph.dependencies("git")))
+        self.assertEqual([], self.graph.dependencies(self.packages[0]))
+
+    def test_dependents(self):
+        self.assertEqual(["curl", "git", "python", "python-pip"],
+                         self.names(self.graph.dependents("openssl")))
+
+    def test_cycle(self):
+        self.assertEqual(["glibc", "openssl", "python", "python-pip"],
+                         self.names(self.graph.dependencies("python")))
+
+    def test_update(self):
+        self.assertEqual(["git"], self.names(self.graph.dependents("curl")))
+        self.assertEqual(["glibc", "openssl"],
+                         self.names(self.graph.dependencies("curl")))
+        self.graph.update(parched.DatabasePackage(make_desc(
+            "curl", "7.79-1", depends=["libssh2", "glibc"])))
+        self.assertEqual(["glibc"], self.names(self.graph.dependencies("curl")))
+        self.assertEqual(["git", "python", "python-pip"],
+                         self.names(self.graph.dependents("openssl")))
+        self.graph.update(parched.DatabasePackage(make_desc(
+            "libssh2", "1.10-1", depends="openssl")))
+        self.assertEqual(["curl", "git", "libssh2", "python", "python-pip"],
+                         self.names(self.graph.dependents("openssl")))
+        self.assertEqual(7, len(self.graph))
+
+    def test_remove(self):
+        self.graph.dependents("glibc")
+        self.graph.remove("openssl")
+        self.assertEqual(["curl", "git"],
+                         self.names(self.graph.dependents("glibc")))
+        self.assertRaises(KeyError, self.graph.dependents, "openssl")
+
+
+def make_pkgbuild(name, depends=(), makedepends=(), provides=()):
+    """Parse a minimal PKGBUILD"""
+    return parched.PKGBUILD(fileobj=FileMock(
+        "pkgname=%s\npkgver=1.0\npkgrel=1\ndepends=(%s)\n"
+        "makedepends=(%s)\nprovides=(%s)\n" % (
+            name, " ".join(depends), " ".join(makedepends),
+            " ".join(provides))))
+
+
+class BuildOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.pkgbuilds = [
+            make_pkgbuild("app", depends=["libfoo", "sh"]),
+            make_pkgbuild("libfoo", makedepends=["cmake-bin"]),
+            make_pkgbuild("cmake", provides=["cmake-bin"]),
+            make_pkgbuild("libbar", depends=["glibc"]),
+            make_pkgbuild("tool", depends=["libfoo", "libbar"]),
+        ]
+
+    def names(self, packages):
+        return sorted(package.name for package in packages)
+
+    def test_waves(self):
+        waves = parched.BuildOrder(self.pkgbuilds).waves()
+        self.assertEqual([["cmake", "libbar"], ["libfoo"], ["app", "tool"]],
+                         [self.names(wave) for wave in waves])
+
+    def test_queue(self):
+        queue = parched.BuildOrder(self.pkgbuilds).queue()
+        self.assertEqual(5, len(queue))
+        self.assertEqual(["cmake", "libbar"], self.names(queue.ready()))
+        self.assertEqual([], queue.ready())
+        queue.done(self.pkgbuilds[2])
+        self.assertEqual(["libfoo"], self.names(queue.ready()))
+        queue.done(self.pkgbuilds[1])
+        self.assertEqual(["app"], self.names(queue.ready()))
+        queue.done(self.pkgbuilds[0])
+        self.assertEqual(["tool"], self.names(queue.failed("libbar")))
+        self.assertFalse(queue)
+        self.assertEqual([], queue.ready())
+
+    def test_cycles(self):
+        self.pkgbuilds.append(make_pkgbuild("cmake", depends=["app"],
+                                            provides=["cmake-bin"]))
+        order = parched.BuildOrder(self.pkgbuilds[:2] + self.pkgbuilds[3:])
+        self.assertEqual([["app", "cmake", "libfoo"]],
+                         [self.names(cycle) for cycle in order.cycles])
+        self.assertRaises(ValueError, order.waves)
+        self.assertRaises(ValueError, order.queue)
+
+
+class VercmpTest(unittest.TestCase):
+    # Taken from pacman's vercmp test suite
+    cases = [
+        ("1.5.0", "1.5.0", 0),
+        ("1.5.1", "1.5", 1),
+        ("1.5.0-1", "1.5.0-2", -1),
+        ("1.5-2", "1.5.1-1", -1),
+        ("1.5", "1.5-1", 0),
+        ("1.1-1", "1.0", 1),
+        ("1.5b-1", "1.5-1", -1),
+        ("1.5b", "1.5.1", -1),
+        ("1.0a", "1.0alpha", -1),
+        ("1.0alpha", "1.0b", -1),
+        ("1.0beta", "1.0rc", -1),
+        ("1.0rc", "1.0", -1),
+        ("1.5.a", "1.5", 1),
+        ("1.5.1", "1.5.b", 1),
+        ("1.5-1", "1.5.b", -1),
+        ("2.0", "2_0", 0),
+        ("2.0_a", "2_0.a", 0),
+        ("2.0a", "2.0.a", -1),
+        ("2___a", "2_a", 1),
+        ("1:1.0", "0:1.1", 1),
+        ("1:1.0", "2:1.1", -1),
+        ("0:1.0", "1.0", 0),
+        ("1:1.0-1", "0:1.1-1", 1),
+    ]
+
+    def test_vercmp(self):
+        for a, b, expected in self.cases:
+            self.assertEqual(expected, parched.vercmp(a, b), (a, b))
+            self.assertEqual(-expected, parched.vercmp(b, a), (b, a))
+
+    def test_version_key(self):
+        for a, b, expected in self.cases:
+            if ('-' in a) != ('-' in b):
+                # Releases are only compared if both versions have one
+                continue
+            key_a, key_b = parched.version_key(a), parched.version_key(b)
+            self.assertEqual(expected, (key_a > key_b) - (key_a < key_b),
+                             (a, b))
+        versions = ["1.0-1", "1:0.1-1", "1.0rc1-1", "1.0-2", "1.0.1-1"]
+        self.assertEqual(["1.0rc1-1", "1.0-1", "1.0-2", "1.0.1-1", "1:0.1-1"],
+                         sorted(versions, key=parched.version_key))
+
+
+class PKGBUILDTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.tree = parched.PKGBUILDTree(self.root)
+        self.foo = self.write("foo", "1.0")
+        self.bar = self.write("bar", "1.0")
+        os.makedirs(os.path.join(self.root, ".git", "baz"))
+        with open(os.path.join(self.root, ".git", "baz", "PKGBUILD"), "w"):
+            pass
+
+    def write(self, name, version, mtime=None):
+        path = os.path.join(self.root, name, "PKGBUILD")
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("pkgname=%s\npkgver=%s\npkgrel=1\n" % (name, version))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_refresh(self):
+        changes = self.tree.refresh()
+        self.assertEqual(([self.bar, self.foo], [], []), changes)
+        self.assertEqual("foo", self.tree[self.foo].name)
+        self.assertEqual(2, len(self.tree))
+        self.assertEqual(([], [], []), self.tree.refresh())
+
+    def test_changed(self):
+        self.write("foo", "1.0", 1000000000)
+        self.tree.refresh()
+        before = self.tree[self.foo]
+        self.write("foo", "1.0", 1000000100)
+        self.assertEqual(([], [], []), self.tree.refresh())
+        self.assertTrue(before is self.tree[self.foo])
+        self.write("foo", "1.0.1")
+        self.assertEqual(([], [self.foo], []), self.tree.refresh())
+        self.assertEqual("1.0.1", self.tree[self.foo].version)
+
+    def test_removed(self):
+        self.tree.refresh()
+        os.unlink(self.bar)
+        spam = self.write("spam", "2.0")
+        self.assertEqual(([spam], [], [self.bar]), self.tree.refresh())
+        self.assertEqual(sorted([self.foo, spam]), sorted(self.tree))
+
+    def test_removed_during_scan(self):
+        self.tree.refresh()
+        self.write("bar", "1.1")
+        stat = os.stat
+
+        def unlink_after_stat(path):
+            result = stat(path)
+            if path == self.bar:
+                os.unlink(path)
+            return result
+        os.stat = unlink_after_stat
+        try:
+            changes = self.tree.refresh()
+        finally:
+            os.stat = stat
+        self.assertEqual(([], [], [self.bar]), changes)
+        self.assertEqual([self.foo], list(self.tree))
+
+    def test_errors(self):
+        self.tree.refresh()
+        with open(self.foo, "wb") as f:
+            f.write(b"pkgname=\xff\xfe\n")
+        self.assertEqual(([], [], [self.foo]), self.tree.refresh())
+        self.assertTrue(self.foo in self.tree.errors)
+        self.assertEqual(([], [], []), self.tree.refresh())
+        self.write("foo", "1.1")
+        self.assertEqual(([self.foo], [], []), self.tree.refresh())
+        self.assertEqual({}, self.tree.errors)
+
+
+class PackageTableTest(unittest.TestCase):
+    def setUp(self):
+        self.packages = [
+            parched.DatabasePackage(make_desc(
+                "foo", "1.0-1", isize="4096", builddate="1231575886",
+                license=["MIT", "GPL"], depends=["glibc", "bar"])),
+            parched.DatabasePackage(make_desc(
+                "bar", "2.0-1.1", isize="209715200", license="GPL")),
+            parched.DatabasePackage(make_desc(
+                "baz", "3.0-2", isize="314572800", license="BSD",
+                depends="glibc")),
+        ]
+        self.table = parched.PackageTable(self.packages)
+
+    def test_columns(self):
+        self.assertEqual(3, len(self.table))
+        self.assertEqual(["foo", "bar", "baz"], self.table.column("name"))
+        self.assertEqual([1.0, 1.1, 2.0], self.table.column("release"))
+        self.assertEqual([1231575886, 0, 0], self.table.column("builddate"))
+        self.assertEqual([("glibc", "bar"), (), ("glibc",)],
+                         self.table.column("depends"))
+        row = self.table[-1]
+        self.assertEqual("baz", row["name"])
+        self.assertEqual(("BSD",), row["licenses"])
+        self.assertEqual("", row["packager"])
+
+    def test_where(self):
+        big = self.table.where(licenses="GPL", size=lambda s: s > 100 << 20)
+        self.assertEqual(["bar"], big.column("name"))
+        self.assertEqual(["foo", "baz"],
+                         self.table.where(depends="glibc").column("name"))
+        self.assertEqual([], self.table.where(name="spam").column("name"))
+
+    def test_select(self):
+        table = self.table.select("name", "licenses")
+        self.assertEqual(("name", "licenses"), table.columns)
+        table.append(self.packages[0])
+        self.assertEqual(4, len(table))
+        self.assertEqual(3, len(self.table))
+        self.assertEqual(("MIT", "GPL"), table[3]["licenses"])
+
+    def test_unknown_column(self):
+        self.assertRaises(ValueError, parched.PackageTable, columns=["spam"])
+
+    def test_to_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        arrays = self.table.to_numpy(["name", "size", "depends"])
+        self.assertEqual(["foo", "bar", "baz"], list(arrays["name"]))
+        self.assertEqual(2, (arrays["size"] > 100 << 20).sum())
+        self.assertEqual(("glibc",), arrays["depends"][2])
+
+
+class DependencyIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.bash = parched.DatabasePackage(make_desc(
+            "bash", "5.1-1", provides="sh", depends="glibc"))
+        self.dash = parched.DatabasePackage(make_desc(
+            "dash", "0.5-1", provides="sh", conflicts="bash"))
+        self.glibc = parched.DatabasePackage(make_desc("glibc", "2.33-4"))
+        self.foo = parched.DatabasePackage(make_desc(
+            "foo", "1.0-1", depends=["sh", "glibc>=2.10", "spam"],
+            replaces="foo-legacy"))
+        self.index = parched.DependencyIndex(
+            [self.bash, self.dash, self.glibc, self.foo])
+
+    def test_parse_dependency(self):
+        self.assertEqual(("glibc", ">=", "2.10"),
+                         parched.parse_dependency("glibc>=2.10"))
+        self.assertEqual(("foo", "=", "1:1.0-2"),
+                         parched.parse_dependency("foo=1:1.0-2"))
+        self.assertEqual(("bar", None, None),
+                         parched.parse_dependency("bar: for baz support"))
+
+    def test_providers(self):
+        self.assertEqual([self.bash, self.dash], self.index.providers("sh"))
+        self.assertEqual([self.glibc],
+                         self.index.satisfiers("glibc>=2.10"))
+        self.assertEqual([], self.index.providers("spam"))
+
+    def test_versioned(self):
+        self.assertEqual([], self.index.satisfiers("glibc>2.33"))
+        self.assertEqual([self.glibc], self.index.satisfiers("glibc=2.33"))
+        self.assertEqual([], self.index.satisfiers("sh>=1.0"))
+        self.index.add(parched.DatabasePackage(make_desc(
+            "zsh", "5.8-1", provides="sh=5.8")))
+        self.assertEqual(["zsh"],
+                         [p.name for p in self.index.satisfiers("sh>=1.0")])
+
+    def test_dependents(self):
+        self.assertEqual([self.bash, self.foo],
+                         self.index.dependents("glibc"))
+
+    def test_conflicts(self):
+        self.assertEqual([self.dash], self.index.conflicts(self.bash))
+        self.assertEqual([self.bash], self.index.conflicts(self.dash))
+        self.assertEqual([self.foo], self.index.replacements("foo-legacy"))
+
+    def test_unsatisfied(self):
+        self.assertEqual([(self.foo, ("spam", None, None))],
+                         self.index.unsatisfied())
+        self.index.remove(self.glibc)
+        self.assertEqual([], self.index.providers("glibc"))
+        self.assertEqual(3, len(self.index.unsatisfied()))
+
+    def test_unsatisfied_version(self):
+        self.index.add(parched.DatabasePackage(make_desc(
+            "spam", "1.0-1", depends="glibc>=2.40")))
+        self.assertEqual([("spam", ("glibc", ">=", "2.40"))],
+                         [(package.name, dependency) for package, dependency
+                          in self.index.unsatisfied()])
+
+    def test_split_pkgbuild(self):
+        pkgbuild = parched.PKGBUILD(fileobj=FileMock("""
+            pkgname=(spam spam-docs)
+            pkgver=1.0
+            pkgrel=1
+        """))
+        self.index.add(pkgbuild)
+        self.assertEqual([pkgbuild], self.index.providers("spam-docs"))
+        self.assertEqual([], self.index.unsatisfied())
+
+
 class PKGBUILDTest(unittest.TestCase):
     def setUp(self):
         self.package = PKGBUILDGenerator()
@@ -268,19 +1353,21 @@ class PKGBUILDTest(unittest.TestCase):
         self.assertEqual(self.package.release, target.release)
         self.assertEqual(self.package.description, target.description)
         self.assertEqual(self.package.url, target.url)
-        self.assertEqual(self.package.groups, target.groups)
-        self.assertEqual(self.package.licenses, target.licenses)
-        self.assertEqual(self.package.architectures, target.architectures)
-        self.assertEqual(self.package.replaces, target.replaces)
-        self.assertEqual(self.package.conflicts, target.conflicts)
-        self.assertEqual(self.package.provides, target.provides)
-        self.assertEqual(self.package.backup, target.backup)
-        self.assertEqual(self.package.options, target.options)
-        self.assertEqual(self.package.noextract, target.noextract)
-        self.assertEqual(self.package.makedepends, target.makedepends)
-        self.assertEqual(self.package.sources, target.sources)
-        self.assertEqual(self.package.optdepends, target.optdepends)
-        self.assertEqual(self.package.checksums, target.checksums)
+        self.assertEqual(tuple(self.package.groups), target.groups)
+        self.assertEqual(tuple(self.package.licenses), target.licenses)
+        self.assertEqual(tuple(self.package.architectures), target.architectures)
+        self.assertEqual(tuple(self.package.replaces), target.replaces)
+        self.assertEqual(tuple(self.package.conflicts), target.conflicts)
+        self.assertEqual(tuple(self.package.provides), target.provides)
+        self.assertEqual(tuple(self.package.backup), target.backup)
+        self.assertEqual(tuple(self.package.options), target.options)
+        self.assertEqual(tuple(self.package.noextract), target.noextract)
+        self.assertEqual(tuple(self.package.makedepends), target.makedepends)
+        self.assertEqual(tuple(self.package.sources), target.sources)
+        self.assertEqual(tuple(self.package.optdepends), target.optdepends)
+        checksums = dict((k, tuple(v))
+                         for k, v in self.package.checksums.items())
+        self.assertEqual(checksums, target.checksums)
         self.assertEqual(self.package.install, target.install)
 
     def test_multiline(self):
@@ -295,8 +1382,8 @@ class PKGBUILDTest(unittest.TestCase):
                 pan)
         """)
         target = parched.PKGBUILD(fileobj=pkgbuild)
-        self.assertEqual(['foo', 'baz'], target.sources)
-        self.assertEqual(['eggs', 'spam', 'pancakes'], target.depends)
+        self.assertEqual(('foo', 'baz'), target.sources)
+        self.assertEqual(('eggs', 'spam', 'pancakes'), target.depends)
 
     def test_substitution(self):
         self.package.sources = [
@@ -305,10 +1392,10 @@ class PKGBUILDTest(unittest.TestCase):
         ]
         target = parched.PKGBUILD(fileobj=self.package.as_file())
         values = (self.package.url, self.package.name, self.package.version)
-        parsed_sources = [
+        parsed_sources = (
             '%s/files/%s-%s.tar.gz' % values,
             '%s/files/%s_doc-%s.tar.gz' % values,
-        ]
+        )
         self.assertEqual(parsed_sources, target.sources)
 
     def test_non_standard_variable_substitution(self):
@@ -317,7 +1404,62 @@ class PKGBUILDTest(unittest.TestCase):
             sources=($_pkgname.tar.gz)
         """)
         target = parched.PKGBUILD(fileobj=pkgbuild)
-        self.assertEqual(["Foobar.tar.gz"], target.sources)
+        self.assertEqual(("Foobar.tar.gz",), target.sources)
+
+    def test_parameter_expansion(self):
+        pkgbuild = FileMock("""
+            pkgname=foo
+            pkgver=1.2.3
+            _major=${pkgver%%.*}
+            _minor=${pkgver%.*}
+            _patch=${pkgver##*.}
+            _under=${pkgver//./_}
+            _default=${_undefined:-$pkgname}
+            _alternative=${pkgname:+bar}
+            _length=${#pkgver}
+            _substring=${pkgver:2:3}
+            _upper=${pkgname^^}
+            source=("$url/$_minor/${pkgname}-${_under}.tar.gz")
+            url=http://www.test.com
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual("1", target._major)
+        self.assertEqual("1.2", target._minor)
+        self.assertEqual("3", target._patch)
+        self.assertEqual("1_2_3", target._under)
+        self.assertEqual("foo", target._default)
+        self.assertEqual("bar", target._alternative)
+        self.assertEqual("5", target._length)
+        self.assertEqual("2.3", target._substring)
+        self.assertEqual("FOO", target._upper)
+        self.assertEqual(("http://www.test.com/1.2/foo-1_2_3.tar.gz",),
+                         target.sources)
+
+    def test_array_expansion(self):
+        pkgbuild = FileMock("""
+            pkgname=(foo bar)
+            _first=$pkgname
+            _second=${pkgname[1]}
+            provides=("${pkgname[@]}" baz)
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual("foo", target._first)
+        self.assertEqual("bar", target._second)
+        self.assertEqual(("foo", "bar", "baz"), target.provides)
+
+    def test_cycles(self):
+        pkgbuild = FileMock("""
+            pkgname=foo
+            pkgver=$pkgver
+            _a=$_b
+            _b="$_a$pkgname"
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual("", target.version)
+        self.assertEqual("foo", target._b)
+        self.assertEqual("foo", target._a)
+        cycles = sorted(sorted(cycle) for cycle in target.cycles)
+        self.assertEqual([["_a", "_b"], ["pkgver"]], cycles)
 
     def test_skip_function(self):
         pkgbuild = FileMock("""
@@ -329,6 +1471,151 @@ class PKGBUILDTest(unittest.TestCase):
         target = parched.PKGBUILD(fileobj=pkgbuild)
         self.assertEqual("foo", target.name)
 
+    def test_array_comments(self):
+        pkgbuild = FileMock("""
+            depends=('eggs' # eggs aren't optional
+                     "spam and ham"
+                     # pancakes)
+                     bacon)
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual(('eggs', 'spam and ham', 'bacon'), target.depends)
+
+    def test_append(self):
+        pkgbuild = FileMock("""
+            depends=(eggs)
+            [[ $CARCH == x86_64 ]] && depends+=(spam)
+            if true; then
+                depends+=('ham')
+            fi
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual(('eggs', 'spam', 'ham'), target.depends)
+
+    def test_literal_dollar(self):
+        pkgbuild = FileMock("""
+            pkgname=foo
+            _single='$pkgname'
+            _escaped="\\$pkgname \\\\$pkgname"
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual("$pkgname", target._single)
+        self.assertEqual("$pkgname \\foo", target._escaped)
+
+    def test_function_braces(self):
+        pkgbuild = FileMock("""
+            pkgname=foo
+            package() {
+                echo "}" '{'
+                pkgname=bar
+            }
+            pkgver=1.0
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        self.assertEqual("foo", target.name)
+        self.assertEqual("1.0", target.version)
+
+    def test_script(self):
+        script = parched.PKGBUILDScript(fileobj=FileMock("""
+            pkgname=foo
+            pkgver=1.0
+            source=("foo-$pkgver.tar.gz")
+            source_aarch64=("foo-$pkgver-$CARCH.patch")
+            depends=(glibc)
+            depends_x86_64=(lib32-glibc)
+            if [ -n "$DEBUG" ]; then
+                options=(debug)
+            fi
+            build() {
+                make PREFIX=/usr
+            }
+            function package {
+                make DESTDIR="$pkgdir" install
+            }
+        """))
+        self.assertEqual(["build", "package"], list(script.functions))
+        self.assertEqual("make PREFIX=/usr",
+                         script.functions["build"].strip())
+        self.assertEqual('[ -n "$DEBUG" ]', script.commands[1])
+        target = script.evaluate()
+        self.assertEqual(("foo-1.0.tar.gz",), target.sources)
+        target = script.evaluate({"CARCH": "aarch64", "pkgver": "$2.0"})
+        self.assertEqual("$2.0", target.version)
+        self.assertEqual(("foo-$2.0.tar.gz", "foo-$2.0-aarch64.patch"),
+                         target.sources)
+        self.assertEqual(("glibc",), target.depends)
+        target = script.evaluate({"CARCH": "x86_64"})
+        self.assertEqual(("glibc", "lib32-glibc"), target.depends)
+
+    def test_fields(self):
+        text = """
+            pkgname=foo
+            _base=1.0
+            pkgver=$_base.1
+            pkgrel=1
+            pkgdesc="Foo"
+            depends=("libfoo>=$pkgver")
+            build() {
+                make
+            }
+            depends_x86_64=(lib32-foo)
+            package() {
+                make install
+            }
+        """
+        fields = ('name', 'version', 'depends')
+        target = parched.PKGBUILD(fileobj=FileMock(text), fields=fields)
+        self.assertEqual("foo", target.name)
+        self.assertEqual("1.0.1", target.version)
+        self.assertEqual(("libfoo>=1.0.1",), target.depends)
+        self.assertEqual("", target.description)
+        self.assertEqual("", target.release)
+        self.assertFalse(hasattr(target, "_base"))
+        # Scanning stops after the last assignment of a needed variable
+        script = parched.PKGBUILDScript(fileobj=FileMock(text), fields=fields)
+        self.assertEqual(["build"], list(script.functions))
+        target = script.evaluate({"CARCH": "x86_64"})
+        self.assertEqual(("libfoo>=1.0.1", "lib32-foo"), target.depends)
+        script = parched.PKGBUILDScript(fileobj=FileMock(text),
+                                        fields=('pkgrel',))
+        self.assertEqual([], list(script.functions))
+        self.assertEqual(["pkgname", "_base", "pkgver", "pkgrel"],
+                         [assignment[0] for assignment in script.assignments])
+        target = parched.PKGBUILD(fileobj=FileMock(text + "pkgrel+=.1\n"),
+                                  fields=('release',))
+        self.assertEqual(1.1, target.release)
+
+    def test_verify_sources(self):
+        srcdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, srcdir)
+        for name, content in [("foo.tar.gz", b"foo"), ("bar.patch", b"bar")]:
+            with open(os.path.join(srcdir, name), "wb") as f:
+                f.write(content)
+        pkgbuild = FileMock("""
+            source=(foo.tar.gz::https://example.com/foo-1.0.tar.gz
+                    https://example.com/bar.patch
+                    git+https://example.com/baz.git#tag=v1
+                    missing.txt)
+            md5sums=(acbd18db4cc2f85cedef654fccc4a4d8
+                     37b51d194a7513e45b56f6524f2d51f2
+                     SKIP
+                     d41d8cd98f00b204e9800998ecf8427e)
+            sha256sums=(2C26B46B68FFC68FF99B453C1D30413413422D706483BFA0F98A5E886266E7AE
+                        0000000000000000000000000000000000000000000000000000000000000000
+                        SKIP
+                        SKIP)
+        """)
+        target = parched.PKGBUILD(fileobj=pkgbuild)
+        for workers in (1, 4):
+            foo, bar, baz, missing = target.verify_sources(srcdir, workers)
+            self.assertEqual(os.path.join(srcdir, "foo.tar.gz"), foo.path)
+            self.assertEqual((True, ()), (foo.ok, foo.mismatches))
+            self.assertEqual((False, ("sha256",)), (bar.ok, bar.mismatches))
+            self.assertEqual(os.path.join(srcdir, "baz"), baz.path)
+            self.assertEqual(None, baz.ok)
+            self.assertEqual(False, missing.ok)
+            self.assertTrue(isinstance(missing.error, (IOError, OSError)))
+
     def test_quoted_value(self):
         """Right-hand side of assignment in quotes is parsed correctly."""
         self.package.description = "Someone's package"
@@ -341,5 +1628,124 @@ class PKGBUILDTest(unittest.TestCase):
         self.assertEqual(self.package.url.strip("'"), target.url)
 
 
+SRCINFO_SPLIT = """\
+# Generated by makepkg
+pkgbase = pyfoo
+\tpkgdesc = Foo bindings
+\tpkgver = 1.2
+\tpkgrel = 3
+\tarch = x86_64
+\tarch = i686
+\tlicense = MIT
+\tdepends = python
+\tsource = foo-1.2.tar.gz
+\tmd5sums = 6caefe06c7a0fc9a5e03497c7106cc56
+\tdepends_x86_64 = lib64
+\tsource_i686 = foo32.patch
+\tmd5sums_i686 = 4c593db82677c01e7fbe9febf0b95475
+
+pkgname = python-foo
+
+pkgname = python-foo-docs
+\tpkgdesc = Foo documentation
+\tarch = any
+\tdepends = 
+"""
+
+
+class SRCINFOTest(unittest.TestCase):
+    setUp = PKGBUILDTest.__dict__['setUp']
+
+    def test_round_trip(self):
+        pkgbuild = parched.PKGBUILD(fileobj=self.package.as_file())
+        text = pkgbuild.to_srcinfo()
+        self.assertTrue(text.startswith("pkgbase = test\n\tpkgdesc = "))
+        self.assertTrue("\n\tmd5sums = 6caefe06c7a0fc9a5e03497c7106cc56\n"
+                        in text)
+        self.assertTrue(text.endswith("\npkgname = test\n"))
+        target = parched.SRCINFO(fileobj=FileMock(text))
+        for attribute in ('name', 'version', 'release', 'description', 'url',
+                          'install', 'architectures', 'licenses', 'groups',
+                          'depends', 'makedepends', 'optdepends', 'provides',
+                          'conflicts', 'replaces', 'backup', 'options',
+                          'noextract', 'sources', 'checksums'):
+            self.assertEqual(getattr(pkgbuild, attribute),
+                             getattr(target, attribute), attribute)
+        self.assertEqual(text, target.to_srcinfo())
+
+    def test_split(self):
+        target = parched.SRCINFO(fileobj=FileMock(SRCINFO_SPLIT))
+        self.assertEqual(('python-foo', 'python-foo-docs'), target.name)
+        self.assertEqual(1.2, float(target.version))
+        self.assertEqual(3.0, target.release)
+        self.assertEqual(('python',), target.depends)
+        self.assertEqual(['python-foo', 'python-foo-docs'],
+                         list(target.packages))
+        foo = target.packages['python-foo']
+        self.assertEqual("python-foo", foo.name)
+        self.assertEqual("Foo bindings", foo.description)
+        self.assertEqual(('python',), foo.depends)
+        docs = target.packages['python-foo-docs']
+        self.assertEqual("Foo documentation", docs.description)
+        self.assertEqual(('any',), docs.architectures)
+        self.assertEqual((), docs.depends)
+        self.assertEqual(('MIT',), docs.licenses)
+        self.assertEqual(SRCINFO_SPLIT.split("\n", 1)[1],
+                         target.to_srcinfo())
+
+    def test_carch(self):
+        target = parched.SRCINFO(fileobj=FileMock(SRCINFO_SPLIT),
+                                 overrides={'CARCH': 'i686'})
+        self.assertEqual(('python',), target.depends)
+        self.assertEqual(('foo-1.2.tar.gz', 'foo32.patch'), target.sources)
+        self.assertEqual(('6caefe06c7a0fc9a5e03497c7106cc56',
+                          '4c593db82677c01e7fbe9febf0b95475'),
+                         target.checksums['md5'])
+        target = parched.SRCINFO(fileobj=FileMock(SRCINFO_SPLIT),
+                                 overrides={'CARCH': 'x86_64'})
+        self.assertEqual(('python', 'lib64'), target.depends)
+        self.assertEqual(('python', 'lib64'),
+                         target.packages['python-foo'].depends)
+        self.assertEqual((), target.packages['python-foo-docs'].depends)
+
+    def test_fields(self):
+        target = parched.SRCINFO(fileobj=FileMock(SRCINFO_SPLIT),
+                                 fields=['depends'])
+        self.assertEqual(('python',), target.depends)
+        self.assertEqual((), target.sources)
+
+    def test_snapshot(self):
+        target = parched.SRCINFO(fileobj=FileMock(SRCINFO_SPLIT))
+        copy = parched.Package.from_dict(target.to_dict())
+        self.assertEqual(['python-foo', 'python-foo-docs'],
+                         list(copy.packages))
+        for binary in (False, True):
+            buf = io.BytesIO()
+            parched.dump_packages([target], buf, binary=binary)
+            buf.seek(0)
+            copy, = parched.load_packages(buf)
+            self.assertTrue(isinstance(copy, parched.SRCINFO))
+            self.assertEqual(['python-foo', 'python-foo-docs'],
+                             list(copy.packages))
+            docs = copy.packages['python-foo-docs']
+            self.assertTrue(isinstance(docs, parched.SRCINFO))
+            self.assertEqual("Foo documentation", docs.description)
+            self.assertEqual((), docs.depends)
+            self.assertEqual(('MIT',), docs.licenses)
+            self.assertEqual(target.to_srcinfo(), copy.to_srcinfo())
+
+    def test_guess_kind(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, ".SRCINFO")
+        with open(path, "w") as f:
+            f.write(SRCINFO_SPLIT)
+        self.assertEqual('srcinfo', parched._guess_kind(path))
+        packages = list(parched.iter_packages([path]))
+        self.assertEqual(1, len(packages))
+        self.assertTrue(isinstance(packages[0], parched.SRCINFO))
+        self.assertEqual(('MIT',), packages[0].licenses)
+
+
 if __name__ == "__main__":
     unittest.main()